@@ -1,22 +1,202 @@
 # wikidata_bot.py
 import re
+from enum import Enum
+from typing import Iterable, NamedTuple
 
 import pywikibot
 from pywikibot import ItemPage
+from pywikibot.data.sparql import SparqlQuery
 from pywikibot.pagegenerators import WikidataSPARQLPageGenerator
 
+import timing
+from entity_cache import EntityCache
+from wikidata_index import WikidataIndex
+
 # --- Wikidata properties ---
 IS_INSTANCE_OF = "P31"
 IS_DISAMBIGUATION = "Q4167410"
 COORDINATES = "P625"
 
+# --- Wikibase API limits ---
+ENTITIES_BATCH_SIZE = 50  # max ids per wbgetentities request for non-bot users
+SPARQL_VALUES_BATCH_SIZE = 200  # names per VALUES block, keeps the query url short
+
+
+class SitelinkResolvers(Enum):
+    SPARQL = "sparql"  # query service, one VALUES query per batch of names
+    API = "api"  # wbgetentities with sites/titles, SPARQL only for the misses
+
+
+class SitelinkMatch(NamedTuple):
+    """Result of the bulk resolution of a wikipedia article name"""
+
+    qid: str | None  # None if zero or multiple items were found
+    is_disambiguation: bool = False
+
 
 class WikibaseHelper:
-    def __init__(self):
+    def __init__(
+        self,
+        cache: EntityCache | None = None,
+        resolver: str = SitelinkResolvers.SPARQL.value,
+        index: WikidataIndex | None = None,
+    ):
+        """
+        :param cache: optional persistent cache, checked before downloading entities
+        :param index: optional local index built from a dump, checked before the cache
+        :param resolver: how to resolve wikipedia article names, see ``SitelinkResolvers``
+        """
         self.site = pywikibot.Site().data_repository()
+        self.cache = cache
+        self.index = index
+        self.resolver = SitelinkResolvers(resolver)
+        # Entities loaded so far, keyed by QID
+        self._entities: dict[str, ItemPage] = {}
+        self._sparql: SparqlQuery | None = None
+
+    def prefetch(self, qids: Iterable[str]) -> None:
+        """
+        Load the given wikidata items in batches of ``ENTITIES_BATCH_SIZE``, one
+        ``wbgetentities`` request per batch. Items that are already loaded are skipped.
+        After this call the accessors of this class answer from the loaded set.
+        :param qids: the ids of the wikidata items to load (e.g. ["Q220", "Q90"])
+        :return: None
+        """
+        missing = [
+            qid for qid in dict.fromkeys(qids) if qid and qid not in self._entities
+        ]
+        if self.index is not None:
+            missing = self._load_from_index(missing)
+        if self.cache is not None:
+            missing = self._load_from_cache(missing)
+
+        fetched = {}
+        for batch in self._batches(missing):
+            data = self._get_entities(ids=batch)
+            for qid, content in data["entities"].items():
+                if "missing" in content:
+                    continue
+                self._remember_entity(qid, content)
+                fetched[qid] = content
+
+        if self.cache is not None and fetched:
+            self.cache.put_many(fetched)
+
+    def _load_from_index(self, qids: list[str]) -> list[str]:
+        """
+        Load the given entities from the local dump index, without any request
+        :param qids: the ids of the entities to load
+        :return: the ids not found in the index
+        """
+        for qid in qids:
+            content = self.index.get_entity(qid)
+            if content is not None:
+                self._remember_entity(qid, content)
+        return [qid for qid in qids if qid not in self._entities]
+
+    def _load_from_cache(self, qids: list[str]) -> list[str]:
+        """
+        Load the given entities from the persistent cache. Stale entries are kept if
+        their ``lastrevid`` is still the current one, checked in batches with a
+        ``props=info`` request (no claims are downloaded).
+        :param qids: the ids of the entities to load
+        :return: the ids that still need to be downloaded
+        """
+        fresh, stale = self.cache.lookup(qids)
+        for qid, content in fresh.items():
+            self._remember_entity(qid, content)
+
+        unchanged = []
+        for batch in self._batches(list(stale)):
+            data = self._get_entities(ids=batch, props="info")
+            for qid, info in data["entities"].items():
+                if qid in stale and info.get("lastrevid") == stale[qid].get(
+                    "lastrevid"
+                ):
+                    self._remember_entity(qid, stale[qid])
+                    unchanged.append(qid)
+        self.cache.touch(unchanged)
+
+        return [qid for qid in qids if qid not in self._entities]
+
+    def report(self) -> None:
+        """
+        Print the usage of the persistent cache, if any. Meant to be called at teardown.
+        :return: None
+        """
+        if self.cache is not None:
+            pywikibot.output(self.cache.stats())
+
+    def close(self) -> None:
+        """
+        Close the persistent cache and the local index, if any
+        :return: None
+        """
+        if self.cache is not None:
+            self.cache.close()
+        if self.index is not None:
+            self.index.close()
+
+    @staticmethod
+    def _batches(qids: list[str]) -> Iterable[list[str]]:
+        for start in range(0, len(qids), ENTITIES_BATCH_SIZE):
+            yield qids[start : start + ENTITIES_BATCH_SIZE]
+
+    @timing.timed("wikidata.wbgetentities")
+    def _get_entities(self, **params) -> dict:
+        request = self.site.simple_request(action="wbgetentities", **params)
+        return request.submit()
+
+    def get_many(self, qids: Iterable[str]) -> dict[str, ItemPage]:
+        """
+        Get the wikidata items for the given ids, loading the missing ones in batches
+        :param qids: the ids of the wikidata items
+        :return: a dictionary QID -> ItemPage (missing items are left out)
+        """
+        qids = list(dict.fromkeys(qids))
+        self.prefetch(qids)
+        return {qid: self._entities[qid] for qid in qids if qid in self._entities}
+
+    def _remember_entity(self, qid: str, content: dict) -> ItemPage:
+        """
+        Build an ItemPage from the raw entity json returned by the API and keep it in
+        the loaded set, under the requested id and under the id of the entity itself
+        (they differ when the requested item is a redirect)
+        """
+        item = ItemPage(self.site, content["id"])
+        # No api call is made because item._content is given
+        item._content = content
+        item.get()
+        self._entities[qid] = item
+        self._entities[content["id"]] = item
+        return item
+
+    def _get_item(self, wikidata_entity: str | ItemPage) -> ItemPage:
+        """
+        Get a loaded ItemPage for the given id or item, loading it if needed
+        :param wikidata_entity: the wikidata id (e.g. "Q220") or an ItemPage
+        :return: the ItemPage with its content loaded
+        """
+        qid = (
+            wikidata_entity
+            if isinstance(wikidata_entity, str)
+            else wikidata_entity.getID()
+        )
+        if qid not in self._entities and hasattr(wikidata_entity, "_content"):
+            # already loaded by the caller, e.g. with page.data_item()
+            self._entities[qid] = wikidata_entity
+        if qid not in self._entities:
+            self.prefetch([qid])
+        if qid not in self._entities:
+            # Not found in batch: let pywikibot raise the usual error
+            item = pywikibot.ItemPage(site=self.site, title=qid)
+            with timing.span("wikidata.item"):
+                item.get()
+            return item
+        return self._entities[qid]
 
     def get_p_values(self, wikidata_item: ItemPage, p: str):
-        item_dict = wikidata_item.get()
+        item_dict = self._get_item(wikidata_item).get()
         claims = item_dict["claims"]
         if p in claims:
             return [claim.getTarget().title() for claim in claims[p]]
@@ -28,8 +208,7 @@ class WikibaseHelper:
         :param wikidata_item:
         :return:
         """
-        item = pywikibot.ItemPage(site=self.site, title=wikidata_item)
-        item_dict = item.get()
+        item_dict = self._get_item(wikidata_item).get()
         claims = item_dict["claims"]
         if IS_INSTANCE_OF in claims:
             for claim in claims[IS_INSTANCE_OF]:
@@ -42,7 +221,7 @@ class WikibaseHelper:
         return tuple(format(x, ".6g") for x in coords)
 
     def get_coords(self, wikidata_entity: ItemPage):
-        item_dict = wikidata_entity.get()
+        item_dict = self._get_item(wikidata_entity).get()
         claims = item_dict["claims"]
         coords = {"lat": None, "long": None}
         if COORDINATES in claims:
@@ -58,8 +237,7 @@ class WikibaseHelper:
         :param wikidata_label:
         :return:
         """
-        item = pywikibot.ItemPage(site=self.site, title=wikidata_label)
-        item_dict = item.get()
+        item_dict = self._get_item(wikidata_label).get()
         claims = item_dict["claims"]
         coords = (None, None)
         if COORDINATES in claims:
@@ -94,6 +272,25 @@ class WikibaseHelper:
     def get_wikidata_entity_by_wikipedia_article_name(
         self, article_name: str, alt: str, lang="it"
     ) -> str:
+        if self.resolver == SitelinkResolvers.API:
+            matches = self.resolve_article_names([(article_name, alt)], lang)
+            return self.finalize_sitelink_match(matches[article_name], article_name)
+
+        wikidata_item = self.find_wikidata_candidate(article_name, alt, lang)
+        return self.finalize_wikidata_item(wikidata_item, article_name)
+
+    def find_wikidata_candidate(
+        self, article_name: str, alt: str, lang="it"
+    ) -> str | None:
+        """
+        Look up the wikidata item linked to the wikipedia article with the given name,
+        without checking it. Pass the result to ``finalize_wikidata_item`` once the
+        candidates of a page have been loaded with ``prefetch``.
+        :param article_name: the name of the article
+        :param alt: alternative name, tried in English as last resort
+        :param lang: the language of the wikipedia to search first
+        :return: the wikidata id or None
+        """
         # Try languages in the given order until we find one
         for attempted_lang in [lang, "en"]:
             wikidata_item = self.try_entity_retrieval(article_name, attempted_lang)
@@ -102,7 +299,233 @@ class WikibaseHelper:
         # Lastly, try alt name in English if entity is still not found
         if not wikidata_item:
             wikidata_item = self.try_entity_retrieval(alt, "en")
-        return self.finalize_wikidata_item(wikidata_item, article_name)
+        return wikidata_item
+
+    def resolve_article_names(
+        self, names: Iterable[tuple[str, str]], lang="it"
+    ) -> dict[str, SitelinkMatch]:
+        """
+        Bulk version of ``get_wikidata_entity_by_wikipedia_article_name``: resolves all
+        the given names with a few ``VALUES``-batched SPARQL queries, trying the names in
+        ``lang`` first, then in English, then the alt names in English.
+        Each query also returns whether the item is a disambiguation page (P31), so no
+        entity needs to be fetched.
+        With the ``api`` resolver the names are looked up with ``wbgetentities`` first,
+        and only the misses go to the query service.
+        :param names: pairs (article name, alt name), e.g. the ``nome``/``alt`` params
+                      of the Itemlist entries of a page
+        :param lang: the language of the wikipedia to search first
+        :return: a dictionary article name -> SitelinkMatch
+        """
+        names = dict(names)  # article name -> alt name, without duplicates
+        matches = {name: SitelinkMatch(None) for name in names}
+
+        for attempted_lang in [lang, "en"]:
+            pending = [name for name, match in matches.items() if not match.qid]
+            found = self._lookup_sitelinks(pending, attempted_lang)
+            matches.update(found)
+
+        # Lastly, try alt name in English if entity is still not found
+        pending_alts = {}  # alt name -> article names
+        for name, match in matches.items():
+            if not match.qid and names[name]:
+                pending_alts.setdefault(names[name], []).append(name)
+        found = self._lookup_sitelinks(list(pending_alts), "en")
+        for alt, match in found.items():
+            for name in pending_alts[alt]:
+                matches[name] = match
+
+        return matches
+
+    def finalize_sitelink_match(self, match: SitelinkMatch, article_name: str) -> str:
+        """
+        Same as ``finalize_wikidata_item`` for the results of ``resolve_article_names``
+        :param match: the match found for the article
+        :param article_name: the name of the article, for logging
+        :return: the wikidata id, or an empty string
+        """
+        if match.qid and match.is_disambiguation:
+            self.write_log_line(
+                f"Wikidata item for {article_name} is a disambiguation page\n"
+            )
+            return ""
+        if not match.qid:
+            print(
+                f"\t\tCould not find wikidata item for {article_name} -- keeping empty"
+            )
+            return ""
+        return match.qid
+
+    def _lookup_sitelinks(
+        self, article_names: list[str], lang: str
+    ) -> dict[str, SitelinkMatch]:
+        """
+        Look up the items linked to the given articles with the selected resolver
+        """
+        if self.resolver == SitelinkResolvers.SPARQL:
+            return self._query_sitelinks(article_names, lang)
+
+        found = self._get_sitelinks(article_names, lang)
+        misses = [name for name in article_names if name not in found]
+        if misses:
+            found.update(self._query_sitelinks(misses, lang))
+        return found
+
+    def _get_sitelinks(
+        self, article_names: list[str], lang: str
+    ) -> dict[str, SitelinkMatch]:
+        """
+        Look up the items linked to the given articles of the {lang} wikipedia with
+        ``wbgetentities?sites=...&titles=...``, 50 titles per request.
+        Titles are normalized locally (the API only normalizes single titles); the titles
+        not found are checked for redirects on the wikipedia and retried with the target.
+        The entities found are kept in the loaded set, so they don't need to be fetched again.
+        :param article_names: the article names as found in the wikitext
+        :param lang: the wikipedia language
+        :return: a dictionary article name -> SitelinkMatch for the names found
+        """
+        titles = {}  # normalized title -> article names
+        for name in article_names:
+            title = self._normalize_title(self._clean_city_name(name))
+            if title:
+                titles.setdefault(title, []).append(name)
+
+        found = self._get_entities_by_titles(list(titles), lang)
+
+        missing = [title for title in titles if title not in found]
+        redirects = self._get_redirect_targets(missing, lang)
+        redirect_found = self._get_entities_by_titles(
+            list(dict.fromkeys(redirects.values())), lang
+        )
+        for title, target in redirects.items():
+            if target in redirect_found:
+                found[title] = redirect_found[target]
+
+        matches = {}
+        for title, match in found.items():
+            for article_name in titles[title]:
+                matches[article_name] = match
+        return matches
+
+    def _get_entities_by_titles(
+        self, titles: list[str], lang: str
+    ) -> dict[str, SitelinkMatch]:
+        """
+        :return: a dictionary title -> SitelinkMatch for the titles linked to an item
+        """
+        site_id = f"{lang}wiki"
+        found = {}
+        fetched = {}
+        for batch in self._batches(titles):
+            data = self._get_entities(sites=site_id, titles=batch)
+            for qid, content in data["entities"].items():
+                if "missing" in content:
+                    continue
+                self._remember_entity(qid, content)
+                fetched[qid] = content
+                title = content["sitelinks"][site_id]["title"]
+                found[title] = SitelinkMatch(
+                    qid, self._is_disambiguation_content(content)
+                )
+
+        if self.cache is not None and fetched:
+            self.cache.put_many(fetched)
+        return found
+
+    def _get_redirect_targets(self, titles: list[str], lang: str) -> dict[str, str]:
+        """
+        Follow the redirects of the given {lang} wikipedia articles
+        :return: a dictionary title -> target title, only for redirects
+        """
+        if not titles:
+            return {}
+        client_site = pywikibot.Site(lang, "wikipedia")
+        targets = {}
+        for batch in self._batches(titles):
+            request = client_site.simple_request(
+                action="query", titles=batch, redirects=True
+            )
+            with timing.span("wikipedia.redirects"):
+                data = request.submit().get("query", {})
+            normalized = {n["from"]: n["to"] for n in data.get("normalized", [])}
+            redirects = {r["from"]: r["to"] for r in data.get("redirects", [])}
+            for title in batch:
+                target = redirects.get(normalized.get(title, title))
+                if target:
+                    targets[title] = target
+        return targets
+
+    @staticmethod
+    def _normalize_title(title: str) -> str:
+        """
+        Normalize a page title the way MediaWiki does: underscores and repeated spaces
+        become one space, the first letter is uppercase
+        """
+        title = re.sub(r"[_\s]+", " ", title).strip()
+        return title[:1].upper() + title[1:]
+
+    @staticmethod
+    def _is_disambiguation_content(content: dict) -> bool:
+        for claim in content.get("claims", {}).get(IS_INSTANCE_OF, []):
+            value = claim["mainsnak"].get("datavalue", {}).get("value", {})
+            if value.get("id") == IS_DISAMBIGUATION:
+                return True
+        return False
+
+    def _query_sitelinks(
+        self, article_names: list[str], lang: str
+    ) -> dict[str, SitelinkMatch]:
+        """
+        Look up the items linked to the given articles of the {lang} wikipedia.
+        Raw SPARQL bindings are used, no ItemPage is built.
+        :param article_names: the article names as found in the wikitext
+        :param lang: the wikipedia language
+        :return: a dictionary article name -> SitelinkMatch, only for the names
+                 linked to exactly one item
+        """
+        cleaned = {}  # cleaned name -> article names
+        for name in article_names:
+            cleaned.setdefault(self._clean_city_name(name), []).append(name)
+        cleaned.pop("", None)
+
+        items = {}  # cleaned name -> {item: is_disambiguation}
+        cleaned_names = list(cleaned)
+        for start in range(0, len(cleaned_names), SPARQL_VALUES_BATCH_SIZE):
+            batch = cleaned_names[start : start + SPARQL_VALUES_BATCH_SIZE]
+            values = " ".join(f"{self._sparql_string(name)}@{lang}" for name in batch)
+            query = f"""
+            SELECT ?name ?item ?disambiguation WHERE {{
+              VALUES ?name {{ {values} }}
+              ?sitelink schema:about ?item;
+                schema:isPartOf <https://{lang}.wikipedia.org/>;
+                schema:name ?name.
+              BIND(EXISTS {{ ?item wdt:{IS_INSTANCE_OF} wd:{IS_DISAMBIGUATION} }} AS ?disambiguation)
+            }}"""
+            with timing.span("wikidata.sparql"):
+                rows = self._get_sparql().select(query) or []
+            for row in rows:
+                qid = row["item"].rsplit("/", 1)[-1]
+                items.setdefault(row["name"], {})[qid] = row["disambiguation"] == "true"
+
+        matches = {}
+        for name, found in items.items():
+            if len(found) != 1:
+                print(f"\tFound multiple wikidata item for {name} -- skipping")
+                continue
+            ((qid, is_disambiguation),) = found.items()
+            for article_name in cleaned.get(name, []):
+                matches[article_name] = SitelinkMatch(qid, is_disambiguation)
+        return matches
+
+    @staticmethod
+    def _sparql_string(text: str) -> str:
+        escaped = text.replace("\\", "\\\\").replace('"', '\\"')
+        return f'"{escaped}"'
+
+    def _get_sparql(self) -> SparqlQuery:
+        if self._sparql is None:
+            self._sparql = SparqlQuery(repo=self.site)
+        return self._sparql
 
     def try_entity_retrieval(self, article_name, lang) -> str | None:
         item: str | None = self.run_query_for_label(
@@ -160,7 +583,8 @@ class WikibaseHelper:
         )
         # make sure that the generator is not empty and is of length 1
         # (otherwise we have a problem)
-        pages = list(gen)
+        with timing.span("wikidata.sparql"):
+            pages = list(gen)
 
         if limit == 1:
             if len(pages) != 1:
@@ -175,10 +599,11 @@ class WikibaseHelper:
     def get_iso_3166_1_from_city(self, city_entity):
         # Get the country of the city (P17)
         country = self.get_country_from_city(city_entity)
+        return self.get_iso_3166_1_from_country(country)
 
+    def get_iso_3166_1_from_country(self, country):
         # Get the iso 3166-1 code of the country (P297)
-        item = pywikibot.ItemPage(site=self.site, title=country)
-        item_dict = item.get()
+        item_dict = self._get_item(country).get()
         claims = item_dict["claims"]
         if "P297" in claims:
             for claim in claims["P297"]:
@@ -205,7 +630,7 @@ class WikibaseHelper:
         :param wikidata_entity:
         :return:
         """
-        item_dict = wikidata_entity.get()
+        item_dict = self._get_item(wikidata_entity).get()
         claims = item_dict["claims"]
         if "P18" in claims:
             for claim in claims["P18"]:
@@ -218,7 +643,7 @@ class WikibaseHelper:
         :param wikidata_entity:
         :return:
         """
-        item_dict = wikidata_entity.get()
+        item_dict = self._get_item(wikidata_entity).get()
         claims = item_dict["claims"]
         if "P948" in claims:
             for claim in claims["P948"]:
@@ -231,11 +656,11 @@ class WikibaseHelper:
         :param wikidata_entity:
         :return:
         """
-        item_dict = wikidata_entity.get()
+        item_dict = self._get_item(wikidata_entity).get()
         claims = item_dict["claims"]
         if "P131" in claims:
             for claim in claims["P131"]:
-                entity = claim.getTarget()
+                entity = self._get_item(claim.getTarget())
                 label = (
                     entity.labels["it"]
                     if "it" in entity.labels
@@ -250,7 +675,7 @@ class WikibaseHelper:
         :param city_entity:
         :return:
         """
-        item_dict = city_entity.get()
+        item_dict = self._get_item(city_entity).get()
         claims = item_dict["claims"]
         if "P17" in claims:
             for claim in claims["P17"]:
@@ -263,7 +688,7 @@ class WikibaseHelper:
         :param wikidata_entity:
         :return:
         """
-        item_dict = wikidata_entity.get()
+        item_dict = self._get_item(wikidata_entity).get()
         claims = item_dict["claims"]
         if "P948" in claims:
             for claim in claims["P948"]:
@@ -276,7 +701,7 @@ class WikibaseHelper:
         :param wikidata_entity:
         :return:
         """
-        item_dict = wikidata_entity.get()
+        item_dict = self._get_item(wikidata_entity).get()
         claims = item_dict["claims"]
         if "P18" in claims:
             for claim in claims["P18"]:
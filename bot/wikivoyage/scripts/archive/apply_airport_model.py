@@ -9,16 +9,17 @@ from mwparserfromhell.wikicode import Wikicode
 from pywikibot.bot import ExistingPageBot
 from wikitextparser import ExternalLink
 
+import timing
 from WikibaseHelper import WikibaseHelper
 from voy_aux import (
     format_template_params,
-    terminate_before_section_level_two,
-    format_section_titles,
+    format_sections,
     add_quickbar_image,
     add_banner_image,
     add_mappa_dinamica,
 )
 from pwb_aux import setup_generator
+from review_bundle import ReviewBundle, get_review_opts
 
 # --- it.wikivoyage specific constants ---
 SOURCE_CATEGORY = "Tematica Aeroporto"
@@ -40,12 +41,18 @@ SECTIONS_WITH_LISTINGS = [
 
 class AirportModelApplier(ExistingPageBot):
 
-    def __init__(self, **kwargs):
+    def __init__(self, custom_opts=None, **kwargs):
         super().__init__(**kwargs)
         self.wikibase_helper = WikibaseHelper()
         self.matched_pages = []
         self.wikibase_item = None  # type: pywikibot.ItemPage | None
 
+        # Write the edits to a review bundle instead of asking, see review_bundle
+        self.plan = None
+        if custom_opts and "plan" in custom_opts:
+            self.plan = ReviewBundle(custom_opts["plan"])
+            self.plan.start()
+
     @property
     def edit_opts(self):
         """
@@ -81,8 +88,10 @@ class AirportModelApplier(ExistingPageBot):
             return
 
         # Get and parse the page wikicode
-        content = self.current_page.text
-        wikicode: Wikicode = mwparserfromhell.parse(content)
+        with timing.span("fetch.text"):
+            content = self.current_page.text
+        with timing.span("parse"):
+            wikicode: Wikicode = mwparserfromhell.parse(content)
 
         self.check_sections(wikicode)
 
@@ -115,23 +124,33 @@ class AirportModelApplier(ExistingPageBot):
         # Add dynamic map
         self.add_dynamic_map(wikicode)
 
-        wikicode_str = format_template_params(str(wikicode))
-        wikicode_str = terminate_before_section_level_two(wikicode_str)
-        # wikicode_str = format_section_begin(wikicode_str)
-        wikicode_str = format_section_titles(wikicode_str)
+        with timing.span("format"):
+            wikicode_str = format_template_params(str(wikicode))
+            # add blank_line_after_heading=True to also format the section begin
+            wikicode_str = format_sections(
+                wikicode_str, normalize_titles=True, terminate_level_two=True
+            )
 
         # Save the page
         self.matched_pages.append(self.current_page.title())
 
+        if self.plan is not None:
+            if wikicode_str != content:
+                self.plan.propose(self.current_page, wikicode_str, **self.edit_opts)
+            return
+
         pywikibot.showDiff(content, wikicode_str)
         with open(f"output/wikitext_{self.current_page.title()}.txt", "w") as p:
             p.write(wikicode_str)
             p.close()
 
-            shall_be_saved = self.user_confirm("Do you want to save the page?")
+            # time spent by the operator
+            with timing.span("confirm"):
+                shall_be_saved = self.user_confirm("Do you want to save the page?")
             if shall_be_saved:
                 self.current_page.text = wikicode_str
-                self.current_page.save(**self.edit_opts)
+                with timing.span("save"):
+                    self.current_page.save(**self.edit_opts)
 
     def remove_IATA(self, wikicode: Wikicode):
         # ({{IATA|XXX}}) -> ""
@@ -496,11 +515,17 @@ class AirportModelApplier(ExistingPageBot):
         Print the list of pages that were matched and updated.
         :return: None
         """
+        if self.plan is not None:
+            pywikibot.output(
+                f"{self.plan.proposed} edits written to {self.plan.path}, review them with "
+                f"`pwb review_bundle -bundle:{self.plan.path}`"
+            )
         pywikibot.output(f"Found {len(self.matched_pages)} pages that were updated:")
         with open("logs/airport_model_applier.log", "a") as f:
             f.write("Found {len(self.matched_pages)} pages that were updated:\n")
             for page in self.matched_pages:
                 f.write(f"* {page} \n")
+        timing.report()
 
 
 def prepare_generator_args() -> list[str]:
@@ -521,9 +546,12 @@ def prepare_generator_args() -> list[str]:
 
 def main():
     local_args = prepare_generator_args()
+    custom_opts = get_review_opts(local_args, "apply_airport_model")
+    if "apply" in custom_opts:
+        ReviewBundle(custom_opts["apply"]).apply()
+        return
     generator, options = setup_generator(local_args)
-    #    custom_opts = set_custom_opts(local_args)
-    bot = AirportModelApplier(generator=generator, **options)
+    bot = AirportModelApplier(generator=generator, custom_opts=custom_opts, **options)
     bot.run()
 
 
@@ -0,0 +1,138 @@
+"""
+Micro-benchmark of ``voy_aux.format_template_params`` against the previous
+implementation (a single ``re.sub`` over the whole page).
+
+Run from the scripts directory:
+
+    python benchmarks/bench_format_template_params.py [page.wiki ...]
+
+Without arguments two large synthetic articles are used (sections full of multi-line
+listings, markers in the text, a quickbar and a citylist, ~140 KB), the second one with
+markers nested in the listings: there the previous implementation breaks the listings,
+so its output differs. Otherwise the given files (e.g. the wikitext of real articles)
+are benchmarked.
+"""
+
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voy_aux import format_template_params  # noqa: E402
+
+REPEAT = 5
+
+
+def legacy_format_template_params(text):
+    """The implementation replaced by the single-pass scanner"""
+
+    def format_quickbar(line):
+        return re.sub(r"\|\s*([^=]+?)\s*=\s*(.*?)\s*(?=\||$)", r"| \1 = \2", line)
+
+    def format_listing(line):
+        return re.sub(r"\|\s*([^=]+)\s*=\s*(.*?)\s*(?=[|\n])", r"| \1=\2 ", line)
+
+    def format_inline(line):
+        return re.sub(r"\|\s*([^=]+)\s*=\s*", r"| \1=", line.strip())
+
+    templates = {
+        "quickbarairport": format_quickbar,
+        "see": format_listing,
+        "do": format_listing,
+        "eat": format_listing,
+        "buy": format_listing,
+        "sleep": format_listing,
+        "drink": format_listing,
+        "listing": format_listing,
+        "marker": format_inline,
+        "Destinazione": format_inline,
+        "Città": format_inline,
+        "Destinationlist": format_quickbar,
+        "Regionlist": format_quickbar,
+        "MappaDinamica": format_quickbar,
+    }
+
+    def format_params(match):
+        template_name = match.group(1).strip()
+        format_function = templates.get(template_name.lower())
+        if not format_function:
+            return match.group(0)
+        formatted_lines = [format_function(line) for line in match.group(2).split("\n")]
+        formatted_params = (
+            " ".join(formatted_lines)
+            if format_function == format_inline
+            else "\n".join(formatted_lines)
+        )
+        separator = "\n" if format_function != format_inline else " "
+        return "{{" + template_name + separator + formatted_params + "}}"
+
+    template_pattern = r"\{\{\s*([^}|]+)\s*(\|[^}]+)\}\}"
+    return re.sub(template_pattern, format_params, text, flags=re.IGNORECASE)
+
+
+def synthetic_article(listings_per_section: int = 60, nested: bool = False) -> str:
+    random.seed(0)
+    parts = [
+        "{{Quickbar\n| Nome = Città di prova\n| Immagine = Prova.jpg\n"
+        "| Stato = Italia\n| Regione = Lazio\n}}\n"
+        "'''Città di prova''' è una città del {{marker|tipo=city|nome=Lazio}}.\n"
+    ]
+    for section in ("Vedere", "Fare", "Acquisti", "Mangiare", "Bere", "Dormire"):
+        parts.append(f"\n== {section} ==\n")
+        for i in range(listings_per_section):
+            template = random.choice(("see", "do", "buy", "eat", "drink", "sleep"))
+            marker = f"marker|tipo=go|nome=Piazza {i}|lat=41.9|long=12.5"
+            marker = f"{{{{{marker}}}}}" if nested else f"[[Piazza {i}]]"
+            parts.append(
+                f"* {{{{{template}\n| nome=Luogo {i} | alt= | sito=https://example.org/{i}"
+                f" | email=\n| indirizzo=Via Roma {i} | lat=41.{i} | long=12.{i}"
+                f" | indicazioni=\n| tel=+39 06 {i:06d} | numero verde= | fax=\n"
+                f"| orari=9-18 | prezzo=10 € | wikidata=Q{i}\n"
+                f"| descrizione=Un luogo da visitare, vicino a {marker} e al museo.\n}}}}\n"
+            )
+            parts.append(
+                f"Testo con [[Collegamento {i}]], '''grassetto''' e {{{{-}}}}.\n"
+            )
+    parts.append("\n== Dintorni ==\n{{Citylist\n")
+    for i in range(40):
+        parts.append(
+            f"| {{{{Città | nome=Paese {i} | alt= | wikidata=Q{1000 + i}}}}}\n"
+        )
+    parts.append("}}\n")
+    return "".join(parts)
+
+
+def benchmark(name: str, text: str) -> None:
+    same = legacy_format_template_params(text) == format_template_params(text)
+    legacy = min(
+        timeit.repeat(
+            lambda: legacy_format_template_params(text), number=REPEAT, repeat=3
+        )
+    )
+    current = min(
+        timeit.repeat(lambda: format_template_params(text), number=REPEAT, repeat=3)
+    )
+    print(
+        f"{name}: {len(text) / 1024:.0f} KB, "
+        f"legacy {legacy / REPEAT * 1000:.1f} ms, "
+        f"scanner {current / REPEAT * 1000:.1f} ms, "
+        f"speedup {legacy / current:.2f}x, "
+        f"same output: {same}"
+    )
+
+
+def main():
+    if len(sys.argv) > 1:
+        for filename in sys.argv[1:]:
+            with open(filename, encoding="utf-8") as f:
+                benchmark(os.path.basename(filename), f.read())
+    else:
+        benchmark("synthetic article", synthetic_article())
+        benchmark("synthetic article, nested", synthetic_article(nested=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Micro-benchmark of the section engine of ``voy_aux`` (``format_sections``) against the
+previous section formatters, three ``re.sub`` over the whole page.
+
+Run from the scripts directory:
+
+    python benchmarks/bench_section_engine.py [page.wiki ...]
+
+Without arguments two synthetic articles over 200 KB are used: one with many short
+sections, and one whose last section is long (e.g. a long "Dintorni"), where the lazy
+DOTALL pattern of the previous ``terminate_before_section_level_two`` rescans the
+rest of the page from every position. Otherwise the given files (e.g. the wikitext of
+real articles) are benchmarked.
+"""
+
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voy_aux import format_sections  # noqa: E402
+
+REPEAT = 3
+
+
+def legacy_terminate_before_section_level_two(text, exception=["Da sapere"]):
+    section_pattern = r"(.*?)(\n*)(?<!\=)==\s*([^=].*?)\s*==(?!=)"
+
+    def replace_section(match):
+        preceding_text = match.group(1)
+        section_title = match.group(3)
+        if section_title.strip().lower() not in [exc.lower() for exc in exception]:
+            return preceding_text + "\n{{-}}\n\n== " + section_title + " =="
+        return preceding_text + "\n\n== " + section_title + " =="
+
+    return re.sub(section_pattern, replace_section, text, flags=re.DOTALL)
+
+
+def legacy_format_section_begin(text):
+    section_pattern = r"(?<!\=)==\s*([^=].*?)\s*==(?!=)(.*?)\n(?!$)"
+    return re.sub(section_pattern, r"== \1 ==\n\2\n", text, flags=re.DOTALL)
+
+
+def legacy_format_section_titles(text):
+    def format_title(match):
+        return f"{match.group(1)} {match.group(2).strip()} {match.group(1)}"
+
+    return re.sub(r"(={2,})\s*(.*?)\s*\1", format_title, text)
+
+
+def legacy_format(text):
+    text = legacy_terminate_before_section_level_two(text)
+    text = legacy_format_section_begin(text)
+    return legacy_format_section_titles(text)
+
+
+def synthetic_article(sections: int = 60, last_section_lines: int = 0) -> str:
+    random.seed(0)
+    words = ("Roma", "museo", "piazza", "[[Collegamento]]", "'''grassetto'''", "via")
+    paragraph = lambda: " ".join(random.choice(words) for _ in range(40)) + "\n"
+    parts = ["{{Quickbar\n| Nome = Città di prova\n}}\n", paragraph()]
+    for i in range(sections):
+        parts.append(f"\n==Sezione {i}==\n")
+        parts.extend(paragraph() for _ in range(3))
+        for j in range(3):
+            parts.append(f"\n=== Sottosezione {i}.{j}===\n")
+            parts.extend(
+                f"* {{{{see\n| nome=Luogo {i}.{j}.{k} | descrizione={paragraph()}}}}}\n"
+                for k in range(2)
+            )
+    if last_section_lines:
+        parts.append("\n== Dintorni ==\n")
+        parts.extend(
+            f"* [[Paese {i}]] - {paragraph()}" for i in range(last_section_lines)
+        )
+    return "".join(parts)
+
+
+def benchmark(name: str, text: str) -> None:
+    legacy = min(timeit.repeat(lambda: legacy_format(text), number=1, repeat=REPEAT))
+    current = min(
+        timeit.repeat(
+            lambda: format_sections(
+                text,
+                normalize_titles=True,
+                terminate_level_two=True,
+                blank_line_after_heading=True,
+            ),
+            number=1,
+            repeat=REPEAT,
+        )
+    )
+    print(
+        f"{name}: {len(text) / 1024:.0f} KB, "
+        f"legacy {legacy * 1000:.1f} ms, "
+        f"engine {current * 1000:.1f} ms, "
+        f"speedup {legacy / current:.1f}x"
+    )
+
+
+def main():
+    if len(sys.argv) > 1:
+        for filename in sys.argv[1:]:
+            with open(filename, encoding="utf-8") as f:
+                benchmark(os.path.basename(filename), f.read())
+    else:
+        benchmark("many sections", synthetic_article())
+        benchmark(
+            "long last section",
+            synthetic_article(last_section_lines=40),
+        )
+
+
+if __name__ == "__main__":
+    main()
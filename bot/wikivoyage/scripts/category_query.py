@@ -0,0 +1,115 @@
+import re
+from typing import Callable
+
+TOKEN_RE = re.compile(r"\s*([&|~()]|[^&|~()]+)")
+OPERATORS = "&|~()"
+
+
+class CategoryExpression:
+    """
+    ``CategoryExpression``
+
+    A set expression over categories, e.g. ``Regione & Abbozzi & ~(Parco | Stato)``:
+    ``&`` is the intersection, ``|`` the union and ``~`` the complement with respect to
+    a universe of pages (by default the union of the categories in the expression).
+    Category names are written without namespace and may contain spaces.
+
+    Example usage:
+
+    ```python
+    expression = CategoryExpression("Regione & ~Abbozzi")
+    expression.evaluate(lambda category: members[category])
+    ```
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self._tokens = [token.strip() for token in TOKEN_RE.findall(expression)]
+        self._tokens = [token for token in self._tokens if token]
+        self._position = 0
+        self.tree = self._parse_union()
+        if self._position != len(self._tokens):
+            raise ValueError(
+                f"Unexpected '{self._tokens[self._position]}' in category expression '{expression}'"
+            )
+
+    @property
+    def categories(self) -> list[str]:
+        """
+        :return: the categories named in the expression, in order of appearance
+        """
+        return list(
+            dict.fromkeys(token for token in self._tokens if token not in OPERATORS)
+        )
+
+    def evaluate(
+        self, members: Callable[[str], set[str]], universe: set[str] | None = None
+    ) -> set[str]:
+        """
+        Evaluate the expression
+        :param members: returns the titles of the members of a category
+        :param universe: the pages the result is restricted to, also used for ``~``
+                         (default: all the members of the categories in the expression)
+        :return: the titles of the matching pages
+        """
+        if universe is None:
+            universe = set().union(*(members(name) for name in self.categories))
+        return self._evaluate(self.tree, members, universe) & universe
+
+    def _evaluate(self, node, members, universe) -> set[str]:
+        if isinstance(node, str):
+            return members(node)
+        operator, *operands = node
+        if operator == "~":
+            return universe - self._evaluate(operands[0], members, universe)
+        left, right = (
+            self._evaluate(operand, members, universe) for operand in operands
+        )
+        return left & right if operator == "&" else left | right
+
+    # Recursive descent parser, ``~`` binds tighter than ``&``, which binds tighter than ``|``
+
+    def _peek(self) -> str | None:
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return None
+
+    def _next(self) -> str:
+        token = self._peek()
+        if token is None:
+            raise ValueError(
+                f"Unexpected end of category expression '{self.expression}'"
+            )
+        self._position += 1
+        return token
+
+    def _parse_union(self):
+        node = self._parse_intersection()
+        while self._peek() == "|":
+            self._next()
+            node = ("|", node, self._parse_intersection())
+        return node
+
+    def _parse_intersection(self):
+        node = self._parse_factor()
+        while self._peek() == "&":
+            self._next()
+            node = ("&", node, self._parse_factor())
+        return node
+
+    def _parse_factor(self):
+        token = self._next()
+        if token == "~":
+            return "~", self._parse_factor()
+        if token == "(":
+            node = self._parse_union()
+            if self._next() != ")":
+                raise ValueError(
+                    f"Missing ')' in category expression '{self.expression}'"
+                )
+            return node
+        if token in OPERATORS:
+            raise ValueError(
+                f"Unexpected '{token}' in category expression '{self.expression}'"
+            )
+        return token
@@ -5,36 +5,52 @@ from mwparserfromhell.wikicode import Wikicode
 from pywikibot.bot import ExistingPageBot
 from pywikibot import logging
 
-from WikibaseHelper import WikibaseHelper
+import timing
+from WikibaseHelper import WikibaseHelper, SitelinkResolvers
+from page_journal import JournaledBot
 from pwb_aux import setup_generator
+from recent_changes import commit_run
 
 
-class BestImageTableCompleter(ExistingPageBot):
+class BestImageTableCompleter(JournaledBot, timing.TimedBot, ExistingPageBot):
 
-    def __init__(self, **kwargs):
+    def __init__(self, custom_opts, **kwargs):
         super().__init__(**kwargs)
         self.matches = []
-        self.wb_helper = WikibaseHelper()
+        self.wb_helper = WikibaseHelper(
+            resolver=custom_opts.get("resolver", SitelinkResolvers.SPARQL.value)
+        )
 
     def treat_page(self) -> None:
         logging.info(f"Processing page {self.current_page}")
 
-        wikicode = mwparserfromhell.parse(self.current_page.text)
-        tables = wikicode.filter_tags(matches=lambda node: node.tag == "table")
+        with timing.span("fetch.text"):
+            text = self.current_page.text
+        with timing.span("parse"):
+            wikicode = mwparserfromhell.parse(text)
+            tables = wikicode.filter_tags(matches=lambda node: node.tag == "table")
 
         print(f"Found {len(tables)} tables")
 
-        for table in tables:
-            rows = table.contents.filter_tags(matches=lambda node: node.tag == "tr")
-            for row in rows[1:]:  # Skip the header row
-                cells = row.contents.filter_tags(matches=lambda node: node.tag == "td")
-                if len(cells) == 4:
-                    self.process_table_row(cells)
+        with timing.span("process"):
+            for table in tables:
+                rows = table.contents.filter_tags(matches=lambda node: node.tag == "tr")
+                for row in rows[1:]:  # Skip the header row
+                    cells = row.contents.filter_tags(
+                        matches=lambda node: node.tag == "td"
+                    )
+                    if len(cells) == 4:
+                        self.process_table_row(cells)
 
         # Dump new wikicode to page
         with open("pueblos_magicos.txt", "w") as f:
             f.write(str(wikicode))
 
+    def teardown(self) -> None:
+        commit_run()
+        timing.report()
+        super().teardown()
+
     def get_wikidata_id(self, name):
         # Function to retrieve Wikidata ID from a page name
         print(f"Extracting wikidata id for {name}")
@@ -97,10 +113,33 @@ class BestImageTableCompleter(ExistingPageBot):
         cells[1].contents = [marker_template]
 
 
+def set_custom_opts(args: list[str]) -> dict[str, str]:
+    """
+    Set custom options for the given arguments.
+    In particular following options are supported (i.e. read from command line):
+
+    -resolver:<resolver_name> - How to find the wikidata items. Possible values are "sparql" and "api".
+
+    :param args: List of command line arguments.
+    :return: Dictionary of custom options.
+    """
+    custom_opts = dict()
+
+    if any(arg.startswith("-resolver") for arg in args):
+        custom_opts["resolver"] = args[
+            [arg.startswith("-resolver") for arg in args].index(True)
+        ].split(":")[1]
+
+    return custom_opts
+
+
 def main():
     local_args = pywikibot.handle_args()
-    generator, options = setup_generator(local_args)
-    bot = BestImageTableCompleter(generator=generator, **options)
+    generator, options = setup_generator(local_args, preload=("revisions",))
+    custom_opts = set_custom_opts(local_args)
+    bot = BestImageTableCompleter(
+        generator=generator, custom_opts=custom_opts, **options
+    )
     bot.run()
 
 
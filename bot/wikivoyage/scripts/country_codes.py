@@ -0,0 +1,88 @@
+import json
+import os
+import time
+
+from pywikibot import logging
+from pywikibot.data.sparql import SparqlQuery
+
+DEFAULT_CODES_PATH = "cache/country_codes.json"
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60  # one month, in seconds
+
+# ISO 3166-1 codes (P297) of all the items having one, plus the ISO 3166-2 codes (P300)
+# of the items that are instances of country (Q6256)
+COUNTRY_CODES_QUERY = """
+SELECT ?country ?iso1 ?iso2 WHERE {
+  { ?country wdt:P297 ?iso1 . }
+  UNION
+  { ?country wdt:P31 wd:Q6256 ; wdt:P300 ?iso2 . }
+}"""
+
+
+class CountryCodeTable:
+    """
+    ``CountryCodeTable``
+
+    ISO 3166 codes of the countries on Wikidata, built with a single SPARQL query and kept
+    in a local json file. The table is rebuilt when older than ``max_age`` seconds
+    or when ``refresh`` is called.
+
+    Example usage:
+
+    ```python
+    table = CountryCodeTable()
+    table.get_code("Q38")  # "IT"
+    ```
+    """
+
+    def __init__(self, path: str = DEFAULT_CODES_PATH, max_age: int = DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._codes = None  # type: dict[str, dict[str, str]] | None
+
+    @property
+    def codes(self) -> dict[str, dict[str, str]]:
+        """
+        :return: dictionary QID -> {"P297": ISO 3166-1 code, "P300": ISO 3166-2 code}
+        """
+        if self._codes is None:
+            self._codes = self._load()
+            if self._codes is None:
+                self.refresh()
+        return self._codes
+
+    def get_code(self, country: str | None) -> str | None:
+        """
+        :param country: the QID of a country
+        :return: its ISO 3166-1 code, else its ISO 3166-2 code, else None
+        """
+        codes = self.codes.get(country, {})
+        return codes.get("P297") or codes.get("P300")
+
+    def refresh(self) -> None:
+        """
+        Rebuild the table from Wikidata and save it
+        :return: None
+        """
+        codes = {}
+        for row in SparqlQuery().select(COUNTRY_CODES_QUERY) or []:
+            qid = row["country"].rsplit("/", 1)[-1]
+            if row.get("iso1"):
+                codes.setdefault(qid, {}).setdefault("P297", row["iso1"])
+            if row.get("iso2"):
+                codes.setdefault(qid, {}).setdefault("P300", row["iso2"])
+        logging.info(f"Loaded the ISO 3166 codes of {len(codes)} countries")
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({"fetched_at": time.time(), "codes": codes}, f)
+        self._codes = codes
+
+    def _load(self) -> dict[str, dict[str, str]] | None:
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            data = json.load(f)
+        if time.time() - data["fetched_at"] > self.max_age:
+            return None
+        return data["codes"]
@@ -0,0 +1,161 @@
+import bz2
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterator
+
+import pywikibot
+from pywikibot import logging
+from pywikibot.bot import BaseBot
+from pywikibot.tools import open_archive
+
+from pwb_aux import DumpSource, iter_dump_pages
+
+STREAMS_PER_SHARD = 20  # a multistream dump packs ~100 pages per bz2 stream
+
+_worker_bot = None  # type: BaseBot | None
+_worker_source = None  # type: DumpSource | None
+
+
+def read_multistream_index(index_filename: str) -> list[int]:
+    """
+    Read the index of a multistream dump (lines ``offset:pageid:title``)
+    :param index_filename: the path of the index (usually ``*-multistream-index.txt.bz2``)
+    :return: the sorted byte offsets of the bz2 streams in the dump
+    """
+    offsets = set()
+    with open_archive(index_filename) as index:
+        for line in index:
+            offset, _, _ = line.partition(b":")
+            if offset.strip():
+                offsets.add(int(offset))
+    return sorted(offsets)
+
+
+def get_shards(source: DumpSource) -> list[tuple[int, int]]:
+    """
+    Split a multistream dump in byte ranges made of whole bz2 streams,
+    which can be decompressed and parsed independently
+    :param source: the dump
+    :return: a list of (start, end) byte ranges, in dump order
+    """
+    offsets = read_multistream_index(source.index_filename)
+    starts = offsets[::STREAMS_PER_SHARD]
+    ends = starts[1:] + [os.path.getsize(source.filename)]
+    return list(zip(starts, ends))
+
+
+def read_shard(filename: str, shard: tuple[int, int]) -> io.BytesIO:
+    """
+    Decompress a shard of a multistream dump into a well-formed XML document
+    :param filename: the path of the dump
+    :param shard: the (start, end) byte range of the shard
+    :return: the ``<page>`` elements of the shard, wrapped in a single root element
+    """
+    start, end = shard
+    with open(filename, "rb") as dump:
+        dump.seek(start)
+        data = bz2.decompress(dump.read(end - start))
+    # the last stream of the dump closes the root element opened in the first one
+    data = data.replace(b"</mediawiki>", b"")
+    return io.BytesIO(b"<pages>" + data + b"</pages>")
+
+
+def _init_worker(bot_class: type[BaseBot], source: DumpSource, bot_kwargs: dict):
+    global _worker_bot, _worker_source
+    _worker_bot = bot_class(generator=[], **bot_kwargs)
+    _worker_source = source
+
+
+def _scan_shard(
+    shard: tuple[int, int], result_attributes: tuple[str, ...]
+) -> tuple[int, dict[str, list]]:
+    bot, source = _worker_bot, _worker_source
+    for attribute in result_attributes:
+        setattr(bot, attribute, [])
+
+    pages = _iter_shard_pages(source, shard)
+    if hasattr(bot, "prepare_pages"):
+        # the bot's own wrapping of its generator, e.g. batched lookups
+        pages = bot.prepare_pages(pages)
+    scanned = 0
+    for page in pages:
+        scanned += 1
+        try:
+            page = bot.init_page(page)
+            if bot.skip_page(page):
+                continue
+            bot.treat(page)
+        except Exception as e:
+            # one broken page must not discard the results of the whole shard
+            logging.error(f"Error while checking {page.title()}: {e}")
+
+    return scanned, {
+        attribute: getattr(bot, attribute) for attribute in result_attributes
+    }
+
+
+def _iter_shard_pages(source: DumpSource, shard: tuple[int, int]) -> Iterator:
+    return iter_dump_pages(
+        read_shard(source.filename, shard),
+        namespaces=source.namespaces,
+        title_filter=source.title_filter,
+    )
+
+
+def scan_dump_in_parallel(
+    bot_class: type[BaseBot],
+    source: DumpSource,
+    workers: int,
+    result_attributes: tuple[str, ...] = ("found_matches",),
+    **bot_kwargs: Any,
+) -> BaseBot:
+    """
+    Run a read-only bot on a multistream dump with a pool of processes.
+    The dump is split in shards of whole bz2 streams using the multistream index;
+    each process builds its own bot and runs ``treat`` on the pages of one shard at a time,
+    after passing them through the bot's ``prepare_pages`` method if it has one.
+    The results collected in ``result_attributes`` are merged in dump order, so the output
+    is the same as with a sequential run, then the bot's ``teardown`` writes them out.
+
+    Example usage:
+
+    ```python
+    scan_dump_in_parallel(EmptySectionFinder, source, 8, custom_opts=custom_opts)
+    ```
+
+    :param bot_class: the bot to run, it must not edit pages
+    :param source: the dump, as returned by ``setup_generator`` with ``-xml``
+    :param workers: the number of processes
+    :param result_attributes: the list attributes of the bot holding its findings
+    :param bot_kwargs: the arguments of the bot constructor (they must be picklable)
+    :return: the bot holding the merged results
+    """
+    if source.limit:
+        logging.warning("-limit is not applied when scanning a dump in parallel")
+
+    shards = get_shards(source)
+    pywikibot.output(
+        f"Scanning {source.filename} in {len(shards)} shards with {workers} processes"
+    )
+
+    bot = bot_class(generator=[], **bot_kwargs)
+    for attribute in result_attributes:
+        setattr(bot, attribute, [])
+
+    scanned = 0
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(bot_class, source, bot_kwargs),
+    ) as executor:
+        # map yields the results in submission order, i.e. in dump order
+        results = executor.map(_scan_shard, shards, [result_attributes] * len(shards))
+        for shard_scanned, shard_results in results:
+            scanned += shard_scanned
+            for attribute, values in shard_results.items():
+                getattr(bot, attribute).extend(values)
+
+    pywikibot.output(f"Scanned {scanned} pages")
+    bot.teardown()
+    return bot
@@ -1,26 +1,72 @@
+import csv
 import datetime
+import itertools
+import json
 import re
+from enum import Enum
+from typing import Iterable
 
-import mwparserfromhell
 import pywikibot
 from pywikibot import logging
 from pywikibot.bot import ExistingPageBot
-from pwb_aux import setup_generator
+import timing
+from dump_scan import scan_dump_in_parallel
+from page_journal import JournaledBot
+from pwb_aux import DumpSource, setup_generator
+from recent_changes import commit_run
+from save_queue import SaveQueue
+from voy_aux import STANDARD_SECTIONS, ArticleTypeLookup, split_sections
 
 SOURCE_CATEGORY = "Abbozzi"  # Very unlikely that articles with higher quality will be interesting here
 CATEGORY_TO_ADD = "Articoli senza introduzione"
 SECTION_NAME = "Da sapere"
+# -section:standard checks the standard sections of each article type
+STANDARD_SECTIONS_OPTION = "standard"
 DEFAULT_ACTION = "dump"  # "dump" or "addcat"
+# .csv and .json with the status of each section, when checking several sections
+MATRIX_FILENAME = "logs/empty_sections"
+# Section names are searched in the titles as in mwparserfromhell's get_sections
+SECTION_TITLE_FLAGS = re.IGNORECASE | re.DOTALL | re.UNICODE
+# Comments, {{-}} and whitespace don't count as content
+_EMPTY_SECTION = re.compile(r"(?:\s|<!--(?:(?!-->).)*-->|\{\{-\}\})*", re.DOTALL)
 
 
-class EmptySectionFinder(ExistingPageBot):
+class SectionStatus(Enum):
+    EMPTY = "empty"
+    CONTENT = "content"
+    MISSING = "missing"
+    DUPLICATE = "duplicate"  # more than one section with the name
+
+
+class EmptySectionFinder(JournaledBot, timing.TimedBot, ExistingPageBot):
 
     def __init__(self, custom_opts, **kwargs):
         super().__init__(**kwargs)
         self.service_cat = custom_opts.get("addcat", CATEGORY_TO_ADD)
-        self.section_name = custom_opts.get("section", SECTION_NAME)
+        section = custom_opts.get("section", SECTION_NAME)
         self.action = custom_opts.get("action", DEFAULT_ACTION)
-        self.found_matches = []
+        self.live = custom_opts.get("live", False)
+        # page title and status of each checked section, see SectionStatus
+        self.rows = []  # type: list[tuple[str, dict[str, str]]]
+        self.saves = SaveQueue()
+
+        self.article_types = None
+        self.section_names = []
+        if section == STANDARD_SECTIONS_OPTION:
+            self.article_types = ArticleTypeLookup()
+            self.generator = self.prepare_pages(self.generator)
+        else:
+            self.section_names = [name.strip() for name in section.split(",")]
+        if self.action == "addcat" and len(self.section_names) != 1:
+            raise ValueError("-action:addcat can only be used with a single -section")
+
+    @property
+    def section_name(self) -> str:
+        return ", ".join(self.section_names) or STANDARD_SECTIONS_OPTION
+
+    @property
+    def checks_several_sections(self) -> bool:
+        return self.article_types is not None or len(self.section_names) > 1
 
     @property
     def edit_opts(self):
@@ -40,64 +86,95 @@ class EmptySectionFinder(ExistingPageBot):
             "bot": True,
         }
 
-    def treat_page(self):
-        logging.info(
-            f"Checking page: {self.current_page.title()} for empty '{self.section_name}' section"
-        )
+    def prepare_pages(
+        self, pages: Iterable[pywikibot.Page]
+    ) -> Iterable[pywikibot.Page]:
+        """
+        Also used on the pages of each shard in a parallel dump scan
+        :param pages: the pages to check
+        :return: the same pages, classified in batches when checking the standard sections
+        """
+        if self.article_types is None:
+            return pages
+        return self.article_types.classify(pages)
 
-        content = self.current_page.text
-        wikicode = mwparserfromhell.parse(content)
+    def get_section_names(self) -> list[str]:
+        """
+        :return: the sections to check in the current page
+        """
+        if self.article_types is None:
+            return self.section_names
+        article_type = self.article_types.get_article_type(self.current_page)
+        return list(STANDARD_SECTIONS.get(article_type, ()))
 
-        sections = wikicode.get_sections(
-            matches=self.section_name, include_headings=False
+    def treat_page(self):
+        title = self.current_page.title()
+        section_names = self.get_section_names()
+        if not section_names:
+            logging.warning(f"No standard sections for {title}: unknown article type")
+            return
+        logging.info(
+            f"Checking page: {title} for empty '{', '.join(section_names)}' sections"
         )
-
-        # Make sure we found the standard section with this name
+        # the standard names are titles, not patterns: "Come arrivare" must not
+        # match "Come arrivare in aereo"
+        exact = self.article_types is not None
+
+        if self.live:
+            with timing.span("fetch.sections"):
+                sections = fetch_all_sections(self.current_page, section_names, exact)
+        else:
+            with timing.span("fetch.text"):
+                text = self.current_page.text
+            with timing.span("parse.sections"):
+                sections = find_all_sections(text, section_names, exact)
+
+        # Make sure we found the standard section with each name:
         # there should be only 1 per page
-        n_sections = len(sections)
-
-        if n_sections > 1 or n_sections == 0:
-            logging.warning(
-                f"Too many '{self.section_name}' sections in {self.current_page.title()}"
-            )
-            return
-
-        # Get the section text
-        target_section = sections[0]
-        is_empty = EmptySectionFinder.is_section_empty(str(target_section))
+        statuses = {}
+        for name in section_names:
+            status = get_section_status(sections[name])
+            if status in (SectionStatus.MISSING, SectionStatus.DUPLICATE):
+                logging.warning(
+                    f"Found {len(sections[name])} '{name}' sections in {title}"
+                )
+            statuses[name] = status.value
+        self.rows.append((title, statuses))
 
-        if is_empty:
-            logging.info(
-                f"Found empty '{self.section_name}' section in {self.current_page.title()}"
-            )
+        empty = [
+            name
+            for name, status in statuses.items()
+            if status == SectionStatus.EMPTY.value
+        ]
+        if empty:
+            logging.info(f"Found empty '{', '.join(empty)}' sections in {title}")
 
             if self.action == "dump":
                 pywikibot.output("Found empty section in page:")
-                pywikibot.output(self.current_page.title())
-                self.found_matches.append(self.current_page.title())
+                pywikibot.output(title)
             elif self.action == "addcat":
                 self.add_category()
 
     def teardown(self) -> None:
+        self.saves.close()
+        commit_run(self.saves.failed)
         if self.action == "dump":
             self.dump_findings()
+        timing.report()
 
     def dump_findings(self):
-        logging.info(f"Found {len(self.found_matches)} matches")
-        with open(f"logs/empty_{self.section_name}.txt", "w") as f:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-            f.write(f"Empty sections dump - {timestamp}\n")
-            f.write(f"Found {len(self.found_matches)} matches\n\n")
-            f.write("Searched for:\n")
-            f.write(f"Section name: {self.section_name}\n")
-            f.write(f"Service category: {self.service_cat}\n\n")
-            f.write("Matches:\n")
-
-            for match in self.found_matches:
-                f.write(
-                    f"* [[{match}]] <small>(check eseguito il {timestamp})</small>\n"
-                )
+        section_names = self.section_names or list(
+            dict.fromkeys(name for title, statuses in self.rows for name in statuses)
+        )
+        for name in section_names:
+            found_matches = [
+                title
+                for title, statuses in self.rows
+                if statuses.get(name) == SectionStatus.EMPTY.value
+            ]
+            write_findings(found_matches, name, self.service_cat)
+        if self.checks_several_sections:
+            write_matrix(self.rows, section_names, MATRIX_FILENAME)
 
     def add_category(self):
         """Add a category to the current page if it's not already present.
@@ -119,7 +196,7 @@ class EmptySectionFinder(ExistingPageBot):
             f"Adding category {self.service_cat} to {self.current_page.title()}"
         )
         self.current_page.text += f"\n[[Categoria:{self.service_cat}]]"
-        self.current_page.save(**self.edit_opts)
+        self.saves.put(self.current_page, **self.edit_opts)
 
     @staticmethod
     def is_section_empty(section_text):
@@ -131,22 +208,194 @@ class EmptySectionFinder(ExistingPageBot):
         :return: True if the section is empty, False otherwise.
         :rtype: bool
         """
-        # Remove comments
-        text_without_comments = re.sub(
-            r"<!--.*?-->",
-            "",
-            section_text,
-            flags=re.DOTALL | re.MULTILINE | re.UNICODE | re.IGNORECASE,
+        # Nothing but comments, spacing templates and whitespace
+        return _EMPTY_SECTION.fullmatch(section_text) is not None
+
+
+def get_section_status(sections: list[str]) -> SectionStatus:
+    """
+    :param sections: the sections found with a name
+    :return: the status of the section
+    """
+    if not sections:
+        return SectionStatus.MISSING
+    if len(sections) > 1:
+        return SectionStatus.DUPLICATE
+    if EmptySectionFinder.is_section_empty(sections[0]):
+        return SectionStatus.EMPTY
+    return SectionStatus.CONTENT
+
+
+def title_matches(section_name: str, title: str, exact: bool = False) -> bool:
+    """
+    :param section_name: the name (a regex, unless exact) of the section
+    :param title: the title of a section
+    :param exact: compare the whole title, case-insensitive
+    :return: True if the section has the given name
+    """
+    if exact:
+        return section_name.casefold() == title.strip().casefold()
+    return re.search(section_name, title, SECTION_TITLE_FLAGS) is not None
+
+
+def find_sections(text: str, section_name: str) -> list[str]:
+    """
+    Find the sections with the given name with a single scan of the heading lines,
+    without parsing the page. The name is searched in the titles as a case-insensitive
+    regex, like ``Wikicode.get_sections(matches=section_name)``
+    :param text: the text of the page
+    :param section_name: the name of the section
+    :return: the text of each section, without its heading and with its subsections
+    """
+    return find_all_sections(text, [section_name])[section_name]
+
+
+def find_all_sections(
+    text: str, section_names: list[str], exact: bool = False
+) -> dict[str, list[str]]:
+    """
+    Like ``find_sections``, for several names with a single scan
+    :param text: the text of the page
+    :param section_names: the names of the sections
+    :param exact: compare the names with the whole titles (case-insensitive)
+                  instead of searching them as regexes
+    :return: dictionary name -> the text of each section with that name
+    """
+    sections = split_sections(text)
+    found = {name: [] for name in section_names}
+    for i, section in enumerate(sections):
+        if not section.level:
+            continue
+        names = [
+            name for name in section_names if title_matches(name, section.title, exact)
+        ]
+        if not names:
+            continue
+        subsections = itertools.takewhile(
+            lambda subsection: subsection.level > section.level,
+            itertools.islice(sections, i + 1, None),
+        )
+        section_text = (
+            section.trailer
+            + section.body
+            + "".join(
+                subsection.heading + subsection.body for subsection in subsections
+            )
         )
+        for name in names:
+            found[name].append(section_text)
+    return found
 
-        # Remove spacing templates
-        text_without_spacing = re.sub(r"\{\{-\}\}", "", text_without_comments)
 
-        # Remove newlines
-        text_without_spacing = text_without_spacing.replace("\n", "")
+def fetch_sections(page: pywikibot.Page, section_name: str) -> list[str]:
+    """
+    Like ``find_sections``, but only the section index of the page and the text of the
+    matching sections are downloaded (``rvsection``), not the whole page
+    :param page: the page
+    :param section_name: the name of the section
+    :return: the text of each section, without its heading and with its subsections
+    """
+    return fetch_all_sections(page, [section_name])[section_name]
 
-        # Check if there's any content left
-        return not text_without_spacing.strip()
+
+def fetch_all_sections(
+    page: pywikibot.Page, section_names: list[str], exact: bool = False
+) -> dict[str, list[str]]:
+    """
+    Like ``fetch_sections``, for several names with a single request for the index
+    :param page: the page
+    :param section_names: the names of the sections
+    :param exact: see ``find_all_sections``
+    :return: dictionary name -> the text of each section with that name
+    """
+    site = page.site
+    parsed = site.simple_request(
+        action="parse", page=page.title(), prop="sections", formatversion=2
+    ).submit()
+    indexes = {}  # type: dict[str, list[str]]
+    for section in parsed["parse"]["sections"]:
+        # sections transcluded from templates have indexes like "T-1"
+        if not section["index"].isdigit():
+            continue
+        for name in section_names:
+            if title_matches(name, section["line"], exact):
+                indexes.setdefault(section["index"], []).append(name)
+
+    found = {name: [] for name in section_names}
+    for index, names in indexes.items():
+        data = site.simple_request(
+            action="query",
+            prop="revisions",
+            titles=page.title(),
+            rvprop="content",
+            rvslots="main",
+            rvsection=index,
+            formatversion=2,
+        ).submit()
+        content = data["query"]["pages"][0]["revisions"][0]["slots"]["main"]["content"]
+        # the section starts with its heading line
+        section_text = content[content.find("\n") :] if "\n" in content else ""
+        for name in names:
+            found[name].append(section_text)
+    return found
+
+
+def write_findings(found_matches: list[str], section_name: str, service_cat: str):
+    """
+    Write the pages with an empty section to ``logs/empty_<section_name>.txt``
+    :param found_matches: the titles of the pages
+    :param section_name: the name of the checked section
+    :param service_cat: the service category of the pages
+    :return: None
+    """
+    logging.info(f"Found {len(found_matches)} matches")
+    with open(f"logs/empty_{section_name}.txt", "w") as f:
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        f.write(f"Empty sections dump - {timestamp}\n")
+        f.write(f"Found {len(found_matches)} matches\n\n")
+        f.write("Searched for:\n")
+        f.write(f"Section name: {section_name}\n")
+        f.write(f"Service category: {service_cat}\n\n")
+        f.write("Matches:\n")
+
+        for match in found_matches:
+            f.write(f"* [[{match}]] <small>(check eseguito il {timestamp})</small>\n")
+
+
+def write_matrix(
+    rows: list[tuple[str, dict[str, str]]], section_names: list[str], filename: str
+):
+    """
+    Write the status of each section of each page to ``<filename>.csv``
+    and ``<filename>.json`` (empty / content / missing / duplicate)
+    :param rows: the page titles and the status of their sections
+    :param section_names: the sections, i.e. the columns
+    :param filename: the path of the files, without extension
+    :return: None
+    """
+    with open(f"{filename}.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["title", *section_names])
+        for title, statuses in rows:
+            writer.writerow(
+                [title, *(statuses.get(name, "") for name in section_names)]
+            )
+
+    with open(f"{filename}.json", "w") as f:
+        json.dump(
+            {
+                "checked_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "sections": section_names,
+                "pages": dict(rows),
+            },
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    logging.info(
+        f"Wrote the status of {len(section_names)} sections of {len(rows)} pages"
+    )
 
 
 def handle_opts() -> list[str]:
@@ -171,8 +420,11 @@ def set_custom_opts(args: list[str]) -> dict[str, str]:
     In particular following options are supported (i.e. read from command line):
 
     -addcat:<category_name> - Adds the given category to the pages with empty section.
-    -section:<section_name> - The name of the section to check for emptiness.
+    -section:<section_name> - The name of the section to check for emptiness, several
+                              names separated by commas, or "standard" for the standard
+                              sections of each article type.
     -action:<action_name> - The action to perform. Possible values are "dump" and "addcat".
+    -live - Only download the section index and the text of the section, not the whole page.
 
     :param args: List of command line arguments.
     :return: Dictionary of custom options.
@@ -195,13 +447,36 @@ def set_custom_opts(args: list[str]) -> dict[str, str]:
             [arg.startswith("-action") for arg in args].index(True)
         ].split(":")[1]
 
+    if any(arg.startswith("-live") for arg in args):
+        custom_opts["live"] = True
+
     return custom_opts
 
 
 def main():
     local_args = handle_opts()
-    generator, options = setup_generator(local_args)
     custom_opts = set_custom_opts(local_args)
+    generator, options = setup_generator(
+        local_args,
+        # in live mode only the sections are downloaded
+        preload=(
+            ("categories",) if custom_opts.get("live") else ("revisions", "categories")
+        ),
+        read_only=custom_opts.get("action", DEFAULT_ACTION) == "dump",
+    )
+    workers = options.pop("workers", None)
+    if workers and isinstance(generator, DumpSource):
+        if custom_opts.get("action", DEFAULT_ACTION) != "dump":
+            raise ValueError("-workers can only be used with -action:dump")
+        scan_dump_in_parallel(
+            EmptySectionFinder,
+            generator,
+            workers,
+            result_attributes=("rows",),
+            custom_opts=custom_opts,
+            **options,
+        )
+        return
     bot = EmptySectionFinder(generator=generator, custom_opts=custom_opts, **options)
     bot.run()
 
@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Iterable
+
+DEFAULT_CACHE_PATH = "cache/wikidata_entities.sqlite"
+DEFAULT_TTL = 7 * 24 * 60 * 60  # one week, in seconds
+DEFAULT_MAX_ENTRIES = 100_000
+
+
+class EntityCache:
+    """
+    ``EntityCache``
+
+    Persistent cache of Wikidata entities, stored in a SQLite file as compressed json
+    keyed by QID together with the ``lastrevid`` of the entity.
+
+    Entries younger than ``ttl`` seconds are served as they are (fresh); older entries
+    are returned as stale, so that the caller can compare their ``lastrevid`` with the
+    current one and either ``touch`` them or replace them with ``put_many``.
+    When the cache grows above ``max_entries`` the least recently used entries are evicted.
+    The cache can be shared between threads.
+
+    Example usage:
+
+    ```python
+    cache = EntityCache()
+    fresh, stale = cache.lookup(["Q220", "Q90"])
+    ```
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        ttl: int = DEFAULT_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entities (
+                qid TEXT PRIMARY KEY,
+                lastrevid INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                data BLOB NOT NULL
+            )"""
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS entities_accessed_at ON entities (accessed_at)"
+        )
+        self.connection.commit()
+
+    def lookup(self, qids: Iterable[str]) -> tuple[dict[str, dict], dict[str, dict]]:
+        """
+        Look up the given entities in the cache
+        :param qids: the ids of the entities
+        :return: two dictionaries QID -> entity json, the first with the fresh entries,
+                 the second with the entries older than the ttl. Ids not in the cache
+                 are counted as misses and left out.
+        """
+        qids = list(qids)
+        now = time.time()
+        fresh, stale = {}, {}
+        with self._lock:
+            for start in range(
+                0, len(qids), 500
+            ):  # stay below the SQLite variable limit
+                batch = qids[start : start + 500]
+                rows = self.connection.execute(
+                    f"SELECT qid, fetched_at, data FROM entities "
+                    f"WHERE qid IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+                for qid, fetched_at, data in rows:
+                    content = json.loads(zlib.decompress(data))
+                    if now - fetched_at <= self.ttl:
+                        fresh[qid] = content
+                    else:
+                        stale[qid] = content
+
+            self.hits += len(fresh)
+            self.misses += len(qids) - len(fresh)
+            self.connection.executemany(
+                "UPDATE entities SET accessed_at = ? WHERE qid = ?",
+                [(now, qid) for qid in fresh],
+            )
+            self.connection.commit()
+        return fresh, stale
+
+    def touch(self, qids: Iterable[str]) -> None:
+        """
+        Mark stale entries as fresh again, after checking that their revision did not change
+        :param qids: the ids of the revalidated entities
+        :return: None
+        """
+        now = time.time()
+        rows = [(now, now, qid) for qid in qids]
+        with self._lock:
+            self.connection.executemany(
+                "UPDATE entities SET fetched_at = ?, accessed_at = ? WHERE qid = ?",
+                rows,
+            )
+            self.connection.commit()
+            self.revalidated += len(rows)
+
+    def put_many(self, entities: dict[str, dict]) -> None:
+        """
+        Store the given entities, replacing the old entries, then evict the least
+        recently used entries if the cache is too big
+        :param entities: dictionary QID -> entity json as returned by wbgetentities
+        :return: None
+        """
+        now = time.time()
+        rows = [
+            (
+                qid,
+                content.get("lastrevid", 0),
+                now,
+                now,
+                zlib.compress(json.dumps(content).encode("utf-8")),
+            )
+            for qid, content in entities.items()
+        ]
+        with self._lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._evict()
+            self.connection.commit()
+
+    def _evict(self) -> None:
+        (size,) = self.connection.execute("SELECT COUNT(*) FROM entities").fetchone()
+        if size > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM entities WHERE qid IN "
+                "(SELECT qid FROM entities ORDER BY accessed_at LIMIT ?)",
+                (size - self.max_entries,),
+            )
+
+    def stats(self) -> str:
+        """
+        :return: a one line summary of the cache usage in this run
+        """
+        total = self.hits + self.misses
+        ratio = self.hits / total * 100 if total else 0.0
+        return (
+            f"Wikidata cache: {self.hits} hits, {self.misses} misses "
+            f"({ratio:.1f}% hit rate), {self.revalidated} stale entries revalidated"
+        )
+
+    def close(self) -> None:
+        self.connection.close()
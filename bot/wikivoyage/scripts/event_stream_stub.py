@@ -0,0 +1,184 @@
+"""
+Local stand-in for the EventStreams feed of ``event_worker``: a fake ``requests.Session``
+answering with canned server-sent events, to check the parsing of the stream, the
+selection of the pages and the debounce of the worker without any network access.
+
+Run from the scripts directory:
+
+    python event_stream_stub.py
+"""
+
+import json
+import time
+from typing import Any, Iterator
+
+import event_worker
+from event_worker import HANDLERS, EventWorker, iter_sse_events
+
+STREAM_URL = "http://localhost:8000/v2/stream/recentchange"
+WIKI = "itwikivoyage"
+BOT_USER = "VoyBot"
+CATEGORY = f"Categoria:{HANDLERS[0].category}"
+
+
+def sse_lines(events: list[dict[str, Any]]) -> list[str]:
+    """
+    :param events: the recentchange events
+    :return: the lines of the stream sending them, with a comment and a two lines event
+    """
+    lines = [":ok", ""]
+    for i, event in enumerate(events, start=1):
+        data = json.dumps(event, ensure_ascii=False)
+        # a payload may be split on several data lines, joined with newlines
+        first, sep, rest = data.partition(", ")
+        lines += ["event: message", f"id: {i}", f"data: {first},"]
+        lines += [f"data: {rest}", ""]
+    return lines
+
+
+class FakeResponse:
+    def __init__(self, lines: list[str]):
+        self.lines = lines
+        self.encoding = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+    def raise_for_status(self) -> None:
+        return None
+
+    def iter_lines(self, chunk_size=None, decode_unicode=False) -> Iterator[str]:
+        yield from self.lines
+
+
+class FakeSession:
+    """
+    ``FakeSession``
+
+    Answers every ``get`` with the same canned stream, recording the request headers.
+
+    Example usage:
+
+    ```python
+    session = FakeSession(sse_lines(events))
+    list(iter_sse_events(STREAM_URL, session=session))
+    ```
+    """
+
+    def __init__(self, lines: list[str], failures: int = 0):
+        self.lines = lines
+        self.failures = failures  # the first connections fail with an unexpected error
+        self.requests = []  # type: list[dict[str, str]]
+
+    def get(self, url: str, headers: dict[str, str], **kwargs) -> FakeResponse:
+        self.requests.append(headers)
+        if len(self.requests) <= self.failures:
+            raise ValueError("broken stream")
+        return FakeResponse(self.lines)
+
+
+class FakeSite:
+    def dbName(self) -> str:
+        return WIKI
+
+    def username(self) -> str:
+        return BOT_USER
+
+
+def make_event(**fields: Any) -> dict[str, Any]:
+    event = {"wiki": WIKI, "type": "edit", "namespace": 0, "user": "Utente"}
+    event.update(fields)
+    return event
+
+
+EVENTS = [
+    make_event(title="Roma"),
+    make_event(title="Milano", type="new"),
+    make_event(title="Roma"),  # same page again: still one pending page
+    make_event(title="Parigi", wiki="frwikivoyage"),  # another wiki
+    make_event(title="Torino", user=BOT_USER),  # the bot's own edit
+    make_event(title="Utente:Prova", namespace=2),  # not an article
+    make_event(
+        title=CATEGORY,
+        type="categorize",
+        namespace=14,
+        comment="[[:Napoli]] aggiunta alla categoria",
+    ),
+    make_event(
+        title="Categoria:Altro",
+        type="categorize",
+        namespace=14,
+        comment="[[:Bari]] aggiunta alla categoria",
+    ),
+]
+
+
+def check_stream() -> None:
+    session = FakeSession(sse_lines(EVENTS))
+    events = list(iter_sse_events(STREAM_URL, last_event_id="41", session=session))
+    assert [event_id for event_id, data in events] == [
+        str(i) for i in range(1, len(EVENTS) + 1)
+    ]
+    assert [json.loads(data) for event_id, data in events] == EVENTS
+    assert session.requests[0]["Last-Event-ID"] == "41"
+
+
+def check_titles(worker: EventWorker) -> None:
+    titles = [title for event in EVENTS for title in worker.get_titles(event)]
+    assert titles == ["Roma", "Milano", "Roma", "Napoli"], titles
+
+
+def check_debounce(worker: EventWorker) -> None:
+    now = time.monotonic()
+    worker.pending = {"Roma": now - 2, "Milano": now - 0.5, "Napoli": now}
+    assert worker.pop_due_pages() == ["Roma"]
+    assert set(worker.pending) == {"Milano", "Napoli"}
+    # the worker waits until the oldest pending page is due
+    assert 0 < worker._time_to_next_due() <= 0.5
+    worker.pending["Milano"] = now - 1  # its debounce is over
+    assert worker.pop_due_pages() == ["Milano"]
+    worker.pending.clear()
+    assert worker._time_to_next_due() == worker.debounce
+
+
+def check_reader(worker: EventWorker) -> None:
+    """
+    The reader thread queues the titles of the stream, keeps its position and
+    reconnects after any error
+    """
+    event_worker.RECONNECT_DELAY = 0
+    worker.session = FakeSession(sse_lines(EVENTS), failures=1)
+
+    def get_titles(event: dict[str, Any]) -> list[str]:
+        if event == EVENTS[-1]:
+            # stop at the end of the stream instead of reconnecting
+            worker.stop()
+        return EventWorker.get_titles(worker, event)
+
+    worker.get_titles = get_titles
+    worker._read()
+    queued = []
+    while not worker.events.empty():
+        queued.append(worker.events.get())
+    assert queued == ["Roma", "Milano", "Roma", "Napoli"], queued
+    assert worker.last_event_id == str(len(EVENTS))
+    assert len(worker.session.requests) == 2
+
+
+def main():
+    # no handler is built from the wiki: the category of the first one is set directly
+    worker = EventWorker(url=STREAM_URL, debounce=1, handlers=(), site=FakeSite())
+    worker.categories = {CATEGORY: HANDLERS[0]}
+
+    check_stream()
+    check_titles(worker)
+    check_debounce(worker)
+    check_reader(worker)
+    print("Event stream stand-in: all checks passed")
+
+
+if __name__ == "__main__":
+    main()
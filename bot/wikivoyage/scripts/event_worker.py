@@ -0,0 +1,318 @@
+import json
+import queue
+import re
+import threading
+import time
+from typing import Any, Iterator, NamedTuple
+
+import pywikibot
+import requests
+from pywikibot import logging
+from pywikibot.data import api
+
+import fix_empty_dynamic_map
+import itemlist_wikidata_completer
+from fix_empty_dynamic_map import DynamicMapFiller
+from itemlist_wikidata_completer import ItemListWikidataCompleter
+from pwb_aux import preload_pages
+
+DEFAULT_STREAM_URL = "https://stream.wikimedia.org/v2/stream/recentchange"
+DEFAULT_DEBOUNCE = 30  # seconds without events before a page is handled
+RECONNECT_DELAY = 5  # seconds
+# The page added to or removed from a category, in the comment of "categorize" events
+CATEGORIZED_PAGE_PATTERN = re.compile(r"\[\[:?([^\]|]+)")
+
+
+class Handler(NamedTuple):
+    """A bot run on the pages of its source category using one of its templates"""
+
+    category: str
+    templates: tuple[str, ...]
+    bot_class: type
+    preload: tuple[str, ...]
+    bot_opts: dict[str, Any]  # custom options of the bot, added to the worker's ones
+    bot_kwargs: dict[str, Any]  # other arguments of the bot constructor
+
+
+HANDLERS = (
+    Handler(
+        fix_empty_dynamic_map.SOURCE_CATEGORY,
+        (fix_empty_dynamic_map.DYNAMIC_MAP_TEMPLATE.strip(),),
+        DynamicMapFiller,
+        ("revisions", "pageprops"),
+        # a bot runs on each batch: its report would be rewritten every time
+        {"matchesfile": None},
+        {},
+    ),
+    Handler(
+        itemlist_wikidata_completer.SOURCE_CATEGORY,
+        (
+            itemlist_wikidata_completer.CITY_TEMPLATE_ITEM_NAME,
+            itemlist_wikidata_completer.DESTINATION_TEMPLATE_ITEM_NAME,
+        ),
+        ItemListWikidataCompleter,
+        ("revisions", "pageprops"),
+        {},
+        # nobody is there to confirm the edits
+        {"always": True},
+    ),
+)
+
+
+def iter_sse_events(
+    url: str, last_event_id: str | None = None, session: requests.Session | None = None
+) -> Iterator[tuple[str | None, str]]:
+    """
+    Read a server-sent events stream, e.g. Wikimedia EventStreams
+    :param url: the url of the stream
+    :param last_event_id: resume the stream after this event, if the server supports it
+    :param session: the requests session (default: a new one)
+    :return: a generator of (event id, event data)
+    """
+    headers = {"Accept": "text/event-stream"}
+    if last_event_id:
+        headers["Last-Event-ID"] = last_event_id
+    session = session or requests.Session()
+    with session.get(url, headers=headers, stream=True, timeout=(10, 60)) as response:
+        response.raise_for_status()
+        response.encoding = "utf-8"
+        event_id, data = None, []
+        # chunk_size=None: read each chunk as it arrives, to not wait for a full buffer
+        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+            if not line:
+                if data:
+                    yield event_id, "\n".join(data)
+                data = []
+                continue
+            field, sep, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "data":
+                data.append(value)
+            elif field == "id":
+                event_id = value
+            # "event", "retry" and comments (empty field) are not used
+
+
+class EventWorker:
+    """
+    ``EventWorker``
+
+    Long-running worker fixing the pages within seconds of the edit that put them in the
+    source category of one of the HANDLERS. The recent changes of the wiki are read from
+    an EventStreams feed; edits and category changes of the same page are collected until
+    the page has had no events for ``debounce`` seconds, then the pages are checked with
+    one query (categories and templates) and given to the bots of their categories.
+
+    Example usage:
+
+    ```python
+    worker = EventWorker(url="http://localhost:8000/stream", debounce=5)
+    worker.run()
+    ```
+    """
+
+    def __init__(
+        self,
+        url: str = DEFAULT_STREAM_URL,
+        debounce: float = DEFAULT_DEBOUNCE,
+        handlers: tuple[Handler, ...] = HANDLERS,
+        custom_opts: dict[str, Any] | None = None,
+        site=None,
+        session: requests.Session | None = None,
+    ):
+        self.url = url
+        self.debounce = debounce
+        self.handlers = handlers
+        self.custom_opts = custom_opts or {}
+        self.site = site or pywikibot.Site()
+        self.session = session
+        self.wiki = self.site.dbName()
+        self.categories = {
+            pywikibot.Category(self.site, handler.category).title(): handler
+            for handler in handlers
+        }
+        self.pending = {}  # type: dict[str, float]
+        self.events = queue.Queue()  # type: queue.Queue[str]
+        self.last_event_id = None  # type: str | None
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        """
+        Read the stream and dispatch the pages until ``stop`` is called
+        :return: None
+        """
+        reader = threading.Thread(target=self._read, name="EventStream", daemon=True)
+        reader.start()
+        logging.info(f"Listening to {self.url} for {self.wiki}")
+        while not self.stopped.is_set():
+            try:
+                title = self.events.get(timeout=self._time_to_next_due())
+                self.pending[title] = time.monotonic()
+            except queue.Empty:
+                pass
+            due = self.pop_due_pages()
+            if due:
+                self.dispatch(due)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def get_titles(self, event: dict[str, Any]) -> list[str]:
+        """
+        :param event: a recentchange event
+        :return: the titles of the pages of this wiki that may have entered a source category
+        """
+        if event.get("wiki") != self.wiki or event.get("user") == self.site.username():
+            return []
+        if event.get("type") in ("edit", "new") and event.get("namespace") == 0:
+            return [event["title"]]
+        if event.get("type") == "categorize" and event.get("title") in self.categories:
+            match = CATEGORIZED_PAGE_PATTERN.search(event.get("comment", ""))
+            return [match.group(1)] if match else []
+        return []
+
+    def pop_due_pages(self) -> list[str]:
+        """
+        :return: the pages with no events in the last ``debounce`` seconds, removed
+                 from the pending ones
+        """
+        now = time.monotonic()
+        due = [
+            title for title, last in self.pending.items() if now - last >= self.debounce
+        ]
+        for title in due:
+            del self.pending[title]
+        return due
+
+    def dispatch(self, titles: list[str]) -> None:
+        """
+        Run the bots on the given pages, each on the pages in its source category
+        :param titles: the titles of the pages
+        :return: None
+        """
+        for handler, pages in self._match_handlers(titles).items():
+            logging.info(f"{handler.bot_class.__name__}: {', '.join(pages)}")
+            generator = preload_pages(
+                (pywikibot.Page(self.site, title) for title in pages), handler.preload
+            )
+            try:
+                bot = handler.bot_class(
+                    generator=generator,
+                    custom_opts={**self.custom_opts, **handler.bot_opts},
+                    **handler.bot_kwargs,
+                )
+                bot.run()
+            except Exception as e:
+                # keep listening: the pages are handled again by the next edit or batch run
+                logging.error(f"{handler.bot_class.__name__} failed on {pages}: {e}")
+
+    def _match_handlers(self, titles: list[str]) -> dict[Handler, list[str]]:
+        templates = {
+            pywikibot.Page(self.site, template, ns=10).title(): handler
+            for handler in self.handlers
+            for template in handler.templates
+        }
+        query = api.PropertyGenerator(
+            "categories|templates",
+            site=self.site,
+            titles=titles,
+            clcategories=list(self.categories),
+            tltemplates=list(templates),
+            cllimit="max",
+            tllimit="max",
+        )
+        matches = {}
+        for pagedata in query:
+            used = {templates[t["title"]] for t in pagedata.get("templates", [])}
+            for category in pagedata.get("categories", []):
+                handler = self.categories[category["title"]]
+                if handler in used:
+                    matches.setdefault(handler, []).append(pagedata["title"])
+        return matches
+
+    def _time_to_next_due(self) -> float:
+        if not self.pending:
+            return self.debounce
+        oldest = min(self.pending.values())
+        return max(0.0, oldest + self.debounce - time.monotonic())
+
+    def _read(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                for event_id, data in iter_sse_events(
+                    self.url, self.last_event_id, self.session
+                ):
+                    self.last_event_id = event_id or self.last_event_id
+                    try:
+                        event = json.loads(data)
+                    except json.JSONDecodeError:
+                        continue
+                    for title in self.get_titles(event):
+                        self.events.put(title)
+                    if self.stopped.is_set():
+                        return
+            except Exception as e:
+                # connection errors, but also truncated chunks or decoding errors:
+                # the reader must not die while the worker keeps waiting for events
+                logging.warning(f"Event stream interrupted ({e!r})")
+            logging.info(f"Reconnecting to the event stream in {RECONNECT_DELAY}s")
+            time.sleep(RECONNECT_DELAY)
+
+
+def set_custom_opts(args: list[str]) -> dict[str, Any]:
+    """
+    Set custom options for the given arguments.
+    In particular following options are supported (i.e. read from command line):
+
+    -stream:<url> - The EventStreams url (default: the Wikimedia recentchange stream).
+    -debounce:<seconds> - Wait for the page to have no events for this long (default: 30).
+    -wdindex:<path> - Passed to the bots, see itemlist_wikidata_completer.
+    -resolver:<resolver> - Passed to the bots, see itemlist_wikidata_completer.
+
+    :param args: List of command line arguments.
+    :return: Dictionary of custom options.
+    """
+    custom_opts = dict()
+
+    if any(arg.startswith("-stream") for arg in args):
+        custom_opts["stream"] = args[
+            [arg.startswith("-stream") for arg in args].index(True)
+        ].split(":", 1)[1]
+
+    if any(arg.startswith("-debounce") for arg in args):
+        custom_opts["debounce"] = float(
+            args[[arg.startswith("-debounce") for arg in args].index(True)].split(":")[
+                1
+            ]
+        )
+
+    if any(arg.startswith("-wdindex") for arg in args):
+        custom_opts["wdindex"] = args[
+            [arg.startswith("-wdindex") for arg in args].index(True)
+        ].split(":", 1)[1]
+
+    if any(arg.startswith("-resolver") for arg in args):
+        custom_opts["resolver"] = args[
+            [arg.startswith("-resolver") for arg in args].index(True)
+        ].split(":")[1]
+
+    return custom_opts
+
+
+def main():
+    local_args = pywikibot.handle_args()
+    custom_opts = set_custom_opts(local_args)
+    worker = EventWorker(
+        url=custom_opts.pop("stream", DEFAULT_STREAM_URL),
+        debounce=custom_opts.pop("debounce", DEFAULT_DEBOUNCE),
+        custom_opts=custom_opts,
+    )
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+        logging.info("Stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,51 +4,90 @@ from pywikibot import logging
 from pywikibot.bot import ExistingPageBot
 
 # LOCAL IMPORTS
+import timing
 from WikibaseHelper import WikibaseHelper
+from entity_cache import EntityCache
+from wikidata_index import WikidataIndex
+from page_journal import JournaledBot
 from pwb_aux import setup_generator
+from recent_changes import commit_run
+from save_queue import SaveQueue
+from voy_aux import ArticleTypeLookup, ArticleTypes, TemplateIndex, as_template_index
 
 SOURCE_CATEGORY = "Mappa dinamica senza coordinate"
+MATCHES_FILE = "dynamic_map_matches.txt"
 DYNAMIC_MAP_TEMPLATE = "MappaDinamica\n"  # Peculiar case
 DYNAMIC_MAP_LAT_PARAM = "Lat"
 DYNAMIC_MAP_LON_PARAM = "Long"
 DYNAMIC_MAP_ZOOM_PARAM = "z"
 DYNAMIC_MAP_HEIGHT_PARAM = "h"
 DYNAMIC_MAP_WIDTH_PARAM = "w"
+# More or less an informed guess, needs to be checked
+ZOOM_BY_ARTICLE_TYPE = {
+    ArticleTypes.CITY: "12",
+    ArticleTypes.REGION: "6",
+    ArticleTypes.DISTRICT: "10",
+    ArticleTypes.PARK: "10",
+    ArticleTypes.ARCHEOLOGICAL_SITE: "10",
+}
 
 
-class DynamicMapFiller(ExistingPageBot):
+class DynamicMapFiller(JournaledBot, timing.TimedBot, ExistingPageBot):
 
-    def __init__(self, **kwargs):
+    def __init__(self, custom_opts, **kwargs):
         super().__init__(**kwargs)
-        self.wd_helper = WikibaseHelper()
+        self.wd_helper = WikibaseHelper(
+            cache=EntityCache(),
+            index=(
+                WikidataIndex(custom_opts["wdindex"])
+                if "wdindex" in custom_opts
+                else None
+            ),
+        )
+        self.article_types = ArticleTypeLookup()
+        self.generator = self.article_types.classify(self.generator)
         self.matches = []
+        # None to only log the number of matches, e.g. in the event worker
+        self.matches_file = custom_opts.get("matchesfile", MATCHES_FILE)
+        self.saves = SaveQueue()
 
     def treat_page(self) -> None:
         logging.info(f"Processing page {self.current_page}")
 
         self.matches.append(self.current_page.title())
-        content = self.current_page.text
-        wikicode = mwparserfromhell.parse(content)
+        with timing.span("fetch.text"):
+            content = self.current_page.text
+        with timing.span("parse"):
+            wikicode = mwparserfromhell.parse(content)
+            templates = TemplateIndex.from_wikicode(wikicode)
 
-        templates = wikicode.filter_templates()
-        self._process_dynamic_map(templates)
+        with timing.span("process"):
+            self._process_dynamic_map(templates)
 
-        content = str(wikicode)
+        with timing.span("format"):
+            content = str(wikicode)
         if content != self.current_page.text:
             pywikibot.showDiff(content, self.current_page.text)
             self.current_page.text = content
-            self.current_page.save(
+            self.saves.put(
+                self.current_page,
                 summary="Aggiungo le coordinate alla mappa dinamica",
                 watch="nochange",
                 minor=True,
             )
 
     def teardown(self) -> None:
+        self.saves.close()
+        commit_run(self.saves.failed)
         logging.info(f"Found {len(self.matches)} matches")
-        with open("dynamic_map_matches.txt", "w") as f:
-            f.write(f"Found {len(self.matches)} matches\n")
-            for match in self.matches:
-                f.write(f"* [[{match}]]\n")
+        if self.matches_file is not None:
+            with open(self.matches_file, "w") as f:
+                f.write(f"Found {len(self.matches)} matches\n")
+                for match in self.matches:
+                    f.write(f"* [[{match}]]\n")
+        self.wd_helper.report()
+        self.wd_helper.close()
+        timing.report()
 
     def _process_dynamic_map(self, templates) -> None:
         """
@@ -57,62 +96,44 @@ class DynamicMapFiller(ExistingPageBot):
         :param templates:
         :return:
         """
-        for template in templates:
-            # Conditions (We iterate a category that is supposed to contain only dynamic maps without coordinates)
-            if template.name == DYNAMIC_MAP_TEMPLATE:
-                wikidata_id = self.current_page.data_item()
-                logging.info(
-                    f"Found wikidata item for {self.current_page}: {wikidata_id.title()}"
-                )
+        # We iterate a category that is supposed to contain only dynamic maps without coordinates
+        for template in as_template_index(templates).get(DYNAMIC_MAP_TEMPLATE):
+            wikidata_id = self.current_page.data_item()
+            logging.info(
+                f"Found wikidata item for {self.current_page}: {wikidata_id.title()}"
+            )
 
-                coords = self.wd_helper.get_lat_long(wikidata_id.title())
+            coords = self.wd_helper.get_lat_long(wikidata_id.title())
 
-                if coords[0] is None:
-                    logging.warning(
-                        f"\tCould not find coordinates for {self.current_page} -- keeping empty"
-                    )
-                else:
-                    logging.info(
-                        f"\tFound coordinates for {self.current_page}: {coords}"
-                    )
-                    template.add(
-                        DYNAMIC_MAP_LAT_PARAM,
-                        str(" " + coords[0]),
-                        before=DYNAMIC_MAP_HEIGHT_PARAM,
-                        preserve_spacing=True,
-                    )
+            if coords[0] is None:
+                logging.warning(
+                    f"\tCould not find coordinates for {self.current_page} -- keeping empty"
+                )
+            else:
+                logging.info(f"\tFound coordinates for {self.current_page}: {coords}")
+                template.add(
+                    DYNAMIC_MAP_LAT_PARAM,
+                    str(" " + coords[0]),
+                    before=DYNAMIC_MAP_HEIGHT_PARAM,
+                    preserve_spacing=True,
+                )
+                template.add(
+                    DYNAMIC_MAP_LON_PARAM,
+                    str(" " + coords[1]),
+                    before=DYNAMIC_MAP_HEIGHT_PARAM,
+                    preserve_spacing=True,
+                )
+
+                article_type = self.article_types.get_article_type(self.current_page)
+                if article_type in ZOOM_BY_ARTICLE_TYPE:
                     template.add(
-                        DYNAMIC_MAP_LON_PARAM,
-                        str(" " + coords[1]),
-                        before=DYNAMIC_MAP_HEIGHT_PARAM,
+                        DYNAMIC_MAP_ZOOM_PARAM,
+                        ZOOM_BY_ARTICLE_TYPE[article_type],
                         preserve_spacing=True,
                     )
 
-                    # More or less an informed guess, needs to be checked
-                    if self.is_in_at_least_one_cat(["Città"]):
-                        template.add(
-                            DYNAMIC_MAP_ZOOM_PARAM, "12", preserve_spacing=True
-                        )
-                    elif self.is_in_at_least_one_cat(["Regione"]):
-                        template.add(DYNAMIC_MAP_ZOOM_PARAM, "6", preserve_spacing=True)
-                    elif self.is_in_at_least_one_cat(["Distretto"]):
-                        template.add(
-                            DYNAMIC_MAP_ZOOM_PARAM, "10", preserve_spacing=True
-                        )
-                    elif self.is_in_at_least_one_cat(["Parco", "Sito archeologico"]):
-                        template.add(
-                            DYNAMIC_MAP_ZOOM_PARAM, "10", preserve_spacing=True
-                        )
-
         return templates
 
-    def is_in_at_least_one_cat(self, category: list[str]) -> bool:
-
-        cat_fullnames = [f"Categoria:{cat}" for cat in category]
-
-        # Check at least one category is present
-        return any(cat in self.current_page.categories() for cat in cat_fullnames)
-
 
 def prepare_generator_args() -> list[str]:
     """
@@ -130,10 +151,31 @@ def prepare_generator_args() -> list[str]:
     return args
 
 
+def set_custom_opts(args: list[str]) -> dict[str, str]:
+    """
+    Set custom options for the given arguments.
+    In particular following options are supported (i.e. read from command line):
+
+    -wdindex:<path> - Read the wikidata items from a local index built with wikidata_index.py
+
+    :param args: List of command line arguments.
+    :return: Dictionary of custom options.
+    """
+    custom_opts = dict()
+
+    if any(arg.startswith("-wdindex") for arg in args):
+        custom_opts["wdindex"] = args[
+            [arg.startswith("-wdindex") for arg in args].index(True)
+        ].split(":", 1)[1]
+
+    return custom_opts
+
+
 def main():
     local_args = prepare_generator_args()
-    generator, options = setup_generator(local_args)
-    bot = DynamicMapFiller(generator=generator, **options)
+    generator, options = setup_generator(local_args, preload=("revisions", "pageprops"))
+    custom_opts = set_custom_opts(local_args)
+    bot = DynamicMapFiller(generator=generator, custom_opts=custom_opts, **options)
     bot.run()
 
 
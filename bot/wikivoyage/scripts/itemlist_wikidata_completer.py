@@ -1,4 +1,4 @@
-from typing import Any, Iterable
+from typing import Any, Iterable, NamedTuple
 
 import mwparserfromhell
 import pywikibot
@@ -6,14 +6,24 @@ from mwparserfromhell.nodes import Template
 from mwparserfromhell.wikicode import Wikicode
 from pywikibot import logging
 from pywikibot.bot import ExistingPageBot
-from WikibaseHelper import WikibaseHelper
-from pwb_aux import setup_generator
+from WikibaseHelper import WikibaseHelper, SitelinkResolvers, SitelinkMatch
+from entity_cache import EntityCache
+from wikidata_index import WikidataIndex
+from page_journal import JournaledBot, defer_record
+from pwb_aux import setup_generator, PagePrefetcher
+from recent_changes import commit_run
+import timing
+from review_bundle import ReviewBundle, get_review_opts
+from save_queue import SaveQueue
 from voy_aux import (
     format_template_params,
     terminate_before_section_level_two,
     add_quickbar_image,
     add_banner_image,
     add_mappa_dinamica,
+    TemplateIndex,
+    as_template_index,
+    normalize_template_name,
 )
 
 # --- it.wikivoyage specific constants ---
@@ -26,9 +36,18 @@ ALT_PARAM_NAME = "alt"
 LAT_PARAM_NAME = "lat"
 LON_PARAM_NAME = "long"
 DESCRIPTION_PARAM_NAME = "descrizione"
+DEFAULT_PREFETCH_PAGES = 3  # pages prepared ahead in interactive mode
 
 
-class ItemListWikidataCompleter(ExistingPageBot):
+class PreparedPage(NamedTuple):
+    """Network-bound part of the work on a page, done ahead by ``prepare_page``"""
+
+    wikicode: Wikicode
+    matches: dict[str, SitelinkMatch]
+    data_item: pywikibot.ItemPage
+
+
+class ItemListWikidataCompleter(JournaledBot, timing.TimedBot, ExistingPageBot):
     """
     ``ItemListWikidataCompleter``
 
@@ -41,6 +60,7 @@ class ItemListWikidataCompleter(ExistingPageBot):
     Methods:
         - ``__init__``: Constructs a new ``ItemListWikidataCompleter`` object.
         - ``edit_opts``: Returns options for editing the page.
+        - ``prepare_page``: Fetches and parses a page and looks up its wikidata items, possibly ahead in a worker thread.
         - ``treat_page``: Processes a page by extracting templates, adding wikidata ids and saving the page.
         - ``process_templates``: Processes templates by checking if they are target templates and adding wikidata ids if missing.
         - ``_process_coordinates``: Adds coordinates to the template if they exist.
@@ -56,8 +76,36 @@ class ItemListWikidataCompleter(ExistingPageBot):
 
     def __init__(self, custom_opts, **kwargs):
         super().__init__(**kwargs)
-        self.wikibase_helper = WikibaseHelper()
+        self.wikibase_helper = WikibaseHelper(
+            cache=EntityCache(),
+            resolver=custom_opts.get("resolver", SitelinkResolvers.SPARQL.value),
+            index=(
+                WikidataIndex(custom_opts["wdindex"])
+                if "wdindex" in custom_opts
+                else None
+            ),
+        )
         self.interactive = custom_opts.get("interactive", False)
+        self.saves = SaveQueue()
+
+        # Write the edits to a review bundle instead of asking, see review_bundle
+        self.plan = None
+        if "plan" in custom_opts:
+            if self.interactive:
+                raise ValueError("-plan runs unattended, it can't be -interactive")
+            self.plan = ReviewBundle(custom_opts["plan"])
+            self.plan.start()
+
+        # Prepare the next pages while the operator reviews the current one
+        prefetch_pages = custom_opts.get(
+            "prefetch", DEFAULT_PREFETCH_PAGES if self.interactive else 0
+        )
+        self.prefetcher = None
+        if prefetch_pages > 0 and getattr(self, "generator", None) is not None:
+            self.prefetcher = PagePrefetcher(
+                self.generator, self.prepare_page, ahead=prefetch_pages
+            )
+            self.generator = iter(self.prefetcher)
 
     @property
     def edit_opts(self):
@@ -77,6 +125,19 @@ class ItemListWikidataCompleter(ExistingPageBot):
             "bot": True,
         }
 
+    def teardown(self) -> None:
+        self.saves.close()
+        commit_run(self.saves.failed)
+        if self.plan is not None:
+            pywikibot.output(
+                f"{self.plan.proposed} edits written to {self.plan.path}, review them with "
+                f"`pwb review_bundle -bundle:{self.plan.path}`"
+            )
+        self.wikibase_helper.report()
+        self.wikibase_helper.close()
+        timing.report()
+        super().teardown()
+
     def get_current_page_url(self):
         """
         Returns the current page URL in the format "https://{lang}.{family}.org/wiki/{title}".
@@ -89,70 +150,129 @@ class ItemListWikidataCompleter(ExistingPageBot):
 
         return f"https://{lang}.{family}.org/wiki/{title}"
 
+    def prepare_page(self, page: pywikibot.Page) -> PreparedPage:
+        """
+        Does the network-bound work for a page: loads and parses the text, resolves the
+        names of the Itemlist entries and loads the wikidata items needed later.
+        Runs in a worker thread when prefetching, so it must not use ``self.current_page``.
+
+        :param page: the page to prepare
+        :return: the parsed page with the wikidata matches of its entries
+        """
+        with timing.span("fetch.text"):
+            text = page.text
+        with timing.span("parse"):
+            wikicode = mwparserfromhell.parse(text)
+            entries = self._collect_entries(TemplateIndex.from_wikicode(wikicode))
+        with timing.span("resolve"):
+            matches = self.wikibase_helper.resolve_article_names(
+                (name_label, alt_label) for _, name_label, alt_label in entries
+            )
+            data_item = page.data_item()
+
+            # Load all the needed items at once
+            self.wikibase_helper.prefetch(
+                [data_item.getID()]
+                + [
+                    match.qid
+                    for match in matches.values()
+                    if not match.is_disambiguation
+                ]
+            )
+        return PreparedPage(wikicode, matches, data_item)
+
     def treat_page(self):
         """
         Processes a page by extracting templates, adding wikidata ids and saving the page.
 
         :return: None
         """
-        # Get and parse the page wikicode
-        content = self.current_page.text
-        wikicode = mwparserfromhell.parse(content)
-
-        # Extract the templates from the page
-        templates = wikicode.filter_templates()
-
-        # Add wikidata ids to the templates if they are missing and can be found
-        self.process_templates(templates)
-
-        # Add quickbar image and banner image
-        self._process_quickbar(templates)
-
-        # Add mappa dinamica
-        self._process_map(wikicode, templates)
+        prepared = None
+        if self.prefetcher is not None:
+            # waiting for the worker thread, if the page isn't ready yet
+            with timing.span("prefetch.wait"):
+                prepared = self.prefetcher.pop_result(self.current_page)
+        if prepared is None:
+            prepared = self.prepare_page(self.current_page)
+        wikicode = prepared.wikicode
+
+        with timing.span("process"):
+            # Extract the templates from the page
+            templates = TemplateIndex.from_wikicode(wikicode)
+
+            # Add wikidata ids to the templates if they are missing and can be found
+            self.process_templates(templates, prepared.matches)
+
+            # Quickbar image and banner image: never added so far (the Quickbar was
+            # not found before the template index), enabling them would be a new
+            # mass edit of the Quickbars
+            # self._process_quickbar(templates, prepared.data_item)
+
+            # Add mappa dinamica
+            self._process_map(wikicode, templates, prepared.data_item)
 
         # Format the page
-        wikicode_str = str(wikicode)
-        wikicode_str = format_template_params(wikicode_str)
+        with timing.span("format"):
+            wikicode_str = str(wikicode)
+            wikicode_str = format_template_params(wikicode_str)
         # wikicode_str = terminate_before_section_level_two(wikicode_str)
 
         self._apply_changes(wikicode_str)
 
     def _apply_changes(self, content):
         """
-        Applies the changes to the page if the user accepts them.
+        Applies the changes to the page if the user accepts them,
+        or adds them to the review bundle in plan mode.
         :param content: str, the new content of the page
         :return: None
         """
         if content != self.current_page.text:
+            if self.plan is not None:
+                # not journaled: the edit is only saved once approved in the review
+                defer_record(self.current_page)
+                self.plan.propose(self.current_page, content, **self.edit_opts)
+                return
             pywikibot.showDiff(self.current_page.text, content)
-            prompt = self.user_confirm(
-                f"Do you want to accept these changes for {self.get_current_page_url()}?"
-            )
+            # time spent by the operator
+            with timing.span("confirm"):
+                prompt = self.user_confirm(
+                    f"Do you want to accept these changes for {self.get_current_page_url()}?"
+                )
             if prompt:
                 self.current_page.text = content
-                self.current_page.save(**self.edit_opts)
+                self.saves.put(self.current_page, **self.edit_opts)
 
-    def process_templates(self, templates: Iterable[Template]) -> None:
+    def process_templates(
+        self,
+        templates: TemplateIndex | Iterable[Template],
+        matches: dict[str, SitelinkMatch] | None = None,
+    ) -> None:
         """
         Processes templates to update the data and add additional information.
+        All the names of the page are resolved at once, then the wikidata items
+        found are loaded in one batch to get their coordinates.
 
         :param templates: List of templates to process.
-        :type templates: list
+        :type templates: TemplateIndex or list
+        :param matches: the names already resolved by ``prepare_page``, if any
         :return: None
         """
-        for template in templates:
-            # Conditions
-            conditions_are_met = self._check_conditions(template)
+        entries = self._collect_entries(templates)
 
-            # Skip other templates and those that already have a wikidata param filled
-            if not conditions_are_met:
-                continue
+        if matches is None:
+            matches = self.wikibase_helper.resolve_article_names(
+                (name_label, alt_label) for _, name_label, alt_label in entries
+            )
 
-            # Get the name and alt label of the item for further processing
-            name_label = template.get(NAME_PARAM_NAME).value.strip()
-            alt_label = template.get(ALT_PARAM_NAME, "").value.strip()
-            wikidata_id = self.try_retrieve_wikidata_id(name_label, alt_label)
+            # Load all the found items at once
+            self.wikibase_helper.prefetch(
+                match.qid for match in matches.values() if not match.is_disambiguation
+            )
+
+        for template, name_label, _ in entries:
+            wikidata_id = self.wikibase_helper.finalize_sitelink_match(
+                matches[name_label], name_label
+            )
 
             # Wikipedia has a page for the item, use it
             if wikidata_id:
@@ -168,6 +288,29 @@ class ItemListWikidataCompleter(ExistingPageBot):
                 f"\tCould not find wikidata item for {name_label} -- keeping empty"
             )
 
+    def _collect_entries(
+        self, templates: TemplateIndex | Iterable[Template]
+    ) -> list[tuple[Template, str, str]]:
+        """
+        Collects the Itemlist entries that need a wikidata id
+
+        :param templates: The templates of the page, or their index.
+        :return: A list of (template, name, alt name) tuples.
+        """
+        entries = []
+        for template in as_template_index(templates).get(
+            CITY_TEMPLATE_ITEM_NAME, DESTINATION_TEMPLATE_ITEM_NAME
+        ):
+            # Skip those that already have a wikidata param filled
+            if not self._check_wikidata_param_needs_processing(template):
+                continue
+
+            # Get the name and alt label of the item for further processing
+            name_label = template.get(NAME_PARAM_NAME).value.strip()
+            alt_label = template.get(ALT_PARAM_NAME, "").value.strip()
+            entries.append((template, name_label, alt_label))
+        return entries
+
     def try_retrieve_wikidata_id(self, name_label: str, alt_label: str) -> str:
 
         wikidata_id = (
@@ -219,9 +362,9 @@ class ItemListWikidataCompleter(ExistingPageBot):
         :param template: the template to check
         :return: True if the template is a target template, False otherwise
         """
-        return (
-            template.name == CITY_TEMPLATE_ITEM_NAME
-            or template.name == DESTINATION_TEMPLATE_ITEM_NAME
+        return normalize_template_name(str(template.name)) in (
+            CITY_TEMPLATE_ITEM_NAME,
+            DESTINATION_TEMPLATE_ITEM_NAME,
         )
 
     def _check_wikidata_param_needs_processing(self, template: Template) -> bool:
@@ -292,16 +435,25 @@ class ItemListWikidataCompleter(ExistingPageBot):
                 preserve_spacing=True,
             )
 
-    def _process_quickbar(self, templates: Iterable[Template]):
-        image = self.wikibase_helper.get_image(self.current_page.data_item())
-        banner = self.wikibase_helper.get_banner(self.current_page.data_item())
+    def _process_quickbar(
+        self,
+        templates: TemplateIndex | Iterable[Template],
+        data_item: pywikibot.ItemPage,
+    ):
+        image = self.wikibase_helper.get_image(data_item)
+        banner = self.wikibase_helper.get_banner(data_item)
         if image:
             add_quickbar_image(templates, image)
         if banner:
             add_banner_image(templates, banner)
 
-    def _process_map(self, wikicode: Wikicode, templates: Iterable[Template]) -> None:
-        coords = self.wikibase_helper.get_coords(self.current_page.data_item())
+    def _process_map(
+        self,
+        wikicode: Wikicode,
+        templates: TemplateIndex | Iterable[Template],
+        data_item: pywikibot.ItemPage,
+    ) -> None:
+        coords = self.wikibase_helper.get_coords(data_item)
         add_mappa_dinamica(wikicode, templates, coords, 8)
 
     def get_user_input(self, item_label):
@@ -336,13 +488,35 @@ def set_custom_opts(local_args):
     if any(arg.startswith("-interactive") for arg in local_args):
         custom_opts["interactive"] = True
 
+    if any(arg.startswith("-prefetch") for arg in local_args):
+        custom_opts["prefetch"] = int(
+            local_args[
+                [arg.startswith("-prefetch") for arg in local_args].index(True)
+            ].split(":")[1]
+        )
+
+    if any(arg.startswith("-wdindex") for arg in local_args):
+        custom_opts["wdindex"] = local_args[
+            [arg.startswith("-wdindex") for arg in local_args].index(True)
+        ].split(":", 1)[1]
+
+    if any(arg.startswith("-resolver") for arg in local_args):
+        custom_opts["resolver"] = local_args[
+            [arg.startswith("-resolver") for arg in local_args].index(True)
+        ].split(":")[1]
+
+    custom_opts.update(get_review_opts(local_args, "itemlist_wikidata_completer"))
+
     return custom_opts
 
 
 def main():
     local_args = prepare_generator_args()
-    generator, options = setup_generator(local_args)
     custom_opts = set_custom_opts(local_args)
+    if "apply" in custom_opts:
+        ReviewBundle(custom_opts["apply"]).apply()
+        return
+    generator, options = setup_generator(local_args, preload=("revisions", "pageprops"))
     bot = ItemListWikidataCompleter(
         generator=generator, custom_opts=custom_opts, **options
     )
@@ -8,8 +8,13 @@ from mwparserfromhell.wikicode import Wikicode
 from pywikibot.bot import ExistingPageBot
 from pywikibot import logging
 
+import timing
 from voy_aux import ArticleTypeCategories, ArticleTypes, ArticleTypeLookup
-from pwb_aux import setup_generator
+from dump_scan import scan_dump_in_parallel
+from page_journal import JournaledBot
+from pwb_aux import DumpSource, setup_generator
+from recent_changes import commit_run
+from transclusion_index import TransclusionIndex
 from WikibaseHelper import WikibaseHelper
 
 DEFAULT_SOURCE_CATEGORY = ArticleTypeCategories.REGION.value
@@ -19,16 +24,20 @@ WIKIDATA_SUBPARTS_PROP = "P527"
 STANDARD_TEMPLATE_COLOR = "StdColor"
 
 
-class MissingDynamicMapFinder(ExistingPageBot):
+class MissingDynamicMapFinder(JournaledBot, timing.TimedBot, ExistingPageBot):
     """
     IMPORTANT: DO NOT RUN AUTOMATICALLY -- STILL WORK IN PROGRESS
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self, transclusions: TransclusionIndex | None = None, **kwargs):
         super().__init__(**kwargs)
         self.found_matches = []
         self.no_region_list = []
         self.wikibase_helper = WikibaseHelper()
+        # shared by the workers of a parallel scan, see main
+        self.transclusions = transclusions or TransclusionIndex()
+        self.article_types = ArticleTypeLookup()
+        self.generator = self.article_types.classify(self.generator)
         self.target_section = None
         self.current_article_type = None
 
@@ -48,7 +57,7 @@ class MissingDynamicMapFinder(ExistingPageBot):
         :return: The page to be treated.
         """
         page = super().init_page(item)
-        self.current_article_type = ArticleTypeLookup.get_article_type(page)
+        self.current_article_type = self.article_types.get_article_type(page)
         self.set_target_section()
         return page
 
@@ -61,21 +70,24 @@ class MissingDynamicMapFinder(ExistingPageBot):
             raise ValueError(f"Unexpected article type {self.current_article_type}")
 
     def treat_page(self):
-        templates = self.current_page.templatesWithParams()
-        has_dynamic_map = any(
-            template[0].title(with_ns=False) == DYNAMIC_MAP_TEMPLATE
-            for template in templates
-        )
-        has_regionlist = any(
-            template[0].title(with_ns=False) == REGION_LIST_TEMPLATE
-            for template in templates
-        )
+        title = self.current_page.title()
+        has_dynamic_map = self.transclusions.uses(title, DYNAMIC_MAP_TEMPLATE)
+        has_regionlist = self.transclusions.uses(title, REGION_LIST_TEMPLATE)
 
         if not has_dynamic_map and not has_regionlist:
             self.found_matches.append(self.current_page.title())
             subregions = self.wikibase_helper.get_p_values(
                 self.current_page.data_item(), WIKIDATA_SUBPARTS_PROP
             )
+            # the map shapes and the region list must have the same subregions
+            subregion_items = self.wikibase_helper.get_many(subregions)
+            missing = [qid for qid in subregions if subregion_items.get(qid) is None]
+            if missing:
+                logging.warning(
+                    f"Page {title}: subregions not found on Wikidata, "
+                    f"left out: {', '.join(missing)}"
+                )
+                subregions = [qid for qid in subregions if qid not in missing]
             if not subregions:
                 logging.info(f"Page {self.current_page.title()} has no subregions")
                 return
@@ -128,23 +140,29 @@ class MissingDynamicMapFinder(ExistingPageBot):
         Width and height are set to 450px as per documentation and it.voy standard.
         :return:
         """
-        wikicode = mwparserfromhell.parse(self.current_page.text)
-        sections = wikicode.get_sections(flat=False, include_lead=False)
+        with timing.span("fetch.text"):
+            text = self.current_page.text
+        with timing.span("parse"):
+            wikicode = mwparserfromhell.parse(text)
+            sections = wikicode.get_sections(flat=False, include_lead=False)
 
         # find the section "Come orientarsi"
-        for section in sections:  # type: Wikicode
-            if section.startswith(f"== {self.target_section} =="):
-                dyn_map = self._insert_dynamic_map(section)
-                shapes_templates = self._insert_mapshapes(
-                    section, subregions_list, dyn_map
-                )
-                self._insert_region_list(section, subregions_list, shapes_templates)
-                break
+        with timing.span("process"):
+            for section in sections:  # type: Wikicode
+                if section.startswith(f"== {self.target_section} =="):
+                    dyn_map = self._insert_dynamic_map(section)
+                    shapes_templates = self._insert_mapshapes(
+                        section, subregions_list, dyn_map
+                    )
+                    self._insert_region_list(section, subregions_list, shapes_templates)
+                    break
 
         if self.current_page.text != str(wikicode):
             pywikibot.showDiff(self.current_page.text, str(wikicode))
             logging.info(f"SECTION:\n {section}")
-            self.user_confirm("Do you want to save these changes?")
+            # time spent by the operator
+            with timing.span("confirm"):
+                self.user_confirm("Do you want to save these changes?")
 
             # if prompt:
             #     self.current_page.text = str(wikicode)
@@ -158,11 +176,10 @@ class MissingDynamicMapFinder(ExistingPageBot):
     ):
 
         template = mwparserfromhell.nodes.Template(REGION_LIST_TEMPLATE + "\n")
+        subregion_items = self.wikibase_helper.get_many(subregions_list)
 
         for i, subregion in enumerate(subregions_list):
-            wikidata_item = pywikibot.ItemPage(
-                self.current_page.site.data_repository(), subregion
-            )
+            wikidata_item = subregion_items[subregion]
             label = (
                 wikidata_item.labels["it"]
                 if "it" in wikidata_item.labels
@@ -216,26 +233,30 @@ class MissingDynamicMapFinder(ExistingPageBot):
         return template
 
     def teardown(self) -> None:
+        commit_run()
         self.dump_findings()
         self.log_missing_region_list()
+        timing.report()
 
     def dump_findings(self):
-        logging.info(f"Found {len(self.found_matches)} matches")
-        with open(f"logs/missing_dynamic_map.txt", "w") as f:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            for match in self.found_matches:
-                f.write(
-                    f"* [[{match}]] <small>(check eseguito il {timestamp})</small>\n"
-                )
+        write_findings("logs/missing_dynamic_map.txt", self.found_matches)
 
     def log_missing_region_list(self):
-        logging.info(f"Found {len(self.no_region_list)} matches")
-        with open(f"logs/missing_region_list.txt", "w") as f:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            for match in self.no_region_list:
-                f.write(
-                    f"* [[{match}]] <small>(check eseguito il {timestamp})</small>\n"
-                )
+        write_findings("logs/missing_region_list.txt", self.no_region_list)
+
+
+def write_findings(filename: str, found_matches: list[str]):
+    """
+    Write a list of pages to the given log file
+    :param filename: the path of the log file
+    :param found_matches: the titles of the pages
+    :return: None
+    """
+    logging.info(f"Found {len(found_matches)} matches")
+    with open(filename, "w") as f:
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for match in found_matches:
+            f.write(f"* [[{match}]] <small>(check eseguito il {timestamp})</small>\n")
 
 
 def handle_opts() -> list[str]:
@@ -256,7 +277,26 @@ def handle_opts() -> list[str]:
 
 def main():
     local_args = handle_opts()
-    generator, options = setup_generator(local_args)
+    # the changes are only shown, never saved
+    generator, options = setup_generator(
+        local_args, preload=("revisions", "pageprops", "coordinates"), read_only=True
+    )
+    workers = options.pop("workers", None)
+    if workers and isinstance(generator, DumpSource):
+        # the workers cannot prompt: the proposed changes are only shown
+        options["always"] = True
+        # loaded once here instead of once per worker
+        transclusions = TransclusionIndex()
+        transclusions.load([DYNAMIC_MAP_TEMPLATE, REGION_LIST_TEMPLATE])
+        scan_dump_in_parallel(
+            MissingDynamicMapFinder,
+            generator,
+            workers,
+            result_attributes=("found_matches", "no_region_list"),
+            transclusions=transclusions,
+            **options,
+        )
+        return
     bot = MissingDynamicMapFinder(generator=generator, **options)
     bot.run()
 
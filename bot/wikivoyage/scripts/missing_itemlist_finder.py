@@ -3,7 +3,13 @@ from enum import Enum
 import pywikibot
 from pywikibot import logging
 from pywikibot.bot import ExistingPageBot
-from pwb_aux import setup_generator
+import timing
+from dump_scan import scan_dump_in_parallel
+from page_journal import JournaledBot
+from pwb_aux import DumpSource, setup_generator
+from recent_changes import commit_run
+from save_queue import SaveQueue
+from transclusion_index import TransclusionIndex
 
 
 class AllowedActions(Enum):
@@ -16,6 +22,8 @@ class AllowedActions(Enum):
 SOURCE_CATEGORY = "Regione"  # Very unlikely that articles with higher quality will be interesting here
 CATEGORY_TO_ADD = "Regioni senza Citylist o Destinationlist"
 DEFAULT_ACTION = AllowedActions.ADD_CAT.value
+CITYLIST_TEMPLATE = "Citylist"
+DESTINATIONLIST_TEMPLATE = "Destinationlist"
 
 EXCEPTIONS = [  # Too small to have a citylist
     "Gibilterra",
@@ -32,13 +40,18 @@ EXCLUDED_TITLES = [
 ]
 
 
-class MissingItemListFinder(ExistingPageBot):
+class MissingItemListFinder(JournaledBot, timing.TimedBot, ExistingPageBot):
 
-    def __init__(self, custom_opts, **kwargs):
+    def __init__(
+        self, custom_opts, transclusions: TransclusionIndex | None = None, **kwargs
+    ):
         super().__init__(**kwargs)
         self.service_cat = custom_opts.get("addcat", CATEGORY_TO_ADD)
         self.action = custom_opts.get("action", DEFAULT_ACTION)
         self.found_matches = []
+        # shared by the workers of a parallel scan, see main
+        self.transclusions = transclusions or TransclusionIndex()
+        self.saves = SaveQueue()
 
     @property
     def edit_opts(self):
@@ -64,13 +77,8 @@ class MissingItemListFinder(ExistingPageBot):
     def handle_categorization(self):
         logging.info(f"Checking page: {self.current_page.title()} for missing Itemlist")
 
-        # Handle exceptions
-        if self.current_page.title() in EXCEPTIONS:
-            logging.info(f"Skipping page {self.current_page.title()}")
-            return
-
-        # Handle excluded titles
-        if any(title in self.current_page.title() for title in EXCLUDED_TITLES):
+        # Handle exceptions and excluded titles
+        if is_excepted(self.current_page.title()):
             logging.info(f"Skipping page {self.current_page.title()}")
             return
 
@@ -121,7 +129,7 @@ class MissingItemListFinder(ExistingPageBot):
         self.current_page.text = self.current_page.text.replace(
             f"[[Category:{self.service_cat}]]", ""
         )
-        self.current_page.save(**self.edit_opts)
+        self.saves.put(self.current_page, **self.edit_opts)
 
     def treat_page(self):
 
@@ -139,45 +147,20 @@ class MissingItemListFinder(ExistingPageBot):
             raise ValueError(f"Invalid action: {self.action}")
 
     def teardown(self) -> None:
+        self.saves.close()
+        commit_run(self.saves.failed)
         if "dump" in self.action:
             self.dump_findings()
-
-    @staticmethod
-    def _get_template_page(template_name: str) -> pywikibot.Page:
-        site = pywikibot.Site()
-        page = pywikibot.Page(site, template_name, ns=10)
-        return page
+        timing.report()
 
     def _check_relevant_templates(self) -> tuple[bool, bool]:
-
-        citylist = MissingItemListFinder._get_template_page("Citylist")
-        destinationlist = MissingItemListFinder._get_template_page("Destinationlist")
-
-        has_citylist = False
-        has_destinationlist = False
-
-        templates = self.current_page.templates()
-
-        for template in templates:
-            if template == citylist:
-                has_citylist = True
-                break
-            if template == destinationlist:
-                has_destinationlist = True
-                break
-
+        title = self.current_page.title()
+        has_citylist = self.transclusions.uses(title, CITYLIST_TEMPLATE)
+        has_destinationlist = self.transclusions.uses(title, DESTINATIONLIST_TEMPLATE)
         return has_citylist, has_destinationlist
 
     def dump_findings(self):
-        logging.info(f"Found {len(self.found_matches)} matches")
-        with open(f"logs/missing_itemlits.txt", "w") as f:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            f.write(f"Matches for action {self.action}:\n")
-
-            for match in self.found_matches:
-                f.write(
-                    f"* [[{match}]] <small>(check eseguito il {timestamp})</small>\n"
-                )
+        write_findings(self.found_matches, self.action)
 
     def categorize(self):
         """Add a category to the current page if it's not already present.
@@ -199,7 +182,31 @@ class MissingItemListFinder(ExistingPageBot):
             f"Adding category {self.service_cat} to {self.current_page.title()}"
         )
         self.current_page.text += f"\n[[Categoria:{self.service_cat}]]"
-        self.current_page.save(**self.edit_opts)
+        self.saves.put(self.current_page, **self.edit_opts)
+
+
+def is_excepted(title: str) -> bool:
+    """
+    :param title: the title of a region article
+    :return: True if the article is not expected to have an Itemlist
+    """
+    return title in EXCEPTIONS or any(excluded in title for excluded in EXCLUDED_TITLES)
+
+
+def write_findings(found_matches: list[str], action: str):
+    """
+    Write the matches of the given action to ``logs/missing_itemlits.txt``
+    :param found_matches: the titles of the pages
+    :param action: the action of the run
+    :return: None
+    """
+    logging.info(f"Found {len(found_matches)} matches")
+    with open(f"logs/missing_itemlits.txt", "w") as f:
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        f.write(f"Matches for action {action}:\n")
+
+        for match in found_matches:
+            f.write(f"* [[{match}]] <small>(check eseguito il {timestamp})</small>\n")
 
 
 def handle_opts() -> list[str]:
@@ -248,8 +255,30 @@ def set_custom_opts(args: list[str]) -> dict[str, str]:
 
 def main():
     local_args = handle_opts()
-    generator, options = setup_generator(local_args)
     custom_opts = set_custom_opts(local_args)
+    generator, options = setup_generator(
+        local_args,
+        preload=(),
+        read_only="dump" in custom_opts.get("action", DEFAULT_ACTION),
+    )
+    workers = options.pop("workers", None)
+    if workers and isinstance(generator, DumpSource):
+        if "dump" not in custom_opts.get("action", DEFAULT_ACTION):
+            raise ValueError(
+                "-workers can only be used with -action:add-dump or -action:remove-dump"
+            )
+        # loaded once here instead of once per worker
+        transclusions = TransclusionIndex()
+        transclusions.load([CITYLIST_TEMPLATE, DESTINATIONLIST_TEMPLATE])
+        scan_dump_in_parallel(
+            MissingItemListFinder,
+            generator,
+            workers,
+            custom_opts=custom_opts,
+            transclusions=transclusions,
+            **options,
+        )
+        return
     bot = MissingItemListFinder(generator=generator, custom_opts=custom_opts, **options)
     bot.run()
 
@@ -0,0 +1,203 @@
+import atexit
+import itertools
+import os
+import sqlite3
+import time
+import threading
+from typing import Any, Iterable, Iterator
+
+import pywikibot
+from pywikibot import logging
+from pywikibot.data import api
+
+DEFAULT_JOURNAL_PATH = "cache/journal.sqlite"
+DEFAULT_OUTCOME = "done"
+JOURNAL_BATCH_SIZE = 50
+
+
+def record_outcome(page: pywikibot.Page, outcome: str) -> None:
+    """
+    Record a page handled by the bot with the given outcome, if it comes from a
+    journaled generator (see ``PageJournal.track``), e.g. "edited" once it is saved
+    :param page: the page
+    :param outcome: a short description of what the bot did with the page
+    :return: None
+    """
+    journal = getattr(page, "_journal", None)
+    if journal is not None:
+        journal.record(page, outcome)
+
+
+def defer_record(page: pywikibot.Page) -> None:
+    """
+    Don't record the page when the bot is done with it: it is recorded later with
+    ``record_outcome``, e.g. when its edit is queued and will be saved in the background
+    :param page: the page being handled
+    :return: None
+    """
+    page._journal_deferred = True
+
+
+class JournaledBot:
+    """
+    ``JournaledBot``
+
+    Bot mixin recording each page in the journal once ``treat`` has returned, with the
+    "done" outcome unless the recording was deferred (see ``defer_record``). Pages
+    skipped by the bot or whose treatment failed are not recorded, so a resumed run
+    handles them again. Pages not coming from a journaled generator are ignored.
+
+    Example usage:
+
+    ```python
+    class EmptySectionFinder(JournaledBot, ExistingPageBot):
+        ...
+    ```
+    """
+
+    def treat(self, page: Any) -> None:
+        super().treat(page)
+        if not getattr(page, "_journal_deferred", False):
+            record_outcome(page, DEFAULT_OUTCOME)
+
+
+class PageJournal:
+    """
+    ``PageJournal``
+
+    Journal of the pages handled by a script: title, revision id and outcome, in a SQLite
+    file shared by all the scripts (a ``read_only`` journal, e.g. in a simulation, is
+    only used to skip pages). ``track`` wraps a page generator and attaches the journal
+    to its pages, which are recorded once the bot has handled them (see
+    ``JournaledBot``); with ``resume`` it also skips the pages whose latest revision was
+    already handled, so an interrupted or repeated run only looks at the pages it has
+    not seen yet or that changed since.
+
+    Example usage:
+
+    ```python
+    journal = PageJournal("empty_section_finder")
+    generator = journal.track(generator, resume=True)
+    ```
+    """
+
+    def __init__(
+        self, script: str, path: str = DEFAULT_JOURNAL_PATH, read_only: bool = False
+    ):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.script = script
+        self.read_only = read_only
+        self.skipped = 0
+        # pages are also recorded by the put thread once saved (see SaveQueue)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                script TEXT NOT NULL,
+                title TEXT NOT NULL,
+                revid INTEGER NOT NULL,
+                outcome TEXT NOT NULL,
+                handled_at REAL NOT NULL,
+                PRIMARY KEY (script, title)
+            )"""
+        )
+        self.connection.commit()
+        # the last records are committed when the script exits
+        atexit.register(self.close)
+
+    def track(
+        self, pages: Iterable[pywikibot.Page], resume: bool = False
+    ) -> Iterator[pywikibot.Page]:
+        """
+        Attach the journal to the pages of a generator, with the revision the bot sees,
+        so that they are recorded once handled
+        :param pages: the pages
+        :param resume: skip the pages whose latest revision is already in the journal
+        :return: a generator of the pages to handle
+        """
+        pages = iter(pages)
+        while batch := list(itertools.islice(pages, JOURNAL_BATCH_SIZE)):
+            revids = self._get_revids(batch)
+            if resume:
+                batch = self._drop_unchanged(batch, revids)
+            for page in batch:
+                page._journal = self
+                page._journal_revid = revids.get(page.title(), 0)
+            yield from batch
+        if resume:
+            logging.info(f"Skipped {self.skipped} pages already in the journal")
+
+    def record(self, page: pywikibot.Page, outcome: str = DEFAULT_OUTCOME) -> None:
+        """
+        :param page: a page handled by the bot, from ``track``
+        :param outcome: a short description of what the bot did with the page
+        :return: None
+        """
+        if self.read_only:
+            return
+        revid = getattr(page, "_journal_revid", 0)
+        with self._lock:
+            if self.connection is None:
+                return
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                (self.script, page.title(), revid, outcome, time.time()),
+            )
+            # committed in batches: an interrupted run handles at most a batch again
+            self._uncommitted += 1
+            if self._uncommitted >= JOURNAL_BATCH_SIZE:
+                self.connection.commit()
+                self._uncommitted = 0
+
+    def _drop_unchanged(
+        self, batch: list[pywikibot.Page], revids: dict[str, int]
+    ) -> list[pywikibot.Page]:
+        titles = [page.title() for page in batch]
+        with self._lock:
+            handled = dict(
+                self.connection.execute(
+                    f"SELECT title, revid FROM pages WHERE script = ? "
+                    f"AND title IN ({','.join('?' * len(titles))})",
+                    [self.script, *titles],
+                )
+            )
+        kept = [
+            page
+            for page in batch
+            if page.title() not in handled
+            or handled[page.title()] != revids.get(page.title())
+        ]
+        self.skipped += len(batch) - len(kept)
+        return kept
+
+    @staticmethod
+    def _get_revids(batch: list[pywikibot.Page]) -> dict[str, int]:
+        """
+        :return: the latest revision id of each page, from the page itself when known
+                 (pages read from a dump or preloaded), else with one query for the whole batch
+        """
+        revids = {
+            page.title(): page._revid for page in batch if getattr(page, "_revid", None)
+        }
+        missing = [page.title() for page in batch if page.title() not in revids]
+        if missing:
+            query = api.PropertyGenerator("info", site=batch[0].site, titles=missing)
+            for pagedata in query:
+                if "lastrevid" in pagedata:
+                    revids[pagedata["title"]] = pagedata["lastrevid"]
+        return revids
+
+    def close(self) -> None:
+        """
+        Commit the last records and close the journal
+        :return: None
+        """
+        with self._lock:
+            if self.connection is not None:
+                self.connection.commit()
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,370 @@
+from abc import ABC, abstractmethod
+from functools import cached_property
+
+import mwparserfromhell
+import pywikibot
+from mwparserfromhell.wikicode import Wikicode
+from pywikibot import logging
+from pywikibot.bot import ExistingPageBot
+
+import empty_section_finder
+import timing
+import list_articles_without_map
+import missing_itemlist_finder
+import template_x_cat
+from missing_itemlist_finder import AllowedActions
+from page_journal import JournaledBot
+from pwb_aux import setup_generator
+from recent_changes import commit_run
+from voy_aux import TemplateIndex, normalize_template_name
+
+CHECKS = {}  # type: dict[str, type[Check]]
+
+
+def register_check(name: str):
+    """
+    Class decorator adding a check to the registry, under the name used with ``-checks``
+    :param name: the name of the check
+    """
+
+    def decorator(cls: type["Check"]) -> type["Check"]:
+        cls.name = name
+        CHECKS[name] = cls
+        return cls
+
+    return decorator
+
+
+class PageRecord:
+    """
+    ``PageRecord``
+
+    A page as seen by the checks of a scan. Text, parsed wikicode, template names
+    and categories are computed on first use and shared by all the checks,
+    so each of them is fetched or parsed at most once per page.
+    """
+
+    def __init__(self, page: pywikibot.Page):
+        self.page = page
+        self.title = page.title()
+        self._sections = {}
+
+    @cached_property
+    def text(self) -> str:
+        with timing.span("fetch.text"):
+            return self.page.text
+
+    @cached_property
+    def wikicode(self) -> Wikicode:
+        text = self.text
+        with timing.span("parse"):
+            return mwparserfromhell.parse(text)
+
+    @cached_property
+    def templates(self) -> TemplateIndex:
+        wikicode = self.wikicode
+        with timing.span("parse.templates"):
+            return TemplateIndex.from_wikicode(wikicode)
+
+    @cached_property
+    def template_names(self) -> set[str]:
+        return self.templates.names()
+
+    @cached_property
+    def categories(self) -> set[str]:
+        with timing.span("fetch.categories"):
+            return {
+                category.title(with_ns=False) for category in self.page.categories()
+            }
+
+    def get_sections(self, name: str) -> list[str]:
+        """
+        Found by scanning the headings, without parsing the page
+        :param name: the name of the section
+        :return: the sections with the given name, without their heading
+        """
+        if name not in self._sections:
+            self._sections[name] = empty_section_finder.find_sections(self.text, name)
+        return self._sections[name]
+
+
+class Check(ABC):
+    """
+    ``Check``
+
+    Base class of the checks run by ``PageScanner``. A check only reads the page record
+    and collects its findings; ``report`` writes them out at the end of the run.
+    ``category`` restricts the check to the pages in that category or in one of its
+    subcategories (None for all pages).
+    """
+
+    name = None  # type: str | None
+    category = None  # type: str | None
+
+    def __init__(self, custom_opts: dict):
+        self.found_matches = []
+        self._category_tree = None  # type: set[str] | None
+
+    @classmethod
+    def is_configured(cls, custom_opts: dict) -> bool:
+        """
+        :return: True if the check runs by default with the given options
+        """
+        return True
+
+    def applies_to(self, record: PageRecord) -> bool:
+        if self.category is None:
+            return True
+        if self._category_tree is None:
+            # resolved once per run, on the site of the first page
+            with timing.span("fetch.category_tree"):
+                self._category_tree = {self.category} | {
+                    category.title(with_ns=False)
+                    for category in pywikibot.Category(
+                        record.page.site, self.category
+                    ).subcategories(recurse=True)
+                }
+        return not self._category_tree.isdisjoint(record.categories)
+
+    @abstractmethod
+    def check(self, record: PageRecord) -> None:
+        """
+        Collect the findings of the check on a page
+        :param record: the page record
+        :return: None
+        """
+
+    @abstractmethod
+    def report(self) -> None:
+        """
+        Write out the findings, at the end of the run
+        :return: None
+        """
+
+
+@register_check("empty-section")
+class EmptySectionCheck(Check):
+    """Pages with an empty section, see ``EmptySectionFinder``"""
+
+    category = empty_section_finder.SOURCE_CATEGORY
+
+    def __init__(self, custom_opts: dict):
+        super().__init__(custom_opts)
+        self.section_name = custom_opts.get(
+            "section", empty_section_finder.SECTION_NAME
+        )
+        self.service_cat = custom_opts.get(
+            "addcat", empty_section_finder.CATEGORY_TO_ADD
+        )
+
+    def check(self, record: PageRecord) -> None:
+        sections = record.get_sections(self.section_name)
+        if len(sections) != 1:
+            logging.warning(
+                f"Found {len(sections)} '{self.section_name}' sections in {record.title}"
+            )
+            return
+        if empty_section_finder.EmptySectionFinder.is_section_empty(sections[0]):
+            self.found_matches.append(record.title)
+
+    def report(self) -> None:
+        empty_section_finder.write_findings(
+            self.found_matches, self.section_name, self.service_cat
+        )
+
+
+@register_check("missing-itemlist")
+class MissingItemlistCheck(Check):
+    """Region articles without Citylist and Destinationlist, see ``MissingItemListFinder``"""
+
+    category = missing_itemlist_finder.SOURCE_CATEGORY
+
+    def check(self, record: PageRecord) -> None:
+        if missing_itemlist_finder.is_excepted(record.title):
+            return
+        if not {"Citylist", "Destinationlist"} & record.template_names:
+            self.found_matches.append(record.title)
+
+    def report(self) -> None:
+        missing_itemlist_finder.write_findings(
+            self.found_matches, AllowedActions.ADD_DUMP.value
+        )
+
+
+@register_check("missing-map")
+class MissingMapCheck(Check):
+    """
+    Region articles without dynamic map and region list, and those with a dynamic map
+    but no region list, see ``MissingDynamicMapFinder``
+    """
+
+    category = list_articles_without_map.DEFAULT_SOURCE_CATEGORY
+
+    def __init__(self, custom_opts: dict):
+        super().__init__(custom_opts)
+        self.no_region_list = []
+
+    def check(self, record: PageRecord) -> None:
+        has_dynamic_map = (
+            list_articles_without_map.DYNAMIC_MAP_TEMPLATE in record.template_names
+        )
+        has_regionlist = (
+            list_articles_without_map.REGION_LIST_TEMPLATE in record.template_names
+        )
+        if not has_dynamic_map and not has_regionlist:
+            self.found_matches.append(record.title)
+        elif has_dynamic_map and not has_regionlist:
+            self.no_region_list.append(record.title)
+
+    def report(self) -> None:
+        list_articles_without_map.write_findings(
+            "logs/missing_dynamic_map.txt", self.found_matches
+        )
+        list_articles_without_map.write_findings(
+            "logs/missing_region_list.txt", self.no_region_list
+        )
+
+
+@register_check("template-x-cat")
+class TemplateCrossCatCheck(Check):
+    """
+    Pages using ``-template`` that are (not, with ``-negative``) in ``-targetcat``,
+    see ``TemplateCrossCat``
+    """
+
+    def __init__(self, custom_opts: dict):
+        super().__init__(custom_opts)
+        self.target_cat = custom_opts.get("targetcat", None)
+        if self.target_cat is None:
+            raise ValueError(
+                "No target category specified, Use -targetcat:TargetCategory"
+            )
+        self.template = custom_opts.get("template", None)
+        if self.template is not None:
+            self.template = normalize_template_name(self.template)
+        self.negative = custom_opts.get("negative", False)
+        self.outputfile = custom_opts.get("outputfile", "template_x_cat_results.txt")
+        self.format = custom_opts.get(
+            "format", template_x_cat.FileFormats.WIKITEXT.value
+        )
+
+    @classmethod
+    def is_configured(cls, custom_opts: dict) -> bool:
+        return "targetcat" in custom_opts
+
+    def check(self, record: PageRecord) -> None:
+        if self.template is not None and self.template not in record.template_names:
+            return
+        if (self.target_cat in record.categories) ^ self.negative:
+            self.found_matches.append(record.title)
+
+    def report(self) -> None:
+        template_x_cat.save_results(self.found_matches, self.outputfile, self.format)
+
+
+class PageScanner(JournaledBot, timing.TimedBot, ExistingPageBot):
+    """
+    ``PageScanner``
+
+    Runs several read-only checks in a single pass over the pages of the generator:
+    each page is fetched and parsed once into a ``PageRecord`` shared by all the checks,
+    and each check writes its usual report at the end of the run.
+
+    Example usage:
+
+    ```python
+    bot = PageScanner(generator=generator, custom_opts={"checks": ["empty-section"]})
+    bot.run()
+    ```
+    """
+
+    def __init__(self, custom_opts, **kwargs):
+        super().__init__(**kwargs)
+        names = custom_opts.get(
+            "checks",
+            [
+                name
+                for name, check in CHECKS.items()
+                if check.is_configured(custom_opts)
+            ],
+        )
+        unknown = [name for name in names if name not in CHECKS]
+        if unknown:
+            raise ValueError(
+                f"Unknown checks: {', '.join(unknown)}. Available: {', '.join(CHECKS)}"
+            )
+        self.checks = [CHECKS[name](custom_opts) for name in names]
+
+    def treat_page(self):
+        record = PageRecord(self.current_page)
+        logging.info(f"Checking page: {record.title}")
+        for check in self.checks:
+            if check.applies_to(record):
+                with timing.span(f"check.{check.name}"):
+                    check.check(record)
+
+    def teardown(self) -> None:
+        commit_run()
+        for check in self.checks:
+            check.report()
+        timing.report()
+
+
+def set_custom_opts(args: list[str]) -> dict[str, str | list[str] | bool]:
+    """
+    Set custom options for the given arguments.
+    In particular following options are supported (i.e. read from command line):
+
+    -checks:<name>,<name> - The checks to run, see CHECKS (default: all those
+                            that need no further options).
+    -section:<section_name> - empty-section: the name of the section to check for emptiness.
+    -addcat:<category_name> - empty-section: the service category written in the report.
+    -targetcat:<category_name> - template-x-cat: the category to check (required).
+    -template:<template_name> - template-x-cat: only check the pages using this template.
+    -negative - template-x-cat: look for the pages not in the target category.
+    -format:<format> - template-x-cat: the format of the output file.
+    -outputfile:<path> - template-x-cat: the path of the output file.
+
+    :param args: List of command line arguments.
+    :return: Dictionary of custom options.
+    """
+    custom_opts = dict()
+
+    if any(arg.startswith("-checks") for arg in args):
+        custom_opts["checks"] = (
+            args[[arg.startswith("-checks") for arg in args].index(True)]
+            .split(":")[1]
+            .split(",")
+        )
+
+    for option in [
+        "section",
+        "addcat",
+        "targetcat",
+        "template",
+        "format",
+        "outputfile",
+    ]:
+        if any(arg.startswith(f"-{option}:") for arg in args):
+            custom_opts[option] = args[
+                [arg.startswith(f"-{option}:") for arg in args].index(True)
+            ].split(":", 1)[1]
+
+    if any(arg.startswith("-negative") for arg in args):
+        custom_opts["negative"] = True
+
+    return custom_opts
+
+
+def main():
+    local_args = pywikibot.handle_args()
+    generator, options = setup_generator(
+        local_args, preload=("revisions", "categories"), read_only=True
+    )
+    custom_opts = set_custom_opts(local_args)
+    bot = PageScanner(generator=generator, custom_opts=custom_opts, **options)
+    bot.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,421 @@
-from typing import Iterable, Any
+import itertools
+import re
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import IO, Iterable, Any, Callable, Iterator
+from xml.etree.ElementTree import iterparse
 
+import pywikibot
 from pywikibot import pagegenerators
+from pywikibot.data import api
+from pywikibot.tools import open_archive
 
+import timing
+from page_journal import DEFAULT_JOURNAL_PATH, PageJournal
+from recent_changes import RecentChangesSource, get_source_categories
 
-def setup_generator(local_args: list[str]) -> tuple[Iterable | None, dict[str, Any]]:
+# Page data that can be preloaded, see preload_pages
+PRELOAD_PROPS = ("revisions", "categories", "templates", "pageprops", "coordinates")
+DEFAULT_PRELOAD_GROUPSIZE = 50
+_PRELOAD_LIMITS = {"categories": "cl", "templates": "tl", "coordinates": "co"}
+
+
+def setup_generator(
+    local_args: list[str],
+    preload: Iterable[str] = PRELOAD_PROPS,
+    preload_groupsize: int = DEFAULT_PRELOAD_GROUPSIZE,
+    read_only: bool = False,
+) -> tuple[Iterable | None, dict[str, Any]]:
+    """
+    Build the page generator from the command line arguments.
+    The pages from the wiki are preloaded in groups with the data the script needs,
+    see ``preload_pages``.
+    Besides the pywikibot generator options, the following are supported:
+
+    -xml:<dumpfile> - Read the pages from an XML dump (pages-articles, .bz2/.gz/.7z or plain)
+                      instead of the wiki. Category and page options are ignored;
+                      ``-ns`` (default: main namespace) and ``-xmltitle`` filter the pages.
+                      Only for read-only runs: an edit based on the dump text would
+                      overwrite the edits made since the dump.
+    -xmltitle:<regex> - Only read the dump pages whose title matches the regex.
+    -xmlindex:<indexfile> - Index of a multistream dump, for the scripts that can scan
+                            it with several processes (default: derived from the dump name).
+    -resume - Skip the pages already handled by this script, unless they changed since
+              (see ``PageJournal``; the journal is kept unless running with -simulate).
+    -journal[:<path>] - Journal the pages handled by this script without skipping any,
+                        in the given file (default: cache/journal.sqlite, also used by
+                        -resume). Without -resume or -journal no journal is kept.
+    -incremental - Only handle the pages of the -cat/-catr categories edited or added to
+                   them since the last complete run of the script (see
+                   ``RecentChangesSource``); the first run handles all of them.
+                   No other generator option (-limit, -ns, ...) can be given.
+    -timing - Time the phases of the run (fetching, parsing, Wikidata requests,
+              saving, ...) and print their statistics at the end, see ``timing``.
+    -trace:<path> - Like -timing, also writing a Chrome trace of the run to the file.
+
+    :param local_args: the command line arguments
+    :param preload: the page data used by the script, among PRELOAD_PROPS
+                    (empty to not preload anything)
+    :param preload_groupsize: the number of pages preloaded with each request
+    :param read_only: the run doesn't edit the pages, so they can be read from a dump
+    :return: the generator and the remaining options
+    :raise ValueError: if -xml is given for a run that edits the pages
+    """
     options = {}
     gen_factory = pagegenerators.GeneratorFactory()
-    for arg in gen_factory.handle_args(local_args):
+    remaining_args = gen_factory.handle_args(local_args)
+    for arg in remaining_args:
         if arg.startswith("-"):
             arg, sep, value = arg.partition(":")
             if value != "":
                 options[arg[1:]] = value if not value.isdigit() else int(value)
             else:
                 options[arg[1:]] = True
-    generator = gen_factory.getCombinedGenerator()
+
+    trace = options.pop("trace", None)
+    if options.pop("timing", False) or trace:
+        timing.enable(trace_path=str(trace) if trace else None)
+
+    script = pywikibot.calledModuleName()
+    resume = options.pop("resume", False)
+    journal_path = options.pop("journal", resume)
+    journal = None
+    if journal_path:
+        journal = PageJournal(
+            script,
+            DEFAULT_JOURNAL_PATH if journal_path is True else str(journal_path),
+            read_only=pywikibot.config.simulate,
+        )
+
+    if "xml" in options:
+        if not read_only:
+            raise ValueError(
+                "-xml can only be used by the read-only actions: "
+                "the pages would be edited from their text in the dump"
+            )
+        generator = DumpSource(
+            str(options.pop("xml")),
+            namespaces=[ns.id for ns in gen_factory.namespaces] or [0],
+            title_filter=options.pop("xmltitle", None),
+            index_filename=options.pop("xmlindex", None),
+            limit=gen_factory.limit,
+            journal=journal,
+            resume=resume,
+        )
+    else:
+        generator = gen_factory.getCombinedGenerator()
+        source = None
+        if options.pop("incremental", False):
+            _check_incremental_args(local_args, remaining_args)
+            source = RecentChangesSource(
+                script,
+                get_source_categories(local_args),
+                fallback=generator,
+                read_only=pywikibot.config.simulate,
+            )
+            generator = iter(source)
+        if generator is not None and preload:
+            generator = preload_pages(generator, preload, preload_groupsize)
+        if generator is not None and journal is not None:
+            # after the preload, which gives the revision ids
+            generator = journal.track(generator, resume=resume)
+        if source is not None:
+            generator = source.complete_run(generator)
     return generator, options
+
+
+def _check_incremental_args(local_args: list[str], remaining_args: list[str]) -> None:
+    """
+    An incremental run reads its pages from the source categories only: the other
+    generator options (-limit, -ns, -titleregex, -page, ...) would be ignored, or would
+    cut the run short and still move the high-water mark
+    :raise ValueError: if generator options other than -cat/-catr are given
+    """
+    ignored = [
+        arg
+        for arg in local_args
+        if arg not in remaining_args and arg.partition(":")[0] not in ("-cat", "-catr")
+    ]
+    if ignored:
+        raise ValueError(
+            f"-incremental can't be used with {', '.join(ignored)}: "
+            "only -cat and -catr select its pages"
+        )
+
+
+def preload_pages(
+    pages: Iterable[pywikibot.Page],
+    props: Iterable[str] = PRELOAD_PROPS,
+    groupsize: int = DEFAULT_PRELOAD_GROUPSIZE,
+) -> Iterator[pywikibot.Page]:
+    """
+    Load the given data of the pages with one query per group of pages,
+    so that ``text``, ``categories()``, ``templates()``, ``data_item()`` (through the
+    page properties) and ``coordinates()`` need no further request.
+    Pages are yielded in the order of the generator.
+    :param pages: the pages to load
+    :param props: the data to load, among PRELOAD_PROPS
+    :param groupsize: the number of pages loaded with each request
+    :return: a generator of the loaded pages
+    """
+    props = list(props)
+    unknown = set(props) - set(PRELOAD_PROPS)
+    if unknown:
+        raise ValueError(f"Cannot preload {', '.join(sorted(unknown))}")
+
+    pages = iter(pages)
+    while batch := list(itertools.islice(pages, groupsize)):
+        with timing.span("fetch.preload"):
+            _load_batch(batch, props)
+        yield from batch
+
+
+def _load_batch(batch: list[pywikibot.Page], props: list[str]) -> None:
+    site = batch[0].site
+    by_title = {page.title(with_section=False): page for page in batch}
+    query = api.PropertyGenerator(
+        "|".join(["info", *props]), site=site, titles=list(by_title)
+    )
+    query.set_maximum_items(-1)  # no rvlimit, to get the content of all the pages
+    if "revisions" in props:
+        query.request["rvprop"] = site._rvprops(content=True)
+    if "coordinates" in props:
+        query.request["coprop"] = ["type", "name", "dim", "country", "region", "globe"]
+        query.request["coprimary"] = "all"
+    for prop, prefix in _PRELOAD_LIMITS.items():
+        if prop in props:
+            query.request[f"{prefix}limit"] = "max"
+
+    for pagedata in query:
+        page = by_title.get(pagedata["title"])
+        if page is None:
+            # the API returns normalized titles
+            page = next(
+                (
+                    p
+                    for t, p in by_title.items()
+                    if site.sametitle(t, pagedata["title"])
+                ),
+                None,
+            )
+            if page is None:
+                continue
+        api.update_page(page, pagedata, query.props)
+        if "coordinates" in props and "coordinates" not in pagedata:
+            page._coords = []
+
+
+class DumpPage(pywikibot.Page):
+    """
+    Page read from an XML dump. Page id, revision id and redirect flag come from the dump,
+    so checks like ``exists()`` need no request; the text is handed to pywikibot only
+    when first accessed.
+    """
+
+    def __init__(
+        self,
+        site,
+        title: str,
+        pageid: int,
+        revid: int,
+        is_redirect: bool,
+        dump_text: str,
+    ):
+        super().__init__(site, title)
+        self._pageid = pageid
+        self._revid = revid
+        self._isredir = is_redirect
+        self._dump_text = dump_text
+
+    @property
+    def text(self) -> str:
+        if self._dump_text is not None:
+            self._text = self._dump_text
+            self._dump_text = None
+        return pywikibot.Page.text.fget(self)
+
+    @text.setter
+    def text(self, value: str | None) -> None:
+        self._dump_text = None
+        pywikibot.Page.text.fset(self, value)
+
+    @text.deleter
+    def text(self) -> None:
+        self._dump_text = None
+        pywikibot.Page.text.fdel(self)
+
+
+class DumpSource:
+    """
+    ``DumpSource``
+
+    The pages of an XML dump selected with ``-xml``, ``-ns`` and ``-xmltitle``.
+    Iterating it streams the dump; the attributes let other readers (e.g. the sharded
+    scan of ``dump_scan``) read the same selection.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        namespaces: Iterable[int] = (0,),
+        title_filter: str | None = None,
+        index_filename: str | None = None,
+        limit: int | None = None,
+        journal: PageJournal | None = None,
+        resume: bool = False,
+    ):
+        self.filename = filename
+        self.namespaces = list(namespaces)
+        self.title_filter = title_filter
+        self.index_filename = index_filename or re.sub(
+            r"\.xml\.bz2$", "-index.txt.bz2", filename
+        )
+        self.limit = limit
+        self.journal = journal
+        self.resume = resume
+
+    def __getstate__(self) -> dict:
+        # the journal stays in the main process when the source is sent to workers
+        return {**self.__dict__, "journal": None}
+
+    def __iter__(self) -> Iterator["DumpPage"]:
+        generator = xml_dump_generator(
+            self.filename, namespaces=self.namespaces, title_filter=self.title_filter
+        )
+        if self.limit:
+            generator = itertools.islice(generator, self.limit)
+        if self.journal is not None:
+            generator = self.journal.track(generator, resume=self.resume)
+        return generator
+
+
+def xml_dump_generator(
+    filename: str,
+    site=None,
+    namespaces: Iterable[int] = (0,),
+    title_filter: str | None = None,
+) -> Iterator[DumpPage]:
+    """
+    Stream the pages of an XML dump in constant memory (iterparse, clearing each page
+    element once read). Pages outside the namespaces or not matching the title filter
+    are skipped before any Page object is built.
+    :param filename: the dump file
+    :param site: the site of the pages (default: the configured site)
+    :param namespaces: the namespace ids to keep
+    :param title_filter: optional regex the titles must match
+    :return: a generator of DumpPage
+    """
+    with open_archive(filename) as source:
+        yield from iter_dump_pages(source, site, namespaces, title_filter)
+
+
+def iter_dump_pages(
+    source: IO[bytes],
+    site=None,
+    namespaces: Iterable[int] = (0,),
+    title_filter: str | None = None,
+) -> Iterator[DumpPage]:
+    """
+    Parse the ``<page>`` elements of an uncompressed XML stream, see ``xml_dump_generator``
+    :param source: the XML stream (a whole dump, or a fragment wrapped in one root element)
+    :param site: the site of the pages (default: the configured site)
+    :param namespaces: the namespace ids to keep
+    :param title_filter: optional regex the titles must match
+    :return: a generator of DumpPage
+    """
+    site = site or pywikibot.Site()
+    namespaces = {str(ns) for ns in namespaces}
+    title_re = re.compile(title_filter) if title_filter else None
+
+    root = None
+    for event, elem in iterparse(source, events=("start", "end")):
+        if root is None:
+            root = elem
+        if event != "end" or _local_name(elem.tag) != "page":
+            continue
+
+        fields = {_local_name(child.tag): child for child in elem}
+        title = fields["title"].text
+        if fields["ns"].text in namespaces and (
+            title_re is None or title_re.search(title)
+        ):
+            # The last revision is the latest one in a pages-articles dump
+            revision = elem.findall(f"{elem.tag[: -len('page')]}revision")[-1]
+            revision_fields = {_local_name(child.tag): child for child in revision}
+            yield DumpPage(
+                site,
+                title,
+                pageid=int(fields["id"].text),
+                revid=int(revision_fields["id"].text),
+                is_redirect="redirect" in fields,
+                dump_text=revision_fields["text"].text or "",
+            )
+
+        # clear references in the root, to allow garbage collection
+        elem.clear()
+        root.clear()
+
+
+def _local_name(tag: str) -> str:
+    """Tag name without the XML namespace of the dump schema"""
+    return tag.rsplit("}", 1)[-1]
+
+
+class PagePrefetcher:
+    """
+    ``PagePrefetcher``
+
+    Wraps a page generator and runs ``prepare(page)`` in worker threads for the next
+    ``ahead`` pages, while the bot is still busy with the current one (e.g. waiting for
+    the operator to confirm an edit). Pages are yielded in the original order;
+    the result of ``prepare`` is picked up with ``pop_result``.
+
+    Example usage:
+
+    ```python
+    prefetcher = PagePrefetcher(generator, bot.prepare_page, ahead=3)
+    for page in prefetcher:
+        prepared = prefetcher.pop_result(page)
+    ```
+    """
+
+    def __init__(
+        self,
+        generator: Iterable[pywikibot.Page],
+        prepare: Callable[[pywikibot.Page], Any],
+        ahead: int = 3,
+    ):
+        self.generator = generator
+        self.prepare = prepare
+        self.ahead = ahead
+        self._results: dict[str, Future] = {}
+
+    def __iter__(self):
+        executor = ThreadPoolExecutor(
+            max_workers=self.ahead, thread_name_prefix="prefetch"
+        )
+        pending = deque()
+        try:
+            for page in self.generator:
+                pending.append((page, executor.submit(self.prepare, page)))
+                if len(pending) > self.ahead:
+                    yield self._release(pending)
+            while pending:
+                yield self._release(pending)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, pending: deque) -> pywikibot.Page:
+        page, future = pending.popleft()
+        self._results[page.title()] = future
+        return page
+
+    def pop_result(self, page: pywikibot.Page) -> Any:
+        """
+        Get the result of ``prepare`` for the given page, waiting for it if needed.
+        Exceptions raised by ``prepare`` are raised here.
+        :param page: a page yielded by this prefetcher
+        :return: the result of ``prepare``, or None if the page was not prefetched
+        """
+        future = self._results.pop(page.title(), None)
+        return future.result() if future is not None else None
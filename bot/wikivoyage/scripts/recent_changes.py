@@ -0,0 +1,219 @@
+import datetime
+import itertools
+import json
+import os
+from typing import Iterable, Iterator
+
+import pywikibot
+from pywikibot import logging
+from pywikibot.data import api
+
+DEFAULT_MARKS_PATH = "cache/high_water_marks.json"
+MEMBERSHIP_BATCH_SIZE = 50
+# Older recent changes may have been purged by the wiki: run on the whole categories
+RC_MAX_AGE = datetime.timedelta(days=30)
+
+# The incremental source whose pages were all handled by the bot, see commit_run
+_completed_source = None  # type: RecentChangesSource | None
+
+
+def get_source_categories(local_args: list[str]) -> list[tuple[str, bool]]:
+    """
+    :param local_args: the command line arguments
+    :return: the categories given with -cat and -catr, with True if recursive (-catr)
+    """
+    categories = []
+    for arg in local_args:
+        option, sep, value = arg.partition(":")
+        if option in ("-cat", "-catr") and value:
+            categories.append((value.split("|")[0], option == "-catr"))
+    return categories
+
+
+class HighWaterMarks:
+    """
+    ``HighWaterMarks``
+
+    Start time of the last complete run of each script on its source categories,
+    kept in a local json file.
+
+    Example usage:
+
+    ```python
+    marks = HighWaterMarks()
+    since = marks.get("missing_itemlist_finder Città*")
+    ```
+    """
+
+    def __init__(self, path: str = DEFAULT_MARKS_PATH):
+        self.path = path
+
+    def get(self, key: str) -> pywikibot.Timestamp | None:
+        """
+        :param key: the script and its source categories
+        :return: the start time of the last complete run, or None
+        """
+        mark = self._load().get(key)
+        return pywikibot.Timestamp.fromISOformat(mark) if mark else None
+
+    def set(self, key: str, timestamp: pywikibot.Timestamp) -> None:
+        """
+        :param key: the script and its source categories
+        :param timestamp: the start time of the run
+        :return: None
+        """
+        marks = self._load()
+        marks[key] = timestamp.isoformat()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(marks, f, indent=2)
+
+    def _load(self) -> dict[str, str]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+
+def commit_run(failed_saves: list = ()) -> None:
+    """
+    Move the high-water mark of an incremental run whose pages were all handled, unless
+    some edits could not be saved: the next run handles the pages again. Meant to be
+    called at teardown, after waiting for the pending edits (``SaveQueue.close``)
+    :param failed_saves: the edits that could not be saved (``SaveQueue.failed``)
+    :return: None
+    """
+    global _completed_source
+    source, _completed_source = _completed_source, None
+    if source is None:
+        return
+    if failed_saves:
+        logging.warning(
+            "Some edits could not be saved: the high-water mark is not moved"
+        )
+        return
+    if not source.read_only and source.started is not None:
+        source.marks.set(source.key, source.started)
+
+
+class RecentChangesSource:
+    """
+    ``RecentChangesSource``
+
+    Pages of the source categories changed since the last complete run of a script:
+    the pages edited or created since then (``recentchanges``) that are in one of the
+    categories, plus the pages added to the categories since then (category membership
+    timestamps). On the first run, or when the last one is older than RC_MAX_AGE, all the
+    pages of ``fallback`` are used. Wrap the final generator with ``complete_run`` and
+    call ``commit_run`` at teardown: the high-water mark only moves forward once the bot
+    handled all the pages and their edits were saved.
+
+    Example usage:
+
+    ```python
+    source = RecentChangesSource(
+        "missing_itemlist_finder", [("Città", True)], fallback=generator
+    )
+    for page in source.complete_run(iter(source)):
+        ...
+    commit_run(saves.failed)
+    ```
+    """
+
+    def __init__(
+        self,
+        script: str,
+        categories: list[tuple[str, bool]],
+        fallback: Iterable[pywikibot.Page] | None = None,
+        site=None,
+        marks: HighWaterMarks | None = None,
+        read_only: bool = False,
+    ):
+        if not categories:
+            raise ValueError("Incremental runs need a source category (-cat or -catr)")
+        self.site = site or pywikibot.Site()
+        self.categories = categories
+        self.fallback = fallback
+        self.marks = marks or HighWaterMarks()
+        self.read_only = read_only
+        self.key = f"{script} " + "|".join(
+            f"{name}{'*' if recurse else ''}" for name, recurse in sorted(categories)
+        )
+        self.started = None  # type: pywikibot.Timestamp | None
+
+    def __iter__(self) -> Iterator[pywikibot.Page]:
+        self.started = self.site.server_time()
+        since = self.marks.get(self.key)
+        if since is None or self.started - since > RC_MAX_AGE:
+            logging.info("No recent high-water mark: handling all the pages")
+            yield from self.fallback or []
+            return
+
+        logging.info(f"Handling the pages changed since {since.isoformat()}")
+        categories = self._get_category_tree()
+        seen = set()
+        for page in itertools.chain(
+            self._added_since(categories, since),
+            self._edited_since(categories, since),
+        ):
+            if page.title() not in seen:
+                seen.add(page.title())
+                yield page
+
+    def complete_run(self, pages: Iterable[pywikibot.Page]) -> Iterator[pywikibot.Page]:
+        """
+        Once all the pages were handled, let ``commit_run`` move the high-water mark to
+        the start of the run
+        :param pages: the pages of this source, possibly wrapped by other generators
+        :return: a generator of the same pages
+        """
+        global _completed_source
+        yield from pages
+        _completed_source = self
+
+    def _get_category_tree(self) -> list[pywikibot.Category]:
+        categories = {}
+        for name, recurse in self.categories:
+            category = pywikibot.Category(self.site, name)
+            categories[category.title()] = category
+            if recurse:
+                for subcategory in category.subcategories(recurse=True):
+                    categories[subcategory.title()] = subcategory
+        return list(categories.values())
+
+    def _added_since(
+        self, categories: list[pywikibot.Category], since: pywikibot.Timestamp
+    ) -> Iterator[pywikibot.Page]:
+        for category in categories:
+            yield from self.site.categorymembers(
+                category, namespaces=[0], sortby="timestamp", starttime=since
+            )
+
+    def _edited_since(
+        self, categories: list[pywikibot.Category], since: pywikibot.Timestamp
+    ) -> Iterator[pywikibot.Page]:
+        changes = self.site.recentchanges(
+            start=since,
+            reverse=True,
+            namespaces=[0],
+            changetype="edit|new",
+            top_only=True,
+        )
+        titles = (change["title"] for change in changes)
+        category_titles = {category.title() for category in categories}
+        while batch := list(itertools.islice(titles, MEMBERSHIP_BATCH_SIZE)):
+            query = api.PropertyGenerator(
+                "categories", site=self.site, titles=batch, cllimit="max"
+            )
+            members = {
+                pagedata["title"]
+                for pagedata in query
+                if category_titles.intersection(
+                    category["title"] for category in pagedata.get("categories", [])
+                )
+            }
+            # keep the order of the recent changes
+            for title in batch:
+                if title in members:
+                    yield pywikibot.Page(self.site, title)
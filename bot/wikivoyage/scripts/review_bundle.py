@@ -0,0 +1,270 @@
+import difflib
+import gzip
+import itertools
+import json
+import os
+from enum import Enum
+from typing import Any, Iterator
+
+import pywikibot
+from pywikibot import logging
+
+from save_queue import SaveQueue
+
+APPLY_BATCH_SIZE = 50
+DIFF_CONTEXT_LINES = 1
+
+
+class EntryStatus(Enum):
+    PENDING = "pending"  # not reviewed yet
+    APPROVED = "approved"
+    REJECTED = "rejected"
+    APPLIED = "applied"
+    CONFLICT = "conflict"  # the page changed after the plan: plan it again
+    FAILED = "failed"  # the save failed
+
+
+def default_bundle_path(script: str) -> str:
+    """
+    :param script: the name of the script
+    :return: the path of the review bundle of the script
+    """
+    return f"logs/{script}_plan.jsonl.gz"
+
+
+def get_review_opts(args: list[str], script: str) -> dict[str, str]:
+    """
+    Read the plan/apply options:
+
+    -plan[:<path>] - Don't save nor ask anything: write the proposed edits to a review
+                     bundle (default: logs/<script>_plan.jsonl.gz).
+    -apply[:<path>] - Save the edits approved in the review bundle, skipping the pages
+                      changed since the plan.
+
+    :param args: List of command line arguments.
+    :param script: The name of the script, for the default bundle path.
+    :return: Dictionary with the "plan" or "apply" bundle path, if given.
+    """
+    review_opts = dict()
+
+    for option in ("plan", "apply"):
+        if any(arg.startswith(f"-{option}") for arg in args):
+            arg = args[[arg.startswith(f"-{option}") for arg in args].index(True)]
+            review_opts[option] = arg.split(":", 1)[1] if ":" in arg else ""
+            review_opts[option] = review_opts[option] or default_bundle_path(script)
+
+    if len(review_opts) > 1:
+        raise ValueError("-plan and -apply can't be used together")
+    return review_opts
+
+
+class ReviewBundle:
+    """
+    ``ReviewBundle``
+
+    The edits proposed by a bot run in ``-plan`` mode, to be reviewed offline and saved
+    later in bulk with ``-apply``. The bundle is a gzipped JSON Lines file with one entry
+    per page: title, revision the edit is based on, new text, save options, a unified diff
+    and the review status (see EntryStatus). Entries are appended as the bot goes, so an
+    interrupted plan keeps the pages already handled.
+
+    Example usage:
+
+    ```python
+    bundle = ReviewBundle("logs/itemlist_wikidata_completer_plan.jsonl.gz")
+    bundle.propose(page, new_text, summary="...", minor=False)
+    ...
+    bundle.review()  # offline
+    bundle.apply()
+    ```
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.proposed = 0
+
+    def start(self) -> None:
+        """
+        Start a new plan, dropping the entries of the previous one
+        :return: None
+        """
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with gzip.open(self.path, "wt", encoding="utf-8"):
+            pass
+
+    def propose(self, page: pywikibot.Page, text: str, **save_opts: Any) -> None:
+        """
+        Add the edit of a page to the bundle
+        :param page: the page, with the text of the revision the edit is based on
+        :param text: the new text of the page
+        :param save_opts: the arguments of ``page.save`` (summary, minor, ...)
+        :return: None
+        """
+        diff = difflib.unified_diff(
+            page.text.splitlines(),
+            text.splitlines(),
+            lineterm="",
+            n=DIFF_CONTEXT_LINES,
+        )
+        entry = {
+            "title": page.title(),
+            "revid": page.latest_revision_id,
+            "status": EntryStatus.PENDING.value,
+            "save_opts": save_opts,
+            "diff": "\n".join(itertools.islice(diff, 2, None)),  # without file headers
+            "text": text,
+        }
+        # one gzip member per entry: the file stays readable if the run is interrupted
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.proposed += 1
+
+    def entries(self) -> list[dict[str, Any]]:
+        """
+        :return: the entries of the bundle
+        """
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def write(self, entries: list[dict[str, Any]]) -> None:
+        """
+        Replace the entries of the bundle, e.g. with their new status
+        :param entries: the entries
+        :return: None
+        """
+        with gzip.open(self.path + ".tmp", "wt", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(self.path + ".tmp", self.path)
+
+    def review(self) -> None:
+        """
+        Show the diff of each pending entry and ask whether to approve it. No request
+        is made to the wiki; the decisions are saved when quitting or at the end
+        :return: None
+        """
+        entries = self.entries()
+        pending = [
+            entry for entry in entries if entry["status"] == EntryStatus.PENDING.value
+        ]
+        pywikibot.output(f"{len(pending)} of {len(entries)} edits to review")
+        approve_all = False
+        for entry in pending:
+            if approve_all:
+                entry["status"] = EntryStatus.APPROVED.value
+                continue
+            pywikibot.output(f"\n>>> {entry['title']} <<<")
+            pywikibot.output(entry["diff"])
+            choice = pywikibot.input_choice(
+                "Approve this edit?",
+                [
+                    ("yes", "y"),
+                    ("no", "n"),
+                    ("skip", "s"),
+                    ("all remaining", "a"),
+                    ("quit", "q"),
+                ],
+                default="s",
+            )
+            if choice == "q":
+                break
+            if choice == "a":
+                approve_all = True
+            if choice in ("y", "a"):
+                entry["status"] = EntryStatus.APPROVED.value
+            elif choice == "n":
+                entry["status"] = EntryStatus.REJECTED.value
+        self.write(entries)
+        self.report(entries)
+
+    def apply(self, site=None) -> None:
+        """
+        Save the approved entries. The latest revision of the pages is checked in
+        batches: the pages edited since the plan are not saved, they're marked as
+        conflicts. In a simulation the status of the entries is not updated
+        :param site: the site of the pages (default: the configured one)
+        :return: None
+        """
+        site = site or pywikibot.Site()
+        entries = self.entries()
+        approved = [
+            entry for entry in entries if entry["status"] == EntryStatus.APPROVED.value
+        ]
+        pywikibot.output(f"Applying {len(approved)} approved edits")
+
+        saves = SaveQueue()
+        queued = {}  # type: dict[str, dict[str, Any]]
+        for entry, page in self._iter_current_pages(approved, site):
+            if not page.exists() or page.latest_revision_id != entry["revid"]:
+                logging.warning(f"{entry['title']} changed since the plan, skipped")
+                entry["status"] = EntryStatus.CONFLICT.value
+                continue
+            page.text = entry["text"]
+            saves.put(page, **entry["save_opts"])
+            queued[page.title()] = entry
+        saves.close()
+
+        for entry in queued.values():
+            entry["status"] = EntryStatus.APPLIED.value
+        for title, error in saves.failed:
+            queued[title]["status"] = EntryStatus.FAILED.value
+
+        if not pywikibot.config.simulate:
+            self.write(entries)
+        self.report(entries)
+
+    def report(self, entries: list[dict[str, Any]] | None = None) -> None:
+        """
+        Log the number of entries by status
+        :param entries: the entries (default: the ones of the bundle)
+        :return: None
+        """
+        entries = self.entries() if entries is None else entries
+        counts = {status.value: 0 for status in EntryStatus}
+        for entry in entries:
+            counts[entry["status"]] += 1
+        logging.info(
+            f"{self.path}: "
+            + ", ".join(
+                f"{count} {status}" for status, count in counts.items() if count
+            )
+        )
+
+    @staticmethod
+    def _iter_current_pages(
+        entries: list[dict[str, Any]], site
+    ) -> Iterator[tuple[dict[str, Any], pywikibot.Page]]:
+        """
+        :return: the entries with their pages, whose latest revision is loaded
+                 with one request per batch
+        """
+        entries = iter(entries)
+        while batch := list(itertools.islice(entries, APPLY_BATCH_SIZE)):
+            pages = [pywikibot.Page(site, entry["title"]) for entry in batch]
+            loaded = {
+                page.title(): page
+                for page in site.preloadpages(
+                    pages, groupsize=APPLY_BATCH_SIZE, content=False
+                )
+            }
+            for entry, page in zip(batch, pages):
+                yield entry, loaded.get(page.title(), page)
+
+
+def main():
+    """
+    Review a bundle offline:
+
+    -bundle:<path> - The review bundle, written by a script run with -plan.
+    """
+    local_args = pywikibot.handle_args()
+    if not any(arg.startswith("-bundle:") for arg in local_args):
+        pywikibot.output("Usage: review_bundle -bundle:<path>")
+        return
+    path = local_args[[arg.startswith("-bundle:") for arg in local_args].index(True)]
+    ReviewBundle(path.split(":", 1)[1]).review()
+
+
+if __name__ == "__main__":
+    main()
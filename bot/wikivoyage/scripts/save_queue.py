@@ -0,0 +1,89 @@
+import threading
+from typing import Any
+
+import pywikibot
+from pywikibot import logging
+
+import timing
+from page_journal import defer_record, record_outcome
+
+DEFAULT_MAX_PENDING = 10  # edits waiting to be saved before the bot is slowed down
+
+
+class SaveQueue:
+    """
+    ``SaveQueue``
+
+    Saves pages in the background, so that the bot can analyse the next pages while the
+    edits wait for the put throttle. The pages are saved in the order they were queued
+    by the put thread of pywikibot (``pywikibot.async_request``); ``page.save`` still
+    applies ``put_throttle`` and ``maxlag``, and pywikibot already retries a lagged or
+    failing server (``max_retries``), so a failed save is not attempted again. When
+    ``max_pending`` edits are waiting, ``put`` blocks until they are saved.
+
+    Example usage:
+
+    ```python
+    saves = SaveQueue()
+    saves.put(page, summary="...", minor=True)
+    saves.close()  # in teardown: wait for the pending edits
+    ```
+    """
+
+    def __init__(self, max_pending: int = DEFAULT_MAX_PENDING):
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._done = threading.Condition()
+        self.pending = 0
+        self.saved = []  # type: list[str]
+        self.failed = []  # type: list[tuple[str, Exception]]
+
+    def put(self, page: pywikibot.Page, **save_opts: Any) -> None:
+        """
+        Queue a page to be saved with the given ``page.save`` arguments
+        :param page: the page, with its new text
+        :param save_opts: the arguments of ``page.save`` (summary, minor, ...)
+        :return: None
+        """
+        # journaled as edited once saved, failed saves are not journaled
+        defer_record(page)
+        # blocks while max_pending edits are waiting
+        with timing.span("save.wait"):
+            self._slots.acquire()
+        with self._done:
+            self.pending += 1
+        pywikibot.async_request(self._save, page, save_opts)
+
+    def close(self) -> None:
+        """
+        Wait until all the queued pages are saved
+        :return: None
+        """
+        with self._done:
+            if self.pending:
+                pywikibot.output(
+                    f"Waiting for {self.pending} pending edits to be saved"
+                )
+            self._done.wait_for(lambda: not self.pending)
+        if not self.saved and not self.failed:
+            return
+
+        logging.info(f"Saved {len(self.saved)} pages")
+        for title, error in self.failed:
+            logging.error(f"Could not save {title}: {error}")
+
+    def _save(self, page: pywikibot.Page, save_opts: dict) -> None:
+        try:
+            with timing.span("save"):
+                page.save(**save_opts)
+        except Exception as e:
+            # edit conflicts, protected pages, a server still lagged after the
+            # retries of pywikibot, ...
+            self.failed.append((page.title(), e))
+        else:
+            self.saved.append(page.title())
+            record_outcome(page, "edited")
+        finally:
+            self._slots.release()
+            with self._done:
+                self.pending -= 1
+                self._done.notify_all()
@@ -0,0 +1,136 @@
+"""
+Offline checks of ``save_queue``: fake pages stand in for the wiki to check the order of
+the saves, that a failed save is not attempted again and that ``put`` blocks while
+``max_pending`` edits are waiting, without any network access.
+
+Run from the scripts directory:
+
+    python save_queue_check.py
+"""
+
+import threading
+import time
+from typing import Any
+
+from pywikibot.exceptions import Error, MaxlagTimeoutError
+
+from save_queue import SaveQueue
+
+WAIT = 0.2  # seconds
+
+
+class FakeJournal:
+    def __init__(self):
+        self.records = []  # type: list[tuple[str, str]]
+
+    def record(self, page: "FakePage", outcome: str) -> None:
+        self.records.append((page.title(), outcome))
+
+
+class FakePage:
+    """
+    ``FakePage``
+
+    Records its saves in a shared list; a save can fail or wait for an event.
+
+    Example usage:
+
+    ```python
+    page = FakePage("Roma", saves, error=MaxlagTimeoutError("lagged"))
+    ```
+    """
+
+    def __init__(
+        self,
+        title: str,
+        saves: list[tuple[str, dict[str, Any]]],
+        journal: FakeJournal | None = None,
+        error: Exception | None = None,
+        wait: threading.Event | None = None,
+    ):
+        self._title = title
+        self.saves = saves
+        self._journal = journal
+        self.error = error
+        self.wait = wait
+
+    def title(self) -> str:
+        return self._title
+
+    def save(self, **save_opts: Any) -> None:
+        if self.wait is not None:
+            self.wait.wait()
+        self.saves.append((self._title, save_opts))
+        if self.error is not None:
+            raise self.error
+
+
+def check_order() -> None:
+    saves, journal = [], FakeJournal()
+    titles = [f"Pagina {i}" for i in range(20)]
+    queue = SaveQueue(max_pending=3)
+    for title in titles:
+        queue.put(FakePage(title, saves, journal), summary="Bot", minor=True)
+    queue.close()
+    assert [title for title, save_opts in saves] == titles, saves
+    assert all(save_opts == {"summary": "Bot", "minor": True} for _, save_opts in saves)
+    assert queue.saved == titles and not queue.failed and not queue.pending
+    assert journal.records == [(title, "edited") for title in titles]
+
+
+def check_failures() -> None:
+    """
+    pywikibot already retried the lagged server: the save is not attempted again, the
+    page is not journaled and the next pages are still saved
+    """
+    saves, journal = [], FakeJournal()
+    lagged = MaxlagTimeoutError("Maximum retries attempted due to maxlag")
+    locked = Error("The page is protected")
+    queue = SaveQueue()
+    queue.put(FakePage("Roma", saves, journal))
+    queue.put(FakePage("Milano", saves, journal, error=lagged))
+    queue.put(FakePage("Napoli", saves, journal, error=locked))
+    queue.put(FakePage("Torino", saves, journal))
+    queue.close()
+    assert [title for title, save_opts in saves] == [
+        "Roma",
+        "Milano",
+        "Napoli",
+        "Torino",
+    ]
+    assert queue.saved == ["Roma", "Torino"]
+    assert queue.failed == [("Milano", lagged), ("Napoli", locked)]
+    assert journal.records == [("Roma", "edited"), ("Torino", "edited")]
+
+
+def check_backpressure() -> None:
+    """
+    With max_pending edits waiting ``put`` blocks until one of them is saved
+    """
+    saves, release = [], threading.Event()
+    queue = SaveQueue(max_pending=2)
+    queue.put(FakePage("Roma", saves, wait=release))
+    queue.put(FakePage("Milano", saves))
+
+    blocked = threading.Thread(target=queue.put, args=(FakePage("Napoli", saves),))
+    blocked.start()
+    time.sleep(WAIT)
+    assert blocked.is_alive() and not saves and queue.pending == 2
+
+    release.set()
+    blocked.join(timeout=5)
+    assert not blocked.is_alive()
+    queue.close()
+    assert [title for title, save_opts in saves] == ["Roma", "Milano", "Napoli"]
+    assert not queue.pending
+
+
+def main():
+    check_order()
+    check_failures()
+    check_backpressure()
+    print("Save queue: all checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Equivalence check of the section engine of ``voy_aux`` (``split_sections``, used by
+``format_sections`` and ``empty_section_finder.find_sections``) against mwparserfromhell,
+which it replaces: the same headings must be found, and each section must have the
+same text as with ``Wikicode.get_sections(include_headings=False)``.
+
+Run from the scripts directory:
+
+    python section_engine_check.py [page.wiki ...]
+
+Without arguments a set of tricky cases is checked (comments after the headings,
+headings within comments or <nowiki>, subsections, ...). Otherwise the given files
+(e.g. the wikitext of real articles) are checked.
+"""
+
+import os
+import re
+import sys
+
+import mwparserfromhell
+
+from empty_section_finder import find_sections
+from voy_aux import format_sections, split_sections
+
+CASES = {
+    "plain": "Lead\n== Da sapere ==\nTesto\n== Come arrivare ==\n\n",
+    "subsections": (
+        "Lead\n== Come arrivare ==\n=== In aereo ===\nVoli\n"
+        "=== In treno ===\n\n== Dormire ==\nHotel\n"
+    ),
+    "trailing comment": "Lead\n== Da sapere == <!-- c -->\nTesto\n== Dormire ==\n",
+    "trailing comments": "Lead\n== Da sapere ==<!-- a --> <!-- b -->  \n\n== B ==\nx",
+    "multi-line trailing comment": (
+        "Lead\n== Da sapere == <!-- una\nnota -->\nTesto\n== Dormire ==\n"
+    ),
+    "heading in a comment": (
+        "Lead\n== Da sapere ==\nTesto\n<!--\n== Da sapere ==\n-->\n== Dormire ==\n"
+    ),
+    # like mwparserfromhell, an unclosed comment is text
+    "heading after an unclosed comment": "Lead\n== Da sapere ==\n<!-- bozza\n== B ==\n",
+    "heading in nowiki": (
+        "Lead\n<nowiki>\n== Da sapere ==\n</nowiki>\n== Da sapere ==\n\n"
+    ),
+    "comment in the title": "Lead\n== Da <!-- x --> sapere ==\nTesto\n",
+    "spaces around the title": "Lead\n==Da sapere==\nTesto\n==  Dormire  ==  \n",
+    "uneven equal signs": "Lead\n== Da sapere ===\nTesto\n",
+}
+
+# A format_sections call keeps the comments after a heading
+FORMAT_CASES = {
+    "Lead\n==Da sapere== <!-- c -->\nTesto\n": (
+        "Lead\n== Da sapere == <!-- c -->\n\nTesto\n"
+    ),
+}
+
+
+def check(name: str, text: str) -> list[str]:
+    """
+    :param name: the name of the case
+    :param text: the wikitext
+    :return: the differences found
+    """
+    errors = []
+    wikicode = mwparserfromhell.parse(text)
+    expected = [
+        (heading.level, str(heading.title).strip())
+        for heading in wikicode.filter_headings(recursive=False)
+    ]
+    found = [(section.level, section.title) for section in split_sections(text)[1:]]
+    if found != expected:
+        errors.append(f"{name}: headings {found}, mwparserfromhell {expected}")
+
+    for title in dict.fromkeys(title for level, title in expected):
+        pattern = re.escape(title)
+        expected_sections = [
+            str(section)
+            for section in wikicode.get_sections(
+                matches=pattern, include_headings=False
+            )
+        ]
+        found_sections = find_sections(text, pattern)
+        if found_sections != expected_sections:
+            errors.append(
+                f"{name}: sections {title!r} {found_sections}, "
+                f"mwparserfromhell {expected_sections}"
+            )
+    return errors
+
+
+def main():
+    if len(sys.argv) > 1:
+        cases = {}
+        for filename in sys.argv[1:]:
+            with open(filename, encoding="utf-8") as f:
+                cases[os.path.basename(filename)] = f.read()
+    else:
+        cases = CASES
+
+    errors = [error for name, text in cases.items() for error in check(name, text)]
+    if len(sys.argv) == 1:
+        for text, expected in FORMAT_CASES.items():
+            formatted = format_sections(
+                text, normalize_titles=True, blank_line_after_heading=True
+            )
+            if formatted != expected:
+                errors.append(f"format_sections: {formatted!r}, expected {expected!r}")
+
+    for error in errors:
+        print(error)
+    print(f"{len(cases)} pages checked, {len(errors)} differences")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,13 @@
 import datetime
-import re
 from enum import Enum
 
-import mwparserfromhell
 import pywikibot
 import logging
-from pywikibot.bot import ExistingPageBot
+from pywikibot.bot import BaseBot
+import timing
+from category_query import CategoryExpression
 from pwb_aux import setup_generator
+from recent_changes import commit_run
 
 
 class FileFormats(Enum):
@@ -15,58 +16,101 @@ class FileFormats(Enum):
     TEXT = "text"
 
 
-class TemplateCrossCat(ExistingPageBot):
+class TemplateCrossCat(BaseBot):
+    """
+    ``TemplateCrossCat``
+
+    Lists the pages of the generator (typically ``-transcludes``) matching a set expression
+    over categories (see ``CategoryExpression``). The members of each category are fetched
+    once with ``categorymembers`` and the expression is evaluated as set operations,
+    so no request is made for the single pages: the evaluation is done in ``setup`` and
+    the results are written in ``teardown``, no page is treated on its own.
+    """
 
     def __init__(self, custom_opts, **kwargs):
         super().__init__(**kwargs)
         self.target_cat = custom_opts.get("targetcat", None)
+        self.negative = custom_opts.get("negative", False)
+        expression = custom_opts.get("expr", None)
 
-        if self.target_cat is None:
+        if expression is None and self.target_cat is None:
             raise ValueError(
-                "No target category specified, Use -targetcat:TargetCategory"
+                "No target category specified, Use -targetcat:TargetCategory or -expr:Expression"
             )
+        if expression is None:
+            expression = f"~({self.target_cat})" if self.negative else self.target_cat
 
-        self.negative = custom_opts.get("negative", False)
+        self.expression = CategoryExpression(expression)
         self.outputfile = custom_opts.get("outputfile", "template_x_cat_results.txt")
         self.format = custom_opts.get("format", FileFormats.WIKITEXT.value)
         self.found_matches = []
-
-    def treat_page(self):
-        logging.info(f"Checking page: {self.current_page.title()}")
-
-        categories = [
-            cat.title(with_ns=False) for cat in self.current_page.categories()
+        self._members = {}
+
+    def get_members(self, category: str) -> set[str]:
+        """
+        :param category: the name of the category, without namespace
+        :return: the titles of the pages in the category, fetched once per run
+        """
+        if category not in self._members:
+            logging.info(f"Loading members of category {category}")
+            with timing.span("fetch.members"):
+                self._members[category] = {
+                    page.title()
+                    for page in pywikibot.Category(pywikibot.Site(), category).members()
+                }
+        return self._members[category]
+
+    def setup(self) -> None:
+        super().setup()
+        titles = None
+        if self.generator is not None:
+            # the generator only lists the pages: keep their order for the results
+            titles = list(dict.fromkeys(page.title() for page in self.generator))
+
+        matches = self.expression.evaluate(
+            self.get_members, set(titles) if titles is not None else None
+        )
+        self.found_matches = [
+            title for title in titles or sorted(matches) if title in matches
         ]
-
-        # We just want to create a list of all articles that are also in the target category (if self.negative is False)
-        # or that are not in the target category (if self.negative is True)
-
-        if (self.target_cat in categories) ^ self.negative:
-            logging.info(
-                f"Found match: {self.current_page.title()} - this has {self.target_cat} and we are looking for {'not ' if self.negative else ''}{self.target_cat}"
-            )
-            self.found_matches.append(self.current_page.title())
-            logging.info(f"Found match: {self.current_page.title()}")
+        logging.info(
+            f"Found {len(self.found_matches)} matches for {self.expression.expression}"
+        )
+        # nothing is left for the run loop
+        self.generator = iter(())
 
     def teardown(self) -> None:
+        commit_run()
         self.save_results()
+        timing.report()
         super().teardown()
 
     def save_results(self):
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with open(self.outputfile, "w") as f:
-            if self.format == FileFormats.WIKITEXT.value:
-                for match in self.found_matches:
-                    f.write(f"* [[{match}]] (checked on {timestamp})\n")
-            elif self.format == FileFormats.JSON.value:
-                import json
-
-                json.dump(self.found_matches, f)
-            elif self.format == FileFormats.TEXT.value:
-                for match in self.found_matches:
-                    f.write(f"{match}\n")
-            else:
-                raise ValueError(f"Unknown format: {self.format}")
+        save_results(self.found_matches, self.outputfile, self.format)
+
+
+def save_results(found_matches: list[str], outputfile: str, file_format: str):
+    """
+    Write the matching pages to the output file
+    :param found_matches: the titles of the pages
+    :param outputfile: the path of the output file
+    :param file_format: one of the FileFormats values
+    :return: None
+    """
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with open(outputfile, "w") as f:
+        if file_format == FileFormats.WIKITEXT.value:
+            for match in found_matches:
+                f.write(f"* [[{match}]] (checked on {timestamp})\n")
+        elif file_format == FileFormats.JSON.value:
+            import json
+
+            json.dump(found_matches, f)
+        elif file_format == FileFormats.TEXT.value:
+            for match in found_matches:
+                f.write(f"{match}\n")
+        else:
+            raise ValueError(f"Unknown format: {file_format}")
 
 
 def set_custom_opts(args: list[str]) -> dict[str, str]:
@@ -83,6 +127,11 @@ def set_custom_opts(args: list[str]) -> dict[str, str]:
             [arg.startswith("-targetcat") for arg in args].index(True)
         ].split(":")[1]
 
+    if any(arg.startswith("-expr") for arg in args):
+        custom_opts["expr"] = args[
+            [arg.startswith("-expr") for arg in args].index(True)
+        ].split(":", 1)[1]
+
     if any(arg.startswith("-format") for arg in args):
         custom_opts["format"] = args[
             [arg.startswith("-format") for arg in args].index(True)
@@ -98,7 +147,7 @@ def set_custom_opts(args: list[str]) -> dict[str, str]:
 
 def main():
     local_args = pywikibot.handle_args()
-    generator, options = setup_generator(local_args)
+    generator, options = setup_generator(local_args, preload=(), read_only=True)
     custom_opts = set_custom_opts(local_args)
     bot = TemplateCrossCat(generator=generator, custom_opts=custom_opts, **options)
     bot.run()
@@ -0,0 +1,247 @@
+import functools
+import json
+import os
+import threading
+import time
+from typing import Callable, Iterable, Iterator
+
+import pywikibot
+
+# The timer of the run, None unless enabled with -timing or -trace
+_timer = None  # type: PhaseTimer | None
+
+
+class _NoSpan:
+    """Span used when timing is off: entering and leaving it does nothing"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer: "PhaseTimer", name: str):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.timer.record(self.name, self.start, time.perf_counter())
+
+
+class PhaseTimer:
+    """
+    ``PhaseTimer``
+
+    Durations of the phases of a run (fetching, parsing, Wikidata requests, formatting,
+    saving, ...), measured with ``span``. At the end of the run ``report`` prints count,
+    total, median, 95th percentile and maximum of each phase, and with a ``trace_path``
+    writes the spans as a Chrome trace (``chrome://tracing``, Perfetto). Spans can be
+    recorded from any thread, e.g. the SaveQueue writer or the page prefetcher.
+
+    Example usage:
+
+    ```python
+    timer = enable(trace_path="logs/trace.json")
+    with span("parse"):
+        wikicode = mwparserfromhell.parse(text)
+    report()
+    ```
+    """
+
+    def __init__(self, trace_path: str | None = None):
+        self.trace_path = trace_path
+        self.durations = {}  # type: dict[str, list[float]]
+        # (name, start, duration, thread id), only kept for the trace
+        self.events = []  # type: list[tuple[str, float, float, int]]
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, name: str, start: float, end: float) -> None:
+        """
+        :param name: the name of the phase
+        :param start: the start of the span (``time.perf_counter``)
+        :param end: the end of the span
+        :return: None
+        """
+        with self._lock:
+            self.durations.setdefault(name, []).append(end - start)
+            if self.trace_path is not None:
+                self.events.append((name, start, end - start, threading.get_ident()))
+
+    def report(self) -> None:
+        """
+        Print the statistics of each phase and write the trace, if enabled
+        :return: None
+        """
+        with self._lock:
+            durations = {name: sorted(d) for name, d in self.durations.items()}
+        if not durations:
+            return
+        lines = [
+            f"{'phase':<28}{'count':>8}{'total s':>10}"
+            f"{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"
+        ]
+        for name, values in sorted(
+            durations.items(), key=lambda item: sum(item[1]), reverse=True
+        ):
+            lines.append(
+                f"{name:<28}{len(values):>8}{sum(values):>10.2f}"
+                f"{percentile(values, 50) * 1000:>10.1f}"
+                f"{percentile(values, 95) * 1000:>10.1f}"
+                f"{values[-1] * 1000:>10.1f}"
+            )
+        pywikibot.output("Time per phase:\n" + "\n".join(lines))
+        if self.trace_path is not None:
+            self.write_trace(self.trace_path)
+
+    def write_trace(self, path: str) -> None:
+        """
+        Write the spans in the Chrome trace event format (complete "X" events)
+        :param path: the path of the json file
+        :return: None
+        """
+        with self._lock:
+            events = list(self.events)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        pid = os.getpid()
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "traceEvents": [
+                        {
+                            "name": name,
+                            "cat": name.split(".", 1)[0],
+                            "ph": "X",
+                            "ts": round((start - self.origin) * 1e6, 1),
+                            "dur": round(duration * 1e6, 1),
+                            "pid": pid,
+                            "tid": tid,
+                        }
+                        for name, start, duration, tid in events
+                    ],
+                    "displayTimeUnit": "ms",
+                },
+                f,
+            )
+        pywikibot.output(f"Trace of {len(events)} spans written to {path}")
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    :param values: sorted values
+    :param p: the percentile, between 0 and 100
+    :return: the nearest-rank percentile of the values
+    """
+    if not values:
+        return 0.0
+    rank = max(1, -(-len(values) * p // 100))  # ceil
+    return values[int(rank) - 1]
+
+
+def enable(trace_path: str | None = None) -> PhaseTimer:
+    """
+    Start timing the phases of the run
+    :param trace_path: also write a Chrome trace to this file at the end of the run
+    :return: the timer
+    """
+    global _timer
+    _timer = PhaseTimer(trace_path)
+    return _timer
+
+
+def span(name: str) -> _Span | _NoSpan:
+    """
+    Time a phase, as a context manager: ``with span("parse"): ...``.
+    When timing is off a shared no-op object is returned
+    :param name: the name of the phase, with dots to group them (e.g. "wikidata.sparql")
+    :return: the span
+    """
+    if _timer is None:
+        return _NO_SPAN
+    return _Span(_timer, name)
+
+
+def timed(name: str) -> Callable:
+    """
+    Decorator timing each call of a function as a phase, see ``span``
+    :param name: the name of the phase
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _timer is None:
+                return function(*args, **kwargs)
+            with _Span(_timer, name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_pages(pages: Iterable, fetch: str = "fetch", treat: str = "page") -> Iterator:
+    """
+    Wrap the page generator of a bot: the time spent getting each page (generators,
+    preloading) is recorded as ``fetch``, the time the bot spends on it as ``treat``
+    :param pages: the pages
+    :param fetch: the name of the phase getting the pages
+    :param treat: the name of the phase handling a page
+    :return: a generator of the same pages
+    """
+    pages = iter(pages)
+    while True:
+        with span(fetch):
+            page = next(pages, None)
+        if page is None:
+            return
+        start = time.perf_counter()
+        yield page
+        if _timer is not None:
+            _timer.record(treat, start, time.perf_counter())
+
+
+class TimedBot:
+    """
+    ``TimedBot``
+
+    Bot mixin timing the pages of the run with ``timed_pages`` when timing is enabled.
+    The generator is wrapped in ``setup``, after the bot has added its own wrappers
+    (batched lookups, prefetching, ...): the time they spend getting the next page is
+    recorded as ``fetch``, not as part of the previous page.
+
+    Example usage:
+
+    ```python
+    class DynamicMapFiller(JournaledBot, TimedBot, ExistingPageBot):
+        ...
+    ```
+    """
+
+    def setup(self) -> None:
+        super().setup()
+        if _timer is not None and getattr(self, "generator", None) is not None:
+            self.generator = timed_pages(self.generator)
+
+
+def report() -> None:
+    """
+    Print the time per phase, if timing is enabled. Meant to be called at teardown.
+    :return: None
+    """
+    if _timer is not None:
+        _timer.report()
@@ -0,0 +1,65 @@
+from typing import Iterable
+
+import pywikibot
+from pywikibot import logging
+
+import timing
+
+
+class TransclusionIndex:
+    """
+    ``TransclusionIndex``
+
+    The pages transcluding some templates, loaded with one ``embeddedin`` listing per
+    template the first time the template is asked for, so that checking whether a page
+    uses a template needs neither its text nor a request. The index can be sent to other
+    processes (e.g. the workers of ``dump_scan``) with the listings already loaded.
+
+    Example usage:
+
+    ```python
+    index = TransclusionIndex()
+    index.uses("Lazio", "Citylist")
+    ```
+    """
+
+    def __init__(self, site=None):
+        self.site = site or pywikibot.Site()
+        self._titles = {}  # type: dict[str, set[str]]
+
+    def __getstate__(self) -> dict:
+        # the receiving process uses its own site, if it loads another template
+        return {**self.__dict__, "site": None}
+
+    def load(self, templates: Iterable[str]) -> None:
+        """
+        Load the listings of the given templates now, e.g. before sending the index
+        to other processes
+        :param templates: the names of the templates, without namespace
+        :return: None
+        """
+        for template in templates:
+            self.titles(template)
+
+    def titles(self, template: str) -> set[str]:
+        """
+        :param template: the name of the template, without namespace
+        :return: the titles of the pages transcluding the template
+        """
+        if template not in self._titles:
+            logging.info(f"Loading the pages transcluding {template}")
+            page = pywikibot.Page(self.site or pywikibot.Site(), template, ns=10)
+            # timed apart: the page during which the listing is loaded would stand out
+            with timing.span("fetch.transclusions"):
+                self._titles[template] = {
+                    transcluding.title() for transcluding in page.embeddedin()
+                }
+        return self._titles[template]
+
+    def uses(self, title: str, template: str) -> bool:
+        """
+        :param title: the title of a page
+        :param template: the name of the template, without namespace
+        :return: True if the page transcludes the template
+        """
+        return title in self.titles(template)
@@ -5,23 +5,46 @@ import pywikibot
 import logging
 from pywikibot.bot import ExistingPageBot
 from WikibaseHelper import WikibaseHelper
+from country_codes import CountryCodeTable
+from entity_cache import EntityCache
+from wikidata_index import WikidataIndex
+from page_journal import JournaledBot
 from pwb_aux import setup_generator
+from recent_changes import commit_run
+import timing
+from save_queue import SaveQueue
+from voy_aux import TemplateIndex, as_template_index
 
 # --- it.wikivoyage specific constants ---
 SOURCE_CATEGORY = "Quickbar con codice mappa diverso da Wikidata"
 QUICKBAR_TEMPLATE_NAME = "QuickbarCity\n"
 QUICKBAR_MAP_PARAM = "Map"
 QUICKBAR_LAT_PARAM = "Lat"
+ANY_CODE = "*"  # -oldcode value matching every code different from Wikidata
 
 
-class MapCodeQuickbarUpdater(ExistingPageBot):
+class MapCodeQuickbarUpdater(JournaledBot, timing.TimedBot, ExistingPageBot):
 
     def __init__(self, custom_opts, **kwargs):
         super().__init__(**kwargs)
-        self.wikibase_helper = WikibaseHelper()
+        self.wikibase_helper = WikibaseHelper(
+            cache=EntityCache(),
+            index=(
+                WikidataIndex(custom_opts["wdindex"])
+                if "wdindex" in custom_opts
+                else None
+            ),
+        )
+        self.country_codes = CountryCodeTable()
+        if custom_opts.get("refreshcodes", False):
+            self.country_codes.refresh()
         self.matched_pages = []
+        self.saves = SaveQueue()
         try:
-            self.old_code = custom_opts.get("oldcode", "uk")
+            self.old_codes = {
+                code.strip().lower()
+                for code in custom_opts.get("oldcode", "uk").split(",")
+            }
         except:
             raise ValueError("Invalid custom options")
 
@@ -45,21 +68,25 @@ class MapCodeQuickbarUpdater(ExistingPageBot):
 
     def treat_page(self):
         # Get and parse the page wikicode
-        content = self.current_page.text
-        wikicode = mwparserfromhell.parse(content)
+        with timing.span("fetch.text"):
+            content = self.current_page.text
+        with timing.span("parse"):
+            wikicode = mwparserfromhell.parse(content)
 
-        # Extract the templates from the page
-        templates = wikicode.filter_templates()
+            # Extract the templates from the page
+            templates = TemplateIndex.from_wikicode(wikicode)
 
         # Add wikidata ids to the templates if they are missing and can be found
-        self.process_templates(templates)
+        with timing.span("process"):
+            self.process_templates(templates)
 
         # Save the page
-        content = str(wikicode)
+        with timing.span("format"):
+            content = str(wikicode)
         if content != self.current_page.text:
             pywikibot.showDiff(content, self.current_page.text)
             self.current_page.text = content
-            self.current_page.save(**self.edit_opts)
+            self.saves.put(self.current_page, **self.edit_opts)
         else:
             return
 
@@ -68,24 +95,23 @@ class MapCodeQuickbarUpdater(ExistingPageBot):
         Processes templates to update the data and add additional information.
 
         :param templates: List of templates to process.
-        :type templates: list
+        :type templates: TemplateIndex or list
         :return: None
         """
-        for template in templates:
+        for template in as_template_index(templates).get(QUICKBAR_TEMPLATE_NAME):
             # Conditions
-            is_target_template = template.name == QUICKBAR_TEMPLATE_NAME
-            has_old_value = (
-                template.has(QUICKBAR_MAP_PARAM)
-                and template.get(QUICKBAR_MAP_PARAM).value.strip().lower()
-                == self.old_code.strip().lower()
+            has_old_value = template.has(QUICKBAR_MAP_PARAM) and (
+                ANY_CODE in self.old_codes
+                or template.get(QUICKBAR_MAP_PARAM).value.strip().lower()
+                in self.old_codes
             )
 
-            if is_target_template and has_old_value:
-                self.matched_pages.append(self.current_page.title())
-                wikidata_id = self.current_page.data_item()
-                iso_code = self.wikibase_helper.get_iso_3166_1_from_city(wikidata_id)
+            if has_old_value:
+                iso_code = self.get_country_code(self.current_page.data_item())
+                current_code = template.get(QUICKBAR_MAP_PARAM).value.strip()
 
-                if iso_code is not None:
+                if iso_code is not None and iso_code.upper() != current_code.upper():
+                    self.matched_pages.append(self.current_page.title())
                     template.add(
                         QUICKBAR_MAP_PARAM,
                         iso_code.upper(),
@@ -98,14 +124,35 @@ class MapCodeQuickbarUpdater(ExistingPageBot):
             else:
                 continue
 
+    def get_country_code(self, city_entity) -> str | None:
+        """
+        Get the ISO 3166 code of the country of a city: only the city is read (P17),
+        the code comes from the country table
+        :param city_entity: the wikidata item of the city
+        :return: the code, or None if the city has no country
+        """
+        country = self.wikibase_helper.get_country_from_city(city_entity)
+        if country is None:
+            return None
+        iso_code = self.country_codes.get_code(country)
+        if iso_code is None:
+            # not a current country (e.g. a historical one): ask Wikidata
+            iso_code = self.wikibase_helper.get_iso_3166_1_from_country(country)
+        return iso_code
+
     def teardown(self) -> None:
         """
         Print the list of pages that were matched and updated.
         :return: None
         """
+        self.saves.close()
+        commit_run(self.saves.failed)
         pywikibot.output(f"Found {len(self.matched_pages)} pages that were updated:")
         for page in self.matched_pages:
             pywikibot.output(f"\t{page}")
+        self.wikibase_helper.report()
+        self.wikibase_helper.close()
+        timing.report()
 
 
 def prepare_generator_args() -> list[str]:
@@ -129,9 +176,10 @@ def set_custom_opts(args: list[str]) -> dict[str, str]:
     Set custom options for the given arguments.
     In particular following options are supported (i.e. read from command line):
 
-    -addcat:<category_name> - Adds the given category to the pages with empty section.
-    -section:<section_name> - The name of the section to check for emptiness.
-    -action:<action_name> - The action to perform. Possible values are "dump" and "addcat".
+    -oldcode:<code>[,<code>...] - The map codes to replace (default: "uk");
+                                  "*" replaces every code different from Wikidata.
+    -refreshcodes - Rebuild the table of the country codes from Wikidata.
+    -wdindex:<path> - Read the wikidata items from a local index built with wikidata_index.py
 
     :param args: List of command line arguments.
     :return: Dictionary of custom options.
@@ -144,12 +192,20 @@ def set_custom_opts(args: list[str]) -> dict[str, str]:
             [arg.startswith("-oldcode") for arg in args].index(True)
         ].split(":")[1]
 
+    if any(arg.startswith("-refreshcodes") for arg in args):
+        custom_opts["refreshcodes"] = True
+
+    if any(arg.startswith("-wdindex") for arg in args):
+        custom_opts["wdindex"] = args[
+            [arg.startswith("-wdindex") for arg in args].index(True)
+        ].split(":", 1)[1]
+
     return custom_opts
 
 
 def main():
     local_args = prepare_generator_args()
-    generator, options = setup_generator(local_args)
+    generator, options = setup_generator(local_args, preload=("revisions", "pageprops"))
     custom_opts = set_custom_opts(local_args)
     bot = MapCodeQuickbarUpdater(
         generator=generator, custom_opts=custom_opts, **options
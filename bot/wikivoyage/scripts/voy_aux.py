@@ -1,7 +1,11 @@
+import bisect
+import heapq
+import itertools
 import re
 from enum import Enum
-from typing import Iterable
+from typing import Callable, Iterable, Iterator, NamedTuple
 import pywikibot
+from pywikibot.data import api
 import logging
 from mwparserfromhell.nodes import Template
 from mwparserfromhell.wikicode import Wikicode
@@ -26,6 +30,23 @@ class ArticleTypeCategories(Enum):
 
 
 class ArticleTypeLookup:
+    """
+    ``ArticleTypeLookup``
+
+    Classifies articles by their type category (Città, Regione, ...). Membership is
+    fetched with one ``prop=categories`` query per batch of pages, restricted with
+    ``clcategories`` to the type categories, and cached per page for the whole run.
+    If a page is in more than one type category, the first type of ArticleTypes wins.
+
+    Example usage:
+
+    ```python
+    lookup = ArticleTypeLookup()
+    for page in lookup.classify(generator):
+        lookup.get_article_type(page)
+    ```
+    """
+
     _article_type_lookup = {
         ArticleTypeCategories.CITY.value: ArticleTypes.CITY,
         ArticleTypeCategories.REGION.value: ArticleTypes.REGION,
@@ -35,31 +56,294 @@ class ArticleTypeLookup:
         ArticleTypeCategories.ARCHEOLOGICAL_SITE.value: ArticleTypes.ARCHEOLOGICAL_SITE,
     }
 
+    def __init__(self, batch_size: int = 50):
+        self.batch_size = batch_size
+        self._article_types = {}  # type: dict[str, ArticleTypes | None]
+
+    def classify(self, pages: Iterable[pywikibot.Page]) -> Iterator[pywikibot.Page]:
+        """
+        Wrap a page generator, classifying its pages in batches as they are iterated
+        :param pages: the pages
+        :return: a generator of the same pages
+        """
+        pages = iter(pages)
+        while batch := list(itertools.islice(pages, self.batch_size)):
+            self.load(batch)
+            yield from batch
+
+    def load(self, pages: list[pywikibot.Page]) -> None:
+        """
+        Classify the given pages (at most ``batch_size``) with a single query
+        :param pages: the pages to classify
+        :return: None
+        """
+        pages = [page for page in pages if page.title() not in self._article_types]
+        if not pages:
+            return
+
+        site = pages[0].site
+        query = api.PropertyGenerator(
+            "categories",
+            site=site,
+            titles=[page.title() for page in pages],
+            clcategories=[
+                pywikibot.Category(site, name).title()
+                for name in self._article_type_lookup
+            ],
+            cllimit="max",
+        )
+        found = {page.title(): set() for page in pages}
+        for pagedata in query:
+            found.setdefault(pagedata["title"], set()).update(
+                category["title"] for category in pagedata.get("categories", [])
+            )
+
+        for title, categories in found.items():
+            names = {category.split(":", 1)[1] for category in categories}
+            self._article_types[title] = next(
+                (
+                    article_type
+                    for name, article_type in self._article_type_lookup.items()
+                    if name in names
+                ),
+                None,
+            )
+
+    def get_article_type(self, page: pywikibot.Page) -> ArticleTypes | None:
+        """
+        :param page: the article
+        :return: the type of the article, or None if it's in none of the type categories
+        """
+        if page.title() not in self._article_types:
+            self.load([page])
+        return self._article_types.get(page.title())
+
+
+_NAME_COMMENT = re.compile(r"<!--.*?(?:-->|\Z)", re.DOTALL)
+_NAME_SPACES = re.compile(r"[\s_]+")
+_TEMPLATE_NAMESPACE = re.compile(r"^template\s*:\s*", re.IGNORECASE)
+
+
+def normalize_template_name(name: str) -> str:
+    """
+    Normalize a template name as MediaWiki does when resolving it: comments are
+    dropped, spaces and underscores collapsed and trimmed, the namespace removed and
+    the first letter capitalized
+    :param name: the name of a template as written in the wikitext (e.g. " template:citylist\n")
+    :return: the name as a page title without namespace (e.g. "Citylist")
+    """
+    name = _NAME_SPACES.sub(" ", _NAME_COMMENT.sub("", name)).strip()
+    name = _TEMPLATE_NAMESPACE.sub("", name)
+    return name[:1].upper() + name[1:]
+
+
+class TemplateIndex:
+    """
+    ``TemplateIndex``
+
+    The templates of a page by their normalized name (see ``normalize_template_name``):
+    each name is normalized once, then looking up a template doesn't depend on the
+    spacing or the case of the first letter used in the wikitext, nor scans the page.
+    The nodes are the ones of the parsed wikicode, so they can be edited in place.
+
+    Example usage:
+
+    ```python
+    templates = TemplateIndex.from_wikicode(wikicode)
+    quickbar = templates.first("Quickbar")
+    if "MappaDinamica" not in templates:
+        ...
+    ```
+    """
+
+    def __init__(self, templates: Iterable[Template]):
+        self.templates = list(templates)
+        # name -> (position in the page, template), in page order
+        self._by_name = {}  # type: dict[str, list[tuple[int, Template]]]
+        for position, template in enumerate(self.templates):
+            name = normalize_template_name(str(template.name))
+            self._by_name.setdefault(name, []).append((position, template))
+
     @classmethod
-    def get_article_type(cls, page: pywikibot.Page) -> ArticleTypes:
-        cats = page.categories()
-        for cat in cats:
-            cat_title = cat.title(with_ns=False)
-            if cat_title in cls._article_type_lookup:
-                return cls._article_type_lookup[cat_title]
-        raise ValueError(f"Could not find article type for page {page.title()}")
+    def from_wikicode(cls, wikicode: Wikicode) -> "TemplateIndex":
+        return cls(wikicode.filter_templates())
+
+    def get(self, *names: str) -> list[Template]:
+        """
+        :param names: the names of the templates, normalized like the ones of the page
+        :return: the templates with any of the given names, in page order
+        """
+        found = [self._by_name.get(normalize_template_name(name), []) for name in names]
+        return [template for _, template in heapq.merge(*found, key=lambda t: t[0])]
+
+    def first(self, name: str) -> Template | None:
+        """
+        :param name: the name of the template
+        :return: the first template with the given name, or None
+        """
+        found = self._by_name.get(normalize_template_name(name))
+        return found[0][1] if found else None
+
+    def names(self) -> set[str]:
+        """
+        :return: the normalized names of all the templates of the page
+        """
+        return set(self._by_name)
+
+    def __contains__(self, name: str) -> bool:
+        return normalize_template_name(name) in self._by_name
+
+    def __iter__(self) -> Iterator[Template]:
+        return iter(self.templates)
+
+
+def as_template_index(templates: TemplateIndex | Iterable[Template]) -> TemplateIndex:
+    """
+    :param templates: the templates of a page, or their index
+    :return: the index of the templates
+    """
+    if isinstance(templates, TemplateIndex):
+        return templates
+    return TemplateIndex(templates)
+
+
+# The level two sections of the article templates of each type
+STANDARD_SECTIONS = {
+    ArticleTypes.CITY: (
+        "Da sapere",
+        "Come orientarsi",
+        "Come arrivare",
+        "Come spostarsi",
+        "Cosa vedere",
+        "Cosa fare",
+        "Acquisti",
+        "Come divertirsi",
+        "Dove mangiare",
+        "Dove alloggiare",
+        "Sicurezza",
+        "Informazioni utili",
+        "Nei dintorni",
+    ),
+    ArticleTypes.REGION: (
+        "Da sapere",
+        "Territori e mete turistiche",
+        "Come arrivare",
+        "Come spostarsi",
+        "Cosa vedere",
+        "Cosa fare",
+        "A tavola",
+        "Sicurezza",
+        "Informazioni utili",
+    ),
+    ArticleTypes.COUNTRY: (
+        "Da sapere",
+        "Territori e mete turistiche",
+        "Come arrivare",
+        "Come spostarsi",
+        "Cosa vedere",
+        "Cosa fare",
+        "Acquisti",
+        "A tavola",
+        "Sicurezza",
+        "Situazione sanitaria",
+        "Rispettare le usanze",
+        "Come restare in contatto",
+    ),
+    ArticleTypes.DISTRICT: (
+        "Da sapere",
+        "Come orientarsi",
+        "Come arrivare",
+        "Come spostarsi",
+        "Cosa vedere",
+        "Cosa fare",
+        "Acquisti",
+        "Come divertirsi",
+        "Dove mangiare",
+        "Dove alloggiare",
+        "Sicurezza",
+        "Informazioni utili",
+    ),
+    ArticleTypes.PARK: (
+        "Da sapere",
+        "Come arrivare",
+        "Come spostarsi",
+        "Cosa vedere",
+        "Cosa fare",
+        "Dove alloggiare",
+        "Sicurezza",
+        "Informazioni utili",
+        "Nei dintorni",
+    ),
+    ArticleTypes.ARCHEOLOGICAL_SITE: (
+        "Da sapere",
+        "Come arrivare",
+        "Cosa vedere",
+        "Informazioni utili",
+        "Nei dintorni",
+    ),
+}
+
+
+# The parameter patterns never match across lines, so that a whole block of
+# parameters is formatted as if each line was formatted on its own
+_QUICKBAR_PARAMS = re.compile(
+    r"\|[^\S\n]*([^=\n]+?)[^\S\n]*=[^\S\n]*(.*?)[^\S\n]*(?=[|\n]|\Z)"
+)
+_LISTING_PARAMS = re.compile(r"\|[^\S\n]*([^=\n]+)[^\S\n]*=[^\S\n]*(.*?)[^\S\n]*(?=\|)")
+_INLINE_PARAMS = re.compile(r"\|\s*([^=]+)\s*=\s*")
 
 
 def format_quickbar(line):
-    return re.sub(r"\|\s*([^=]+?)\s*=\s*(.*?)\s*(?=\||$)", r"| \1 = \2", line)
+    return _QUICKBAR_PARAMS.sub(lambda m: f"| {m[1]} = {m[2]}", line)
 
 
 def format_listing(line):
-    return re.sub(r"\|\s*([^=]+)\s*=\s*(.*?)\s*(?=[|\n])", r"| \1=\2 ", line)
+    return _LISTING_PARAMS.sub(lambda m: f"| {m[1]}={m[2]} ", line)
 
 
 def format_inline(line):
-    return re.sub(r"\|\s*([^=]+)\s*=\s*", r"| \1=", line.strip())
+    return _INLINE_PARAMS.sub(lambda m: f"| {m[1]}=", line.strip())
+
+
+class TemplateRule(NamedTuple):
+    """How the parameters of a template are formatted"""
+
+    format: Callable[[str], str]
+    inline: bool = False  # format each line, then join them on a single line
+
+
+# Looked up by the lowercase template name: the capitalized names are never matched
+TEMPLATE_FORMAT_RULES = {
+    "quickbarairport": TemplateRule(format_quickbar),
+    "see": TemplateRule(format_listing),
+    "do": TemplateRule(format_listing),
+    "eat": TemplateRule(format_listing),
+    "buy": TemplateRule(format_listing),
+    "sleep": TemplateRule(format_listing),
+    "drink": TemplateRule(format_listing),
+    "listing": TemplateRule(format_listing),
+    "marker": TemplateRule(format_inline, inline=True),
+    "Destinazione": TemplateRule(format_inline, inline=True),
+    "Città": TemplateRule(format_inline, inline=True),
+    "Destinationlist": TemplateRule(format_quickbar),
+    "Regionlist": TemplateRule(format_quickbar),
+    "MappaDinamica": TemplateRule(format_quickbar),
+}
+
+_TEMPLATE_DELIMITERS = re.compile(r"\{\{|\}\}")
+# Stands for a nested template while the parameters of the outer one are formatted
+_NESTED_TEMPLATE = "\ue000{}\ue001"
+_NESTED_TEMPLATES = re.compile("\ue000(\\d+)\ue001")
+
+# (start, end, nested templates) of a template in the text
+_TemplateSpan = tuple[int, int, list]
 
 
 def format_template_params(text):
     """
     Format template parameters in the text for specific templates.
+    The text is scanned once for the template braces; nested templates are formatted
+    on their own and left untouched by the formatting of the outer template.
 
     Args:
         text (str): The wikitext to process.
@@ -67,56 +351,208 @@ def format_template_params(text):
     Returns:
         str: The text with formatted template parameters.
     """
+    output = []
+    position = 0
+    open_templates = []  # type: list[tuple[int, list[_TemplateSpan]]]
+    for delimiter in _TEMPLATE_DELIMITERS.finditer(text):
+        if delimiter.group() == "{{":
+            open_templates.append((delimiter.start(), []))
+        elif open_templates:
+            start, nested = open_templates.pop()
+            template = (start, delimiter.end(), nested)
+            if open_templates:
+                open_templates[-1][1].append(template)
+            else:
+                position = _replace_template(text, template, output, position)
+
+    # templates never closed are left as they are, but not the ones inside them
+    for template in sorted(t for _, nested in open_templates for t in nested):
+        position = _replace_template(text, template, output, position)
+
+    output.append(text[position:])
+    return "".join(output)
+
+
+def _replace_template(
+    text: str, template: _TemplateSpan, output: list[str], position: int
+) -> int:
+    formatted = _format_template(text, template)
+    if formatted is None:
+        return position
+    output.append(text[position : template[0]])
+    output.append(formatted)
+    return template[1]
+
+
+def _format_template(text: str, template: _TemplateSpan) -> str | None:
+    """
+    :return: the formatted template, or None if it's left as it is
+    """
+    start, end, nested = template
+    if not nested:
+        return _format_body(text[start + 2 : end - 2])
+
+    parts = []
+    nested_texts = []
+    position = start + 2
+    changed = False
+    for nested_template in nested:
+        formatted = _format_template(text, nested_template)
+        changed = changed or formatted is not None
+        parts.append(text[position : nested_template[0]])
+        parts.append(_NESTED_TEMPLATE.format(len(nested_texts)))
+        nested_texts.append(
+            formatted
+            if formatted is not None
+            else text[nested_template[0] : nested_template[1]]
+        )
+        position = nested_template[1]
+    parts.append(text[position : end - 2])
+
+    body = "".join(parts)
+    formatted = _format_body(body)
+    if formatted is None:
+        if not changed:
+            return None
+        formatted = "{{" + body + "}}"
+    return _NESTED_TEMPLATES.sub(lambda m: nested_texts[int(m.group(1))], formatted)
+
+
+def _format_body(body: str) -> str | None:
+    name, sep, params = body.partition("|")
+    rule = TEMPLATE_FORMAT_RULES.get(name.strip().lower())
+    if rule is None or not params:
+        return None
+    if rule.inline:
+        lines = (sep + params).split("\n")
+        return "{{" + name.strip() + " " + " ".join(map(rule.format, lines)) + "}}"
+    return "{{" + name.strip() + "\n" + rule.format(sep + params) + "}}"
+
+
+CLEAR_TEMPLATE = "{{-}}"
+# A heading line: the same number of equal signs on both sides of the title,
+# possibly followed by comments (which may span several lines)
+_HEADING = re.compile(
+    r"^(={2,6})(.+?)\1([ \t]*(?:(?s:<!--.*?-->)[ \t]*)*)$", re.MULTILINE
+)
+# Text where "== ... ==" lines are not headings
+_NOT_WIKITEXT = re.compile(
+    r"<!--.*?-->|<nowiki\s*>.*?</nowiki\s*>", re.DOTALL | re.IGNORECASE
+)
+
+
+class Section(NamedTuple):
+    """A heading of the page and the text up to the next heading"""
+
+    level: int  # 0 for the lead section
+    title: str
+    heading: str  # the heading line, without its newline ("" for the lead section)
+    body: str
+    trailer: str = ""  # the end of the heading line after the equal signs (comments)
+
+
+def split_sections(text: str) -> list[Section]:
+    """
+    Split a page into its sections in a single pass over the heading lines, like
+    mwparserfromhell: the heading lines within comments or ``<nowiki>`` are ignored.
+    Joining the headings and bodies of the sections gives back the text.
+    :param text: the wikitext
+    :return: the sections, starting with the lead section
+    """
+    ignored = _get_ignored_spans(text)
+    sections = []
+    level, title, heading, trailer, position = 0, "", "", "", 0
+    for match in _HEADING.finditer(text):
+        name = match.group(2).strip()
+        if not name.strip("=") or _in_spans(match.start(), ignored):
+            continue
+        sections.append(
+            Section(level, title, heading, text[position : match.start()], trailer)
+        )
+        level, title, heading = len(match.group(1)), name, match.group(0)
+        trailer = match.group(3)
+        position = match.end()
+    sections.append(Section(level, title, heading, text[position:], trailer))
+    return sections
 
-    # Define templates and their formatting functions
-    templates = {
-        "quickbarairport": format_quickbar,
-        "see": format_listing,
-        "do": format_listing,
-        "eat": format_listing,
-        "buy": format_listing,
-        "sleep": format_listing,
-        "drink": format_listing,
-        "listing": format_listing,
-        "marker": format_inline,
-        "Destinazione": format_inline,
-        "Città": format_inline,
-        "Destinationlist": format_quickbar,
-        "Regionlist": format_quickbar,
-        "MappaDinamica": format_quickbar,
-    }
 
-    def format_params(match):
-        template_name = match.group(1).strip()
-        format_function = templates.get(template_name.lower())
+def _get_ignored_spans(text: str) -> list[tuple[int, int]]:
+    if "<!--" not in text and "<nowiki" not in text.lower():
+        return []
+    return [match.span() for match in _NOT_WIKITEXT.finditer(text)]
 
-        if not format_function:
-            return match.group(0)
 
-        params = match.group(2)
-        param_lines = params.split("\n")
-        formatted_lines = [format_function(line) for line in param_lines]
+def _in_spans(position: int, spans: list[tuple[int, int]]) -> bool:
+    index = bisect.bisect_right(spans, (position, float("inf"))) - 1
+    return index >= 0 and position < spans[index][1]
 
-        formatted_params = (
-            " ".join(formatted_lines)
-            if format_function == format_inline
-            else "\n".join(formatted_lines)
-        )
-        template_format = (
-            "{{"
-            + template_name
-            + "{}{}".format(
-                "\n" if format_function != format_inline else " ", formatted_params
-            )
-            + "}}"
-        )
-
-        return template_format
 
-    template_pattern = r"\{\{\s*([^}|]+)\s*(\|[^}]+)\}\}"
-    formatted_text = re.sub(template_pattern, format_params, text, flags=re.IGNORECASE)
-
-    return formatted_text
+def format_sections(
+    text: str,
+    normalize_titles: bool = False,
+    terminate_level_two: bool = False,
+    blank_line_after_heading: bool = False,
+    exceptions: Iterable[str] = ("Da sapere",),
+) -> str:
+    """
+    Format the sections of a page, splitting it once into headings and bodies.
+    The level two headings are written as "== title ==" whenever one of the options
+    applies to them.
+    :param text: the wikitext
+    :param normalize_titles: write all the headings as "== title ==", "=== title ===", ...
+    :param terminate_level_two: end the text preceding each level two heading with {{-}}
+                                and one blank line (only the blank line before the
+                                ``exceptions`` headings)
+    :param blank_line_after_heading: leave one blank line between each level two heading
+                                     and its text
+    :param exceptions: titles of the level two sections not preceded by {{-}}
+    :return: the formatted text
+    """
+    exceptions = {exception.lower() for exception in exceptions}
+    sections = split_sections(text)
+    output = []  # type: list[str]
+    for i, section in enumerate(sections):
+        heading = section.heading
+        if section.level and (
+            normalize_titles
+            or section.level == 2
+            and (terminate_level_two or blank_line_after_heading)
+        ):
+            equal_signs = "=" * section.level
+            heading = f"{equal_signs} {section.title} {equal_signs}"
+            heading += section.trailer.rstrip(" \t")
+
+        if terminate_level_two and section.level == 2:
+            _terminate_section(output, section.title.lower() not in exceptions)
+        output.append(heading)
+
+        body = section.body
+        if (
+            blank_line_after_heading
+            and section.level == 2
+            and body.startswith("\n")
+            and not body.startswith("\n\n")
+            and (body.strip() or i < len(sections) - 1)
+        ):
+            body = "\n" + body
+        output.append(body)
+
+    return "".join(output)
+
+
+def _terminate_section(output: list[str], clear: bool) -> None:
+    """
+    End the text written so far with {{-}} (if ``clear``) and one blank line
+    """
+    while output and not output[-1].rstrip("\n"):
+        output.pop()
+    if not output:
+        # nothing precedes the heading
+        return
+    output[-1] = output[-1].rstrip("\n")
+    if clear and not output[-1].endswith(CLEAR_TEMPLATE):
+        output.append("\n" + CLEAR_TEMPLATE)
+    output.append("\n\n")
 
 
 def terminate_before_section_level_two(
@@ -131,43 +567,35 @@ def terminate_before_section_level_two(
     Returns:
         str: The text with {{-}} added before level two sections.
     """
-    section_pattern = r"(.*?)(\n*)(?<!\=)==\s*([^=].*?)\s*==(?!=)"
-
-    def replace_section(match):
-        preceding_text = match.group(1)  # Extract the text preceding the section
-        section_title = match.group(3)  # Extract the section title
+    return format_sections(text, terminate_level_two=True, exceptions=exception)
 
-        # Check if the section title is not "Voli"
-        if section_title.strip().lower() not in [exc.lower() for exc in exception]:
-            # Add {{-}} directly after the preceding text, followed by one newline,
-            return preceding_text + "\n{{-}}\n\n== " + section_title + " =="
-        else:
-            # If the section title is "Voli", return the text without modification
-            return preceding_text + "\n\n== " + section_title + " =="
 
-    # Use the sub() function to replace the matched text with the formatted replacement
-    formatted_text = re.sub(section_pattern, replace_section, text, flags=re.DOTALL)
+def add_banner_image(templates: TemplateIndex | Iterable[Template], image: str):
+    _fill_quickbar_param(templates, "Banner", image)
 
-    return formatted_text
 
+def add_quickbar_image(templates: TemplateIndex | Iterable[Template], image: str):
+    _fill_quickbar_param(templates, "Immagine", image)
 
-def add_banner_image(templates: Iterable[Template], image: str):
-    for template in templates:
-        if template.name.lower() == "Quickbar\n":
-            template.add("Banner", image)
-            break
 
-
-def add_quickbar_image(templates: Iterable[Template], image: str) -> str:
-    for template in templates:
-        if template.name.lower() == "Quickbar\n":
-            template.add("Immagine", image)
-            break
+def _fill_quickbar_param(
+    templates: TemplateIndex | Iterable[Template], param: str, value: str
+):
+    # only a missing or empty parameter is filled: images chosen by the editors are kept
+    template = as_template_index(templates).first("Quickbar")
+    if template is not None and (
+        not template.has(param) or not template.get(param).value.strip()
+    ):
+        template.add(param, value)
 
 
 def add_mappa_dinamica(
-    page_text: Wikicode, templates: Iterable[Template], coords, zoom=8
+    page_text: Wikicode,
+    templates: TemplateIndex | Iterable[Template],
+    coords,
+    zoom=8,
 ):
+    templates = as_template_index(templates)
     # If there is already a dynamic map, ignore the rest
     if _check_mappa_dinamica_exist(templates):
         return
@@ -175,39 +603,38 @@ def add_mappa_dinamica(
     # If there is a region list, just add the dynamic map
     try:
         if not _check_region_list_exist(templates):
-            for template in templates:
+            template = templates.first("Regionlist")
+            if template is not None:
                 try:
-                    if template.name == "Regionlist\n":
-                        template.add(
-                            "regionInteractiveMap",
-                            "map1",
-                            before=template.get("region1name"),
-                        )
-                        template.add(
-                            "regionmapLat",
-                            coords["lat"],
-                            preserve_spacing=True,
-                            before=template.get("region1name"),
-                        )
-                        template.add(
-                            "regionmapLong",
-                            coords["long"],
-                            preserve_spacing=True,
-                            before=template.get("region1name"),
-                        )
-                        template.add(
-                            "regionmapsize",
-                            "450px",
-                            preserve_spacing=True,
-                            before=template.get("region1name"),
-                        )
-                        template.add(
-                            "regionmapZoom",
-                            str(zoom) + "\n\n",
-                            preserve_spacing=True,
-                            before=template.get("region1name"),
-                        )
-                        break
+                    template.add(
+                        "regionInteractiveMap",
+                        "map1",
+                        before=template.get("region1name"),
+                    )
+                    template.add(
+                        "regionmapLat",
+                        coords["lat"],
+                        preserve_spacing=True,
+                        before=template.get("region1name"),
+                    )
+                    template.add(
+                        "regionmapLong",
+                        coords["long"],
+                        preserve_spacing=True,
+                        before=template.get("region1name"),
+                    )
+                    template.add(
+                        "regionmapsize",
+                        "450px",
+                        preserve_spacing=True,
+                        before=template.get("region1name"),
+                    )
+                    template.add(
+                        "regionmapZoom",
+                        str(zoom) + "\n\n",
+                        preserve_spacing=True,
+                        before=template.get("region1name"),
+                    )
                 except:
                     logging.error(
                         "Error adding dynamic map to region list, template: "
@@ -243,25 +670,19 @@ def add_mappa_dinamica(
         logging.error("Error adding dynamic map to page: ")
 
 
-def _check_mappa_dinamica_exist(templates: Iterable[Template]) -> bool:
-    for template in templates:
-        if template.name == "MappaDinamica\n":
-            return True
-    return False
+def _check_mappa_dinamica_exist(templates: TemplateIndex) -> bool:
+    return "MappaDinamica" in templates
 
 
-def _check_region_list_exist(templates: Iterable[Template]) -> bool:
-    for template in templates:
-        if template.name == "Regionlist\n" and not template.has("regionInteractiveMap"):
-            return True
-    return False
+def _check_region_list_exist(templates: TemplateIndex) -> bool:
+    return any(
+        not template.has("regionInteractiveMap")
+        for template in templates.get("Regionlist")
+    )
 
 
 def format_section_begin(text: str) -> str:
-    section_pattern = r"(?<!\=)==\s*([^=].*?)\s*==(?!=)(.*?)\n(?!$)"
-    formatted_text = re.sub(section_pattern, r"== \1 ==\n\2\n", text, flags=re.DOTALL)
-
-    return formatted_text
+    return format_sections(text, blank_line_after_heading=True)
 
 
 def format_section_titles(text):
@@ -274,19 +695,4 @@ def format_section_titles(text):
     Returns:
         str: The text with formatted section titles.
     """
-
-    # Define the regex pattern for matching section titles of all levels
-    section_pattern = r"(={2,})\s*(.*?)\s*\1"
-
-    # Function to format section titles
-    def format_title(match):
-        equal_signs = match.group(1)  # Extract the series of equal signs
-        title = match.group(2).strip()  # Extract and strip the section title
-
-        # Format the section title with spaces between equal signs and the title
-        return f"{equal_signs} {title} {equal_signs}"
-
-    # Use the sub() function to replace the matched text with formatted section titles
-    formatted_text = re.sub(section_pattern, format_title, text)
-
-    return formatted_text
+    return format_sections(text, normalize_titles=True)
@@ -0,0 +1,286 @@
+import bz2
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from typing import IO, Iterable, Iterator
+
+import pywikibot
+from pywikibot import logging
+
+DEFAULT_INDEX_PATH = "cache/wikidata_index.sqlite"
+INDEXED_LANGUAGES = ["it", "en"]
+COMMIT_EVERY = 10_000  # entities per insert batch while building
+
+# Properties used by WikibaseHelper and their datatypes, as found in the json dumps
+INDEXED_PROPERTIES = {
+    "P31": "wikibase-item",  # instance of
+    "P17": "wikibase-item",  # country
+    "P131": "wikibase-item",  # located in the administrative territorial entity
+    "P527": "wikibase-item",  # has part(s)
+    "P625": "globe-coordinate",  # coordinate location
+    "P18": "commonsMedia",  # image
+    "P948": "commonsMedia",  # page banner
+    "P297": "external-id",  # ISO 3166-1 alpha-2 code
+    "P300": "external-id",  # ISO 3166-2 code
+}
+EARTH = "http://www.wikidata.org/entity/Q2"
+
+
+def open_dump(path: str) -> IO[str]:
+    """
+    Open a Wikidata json dump, compressed (.bz2, .gz) or not
+    :param path: the path of the dump
+    :return: the dump as a text stream
+    """
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def iter_dump_entities(stream: Iterable[str]) -> Iterator[dict]:
+    """
+    Stream the entities of a Wikidata json dump, one entity per line
+    (the dump is a json array with one element per line)
+    :param stream: the lines of the dump
+    :return: a generator of entity dictionaries
+    """
+    for line in stream:
+        line = line.strip().rstrip(",")
+        if line in ("", "[", "]"):
+            continue
+        yield json.loads(line)
+
+
+def compact_entity(entity: dict) -> dict | None:
+    """
+    Keep only the facts used by WikibaseHelper: it/en labels and the values of the
+    indexed properties (deprecated statements and unknown/no values are dropped)
+    :param entity: the entity as found in the dump
+    :return: a compact dictionary, or None if the entity has none of these facts
+    """
+    labels = {
+        lang: entity["labels"][lang]["value"]
+        for lang in INDEXED_LANGUAGES
+        if lang in entity.get("labels", {})
+    }
+    claims = {}
+    for prop in INDEXED_PROPERTIES:
+        values = []
+        for claim in entity.get("claims", {}).get(prop, []):
+            snak = claim["mainsnak"]
+            if claim.get("rank") == "deprecated" or snak["snaktype"] != "value":
+                continue
+            value = snak["datavalue"]["value"]
+            if INDEXED_PROPERTIES[prop] == "wikibase-item":
+                values.append(value["id"])
+            elif INDEXED_PROPERTIES[prop] == "globe-coordinate":
+                values.append(
+                    [value["latitude"], value["longitude"], value["precision"]]
+                )
+            else:
+                values.append(value)
+        if values:
+            claims[prop] = values
+
+    if not labels and not claims:
+        return None
+    return {"lastrevid": entity.get("lastrevid", 0), "labels": labels, "claims": claims}
+
+
+def expand_entity(qid: str, facts: dict) -> dict:
+    """
+    Rebuild an entity in the format returned by ``wbgetentities`` from its compact facts,
+    with the datatype in each snak so that pywikibot can read it without further requests
+    :param qid: the id of the entity
+    :param facts: the compact facts, as returned by ``compact_entity``
+    :return: the entity dictionary
+    """
+    claims = {}
+    for prop, values in facts["claims"].items():
+        datatype = INDEXED_PROPERTIES[prop]
+        claims[prop] = []
+        for value in values:
+            if datatype == "wikibase-item":
+                datavalue = {
+                    "type": "wikibase-entityid",
+                    "value": {
+                        "entity-type": "item",
+                        "numeric-id": int(value[1:]),
+                        "id": value,
+                    },
+                }
+            elif datatype == "globe-coordinate":
+                datavalue = {
+                    "type": "globecoordinate",
+                    "value": {
+                        "latitude": value[0],
+                        "longitude": value[1],
+                        "altitude": None,
+                        "precision": value[2],
+                        "globe": EARTH,
+                    },
+                }
+            else:
+                datavalue = {"type": "string", "value": value}
+            claims[prop].append(
+                {
+                    "mainsnak": {
+                        "snaktype": "value",
+                        "property": prop,
+                        "datatype": datatype,
+                        "datavalue": datavalue,
+                    },
+                    "type": "statement",
+                    "rank": "normal",
+                }
+            )
+
+    return {
+        "type": "item",
+        "id": qid,
+        "lastrevid": facts["lastrevid"],
+        "labels": {
+            lang: {"language": lang, "value": value}
+            for lang, value in facts["labels"].items()
+        },
+        "descriptions": {},
+        "aliases": {},
+        "claims": claims,
+        "sitelinks": {},
+    }
+
+
+class WikidataIndex:
+    """
+    ``WikidataIndex``
+
+    Local index of the Wikidata facts used by ``WikibaseHelper``, built from a json dump.
+    Entities are stored as compressed compact json in a SQLite table keyed by the numeric
+    part of the QID (the rowid), so each lookup is a single key access.
+
+    Example usage:
+
+    ```python
+    index = WikidataIndex.build("latest-all.json.bz2")
+    index.get_entity("Q220")
+    ```
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entities (id INTEGER PRIMARY KEY, data BLOB NOT NULL)"
+        )
+        self.connection.commit()
+
+    @classmethod
+    def build(cls, dump_path: str, path: str = DEFAULT_INDEX_PATH) -> "WikidataIndex":
+        """
+        Build (or update) the index from a dump, streaming it in constant memory
+        :param dump_path: the path of the json dump (.json, .json.bz2 or .json.gz)
+        :param path: the path of the index
+        :return: the index
+        """
+        index = cls(path)
+        with open_dump(dump_path) as stream:
+            index.add_entities(iter_dump_entities(stream))
+        return index
+
+    def add_entities(self, entities: Iterable[dict]) -> int:
+        """
+        Add the items among the given entities to the index
+        :param entities: entity dictionaries, as found in the dump
+        :return: the number of entities indexed
+        """
+        indexed = 0
+        rows = []
+        with self._lock:
+            self.connection.execute("PRAGMA synchronous = OFF")
+            for entity in entities:
+                if entity.get("type") != "item":
+                    continue
+                facts = compact_entity(entity)
+                if facts is None:
+                    continue
+                data = zlib.compress(json.dumps(facts, separators=(",", ":")).encode())
+                rows.append((int(entity["id"][1:]), data))
+                if len(rows) >= COMMIT_EVERY:
+                    indexed += self._insert(rows)
+                    logging.info(f"Indexed {indexed} entities")
+                    rows = []
+            indexed += self._insert(rows)
+            self.connection.execute("PRAGMA synchronous = FULL")
+        return indexed
+
+    def _insert(self, rows: list[tuple[int, bytes]]) -> int:
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO entities VALUES (?, ?)", rows
+        )
+        self.connection.commit()
+        return len(rows)
+
+    def get_facts(self, qid: str) -> dict | None:
+        """
+        :param qid: the id of the item (e.g. "Q220")
+        :return: the compact facts of the item, or None if it's not in the index
+        """
+        if not qid or qid[0] != "Q" or not qid[1:].isdigit():
+            return None
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT data FROM entities WHERE id = ?", (int(qid[1:]),)
+            ).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def get_entity(self, qid: str) -> dict | None:
+        """
+        :param qid: the id of the item (e.g. "Q220")
+        :return: the item in the ``wbgetentities`` format, or None if it's not in the index
+        """
+        facts = self.get_facts(qid)
+        return expand_entity(qid, facts) if facts is not None else None
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def main():
+    """
+    Build the index from a dump:
+
+    -dump:<path> - the Wikidata json dump (.json, .json.bz2 or .json.gz)
+    -index:<path> - where to write the index (default: cache/wikidata_index.sqlite)
+    """
+    args = pywikibot.handle_args()
+    dump_path = None
+    index_path = DEFAULT_INDEX_PATH
+
+    if any(arg.startswith("-dump") for arg in args):
+        dump_path = args[[arg.startswith("-dump") for arg in args].index(True)].split(
+            ":", 1
+        )[1]
+
+    if any(arg.startswith("-index") for arg in args):
+        index_path = args[[arg.startswith("-index") for arg in args].index(True)].split(
+            ":", 1
+        )[1]
+
+    if dump_path is None:
+        raise ValueError("No dump specified, Use -dump:path/to/latest-all.json.bz2")
+
+    index = WikidataIndex.build(dump_path, index_path)
+    (count,) = index.connection.execute("SELECT COUNT(*) FROM entities").fetchone()
+    pywikibot.output(f"Index {index_path} contains {count} entities")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
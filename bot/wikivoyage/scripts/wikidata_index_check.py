@@ -0,0 +1,192 @@
+"""
+Offline checks of ``wikidata_index``: a small synthetic Wikidata json dump is written
+to a temporary directory, the index is built from it and queried, without any network
+access.
+
+Run from the scripts directory:
+
+    python wikidata_index_check.py
+"""
+
+import bz2
+import gzip
+import json
+import os
+import tempfile
+from typing import Any
+
+import wikidata_index
+from wikidata_index import WikidataIndex, compact_entity, open_dump
+
+
+def snak(prop: str, datatype: str, value: Any, snaktype: str = "value") -> dict:
+    if snaktype != "value":
+        return {"snaktype": snaktype, "property": prop, "datatype": datatype}
+    if datatype == "wikibase-item":
+        datavalue = {
+            "type": "wikibase-entityid",
+            "value": {"entity-type": "item", "numeric-id": int(value[1:]), "id": value},
+        }
+    elif datatype == "globe-coordinate":
+        latitude, longitude, precision = value
+        datavalue = {
+            "type": "globecoordinate",
+            "value": {
+                "latitude": latitude,
+                "longitude": longitude,
+                "altitude": None,
+                "precision": precision,
+                "globe": wikidata_index.EARTH,
+            },
+        }
+    else:
+        datavalue = {"type": "string", "value": value}
+    return {
+        "snaktype": "value",
+        "property": prop,
+        "datatype": datatype,
+        "datavalue": datavalue,
+    }
+
+
+def claim(prop: str, datatype: str, value: Any, **kwargs: Any) -> dict:
+    rank = kwargs.pop("rank", "normal")
+    return {
+        "mainsnak": snak(prop, datatype, value, **kwargs),
+        "type": "statement",
+        "rank": rank,
+    }
+
+
+def item(qid: str, labels: dict[str, str], claims: list[dict], **fields: Any) -> dict:
+    entity = {
+        "type": "item",
+        "id": qid,
+        "lastrevid": 1000 + int(qid[1:]),
+        "labels": {lang: {"language": lang, "value": v} for lang, v in labels.items()},
+        "descriptions": {"it": {"language": "it", "value": "not indexed"}},
+        "claims": {},
+        "sitelinks": {"itwiki": {"site": "itwiki", "title": "not indexed"}},
+    }
+    for c in claims:
+        entity["claims"].setdefault(c["mainsnak"]["property"], []).append(c)
+    entity.update(fields)
+    return entity
+
+
+ENTITIES = [
+    item(
+        "Q220",
+        {"it": "Roma", "en": "Rome", "fr": "Rome"},
+        [
+            claim("P31", "wikibase-item", "Q515"),
+            claim("P31", "wikibase-item", "Q5119"),
+            claim("P17", "wikibase-item", "Q38"),
+            claim("P17", "wikibase-item", "Q172579", rank="deprecated"),
+            claim("P625", "globe-coordinate", (41.893, 12.483, 0.001)),
+            claim("P18", "commonsMedia", "Colosseo 2020.jpg"),
+            claim("P948", "commonsMedia", None, snaktype="novalue"),
+            claim("P1082", "quantity", "+2748109"),  # not indexed
+        ],
+    ),
+    item("Q38", {"it": "Italia"}, [claim("P297", "external-id", "IT")]),
+    # only facts that are not indexed: left out of the index
+    item("Q99", {"fr": "Rien"}, [claim("P1082", "quantity", "+1")]),
+    {"type": "property", "id": "P31", "labels": {"it": {"value": "istanza di"}}},
+]
+
+EXPECTED_FACTS = {
+    "Q220": {
+        "lastrevid": 1220,
+        "labels": {"it": "Roma", "en": "Rome"},
+        "claims": {
+            "P31": ["Q515", "Q5119"],
+            "P17": ["Q38"],
+            "P625": [[41.893, 12.483, 0.001]],
+            "P18": ["Colosseo 2020.jpg"],
+        },
+    },
+    "Q38": {"lastrevid": 1038, "labels": {"it": "Italia"}, "claims": {"P297": ["IT"]}},
+}
+
+
+def write_dump(path: str, entities: list[dict]) -> None:
+    """
+    Write the entities like the Wikidata json dumps: an array with one entity per line
+    """
+    opener = {".bz2": bz2.open, ".gz": gzip.open}.get(os.path.splitext(path)[1], open)
+    with opener(path, "wt", encoding="utf-8") as f:
+        f.write("[\n")
+        f.write(",\n".join(json.dumps(entity) for entity in entities))
+        f.write("\n]\n")
+
+
+def check_build(directory: str, extension: str) -> None:
+    dump_path = os.path.join(directory, f"latest-all.json{extension}")
+    index_path = os.path.join(directory, f"index{extension}.sqlite")
+    write_dump(dump_path, ENTITIES)
+
+    index = WikidataIndex.build(dump_path, index_path)
+    (count,) = index.connection.execute("SELECT COUNT(*) FROM entities").fetchone()
+    assert count == len(EXPECTED_FACTS), count
+    for qid, facts in EXPECTED_FACTS.items():
+        assert index.get_facts(qid) == facts, index.get_facts(qid)
+    for qid in ("Q99", "P31", "Q1", "", "Qx", "L1"):
+        assert index.get_facts(qid) is None and index.get_entity(qid) is None, qid
+    index.close()
+
+
+def check_entity(directory: str) -> None:
+    """
+    The entities rebuilt from the index have the format of ``wbgetentities`` and keep
+    all the indexed facts
+    """
+    index = WikidataIndex(os.path.join(directory, "index.sqlite"))
+    entity = index.get_entity("Q220")
+    assert entity["id"] == "Q220" and entity["lastrevid"] == 1220
+    assert entity["labels"]["it"] == {"language": "it", "value": "Roma"}
+    mainsnak = entity["claims"]["P17"][0]["mainsnak"]
+    assert mainsnak["datatype"] == "wikibase-item"
+    assert mainsnak["datavalue"]["value"]["numeric-id"] == 38
+    coordinate = entity["claims"]["P625"][0]["mainsnak"]["datavalue"]["value"]
+    assert coordinate["globe"] == wikidata_index.EARTH
+    for qid, facts in EXPECTED_FACTS.items():
+        assert compact_entity(index.get_entity(qid)) == facts
+    index.close()
+
+
+def check_update(directory: str) -> None:
+    """
+    Building again from a newer dump replaces the entities, in several insert batches
+    """
+    index_path = os.path.join(directory, "index.sqlite")
+    dump_path = os.path.join(directory, "newer.json")
+    newer = item("Q38", {"it": "Italia", "en": "Italy"}, [], lastrevid=2000)
+    extra = [item(f"Q{i}", {"it": f"Voce {i}"}, []) for i in range(1000, 1005)]
+    write_dump(dump_path, [newer, *extra])
+
+    wikidata_index.COMMIT_EVERY = 2
+    index = WikidataIndex.build(dump_path, index_path)
+    assert index.get_facts("Q38") == {
+        "lastrevid": 2000,
+        "labels": {"it": "Italia", "en": "Italy"},
+        "claims": {},
+    }
+    assert index.get_facts("Q220") == EXPECTED_FACTS["Q220"]
+    assert all(index.get_facts(f"Q{i}") for i in range(1000, 1005))
+    index.close()
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        for extension in ("", ".bz2", ".gz"):
+            check_build(directory, extension)
+        with open_dump(os.path.join(directory, "latest-all.json.gz")) as stream:
+            assert stream.readline() == "[\n"
+        check_entity(directory)
+        check_update(directory)
+    print("Wikidata index: all checks passed")
+
+
+if __name__ == "__main__":
+    main()